@@ -0,0 +1,252 @@
+import asyncio
+import email.utils
+import hashlib
+import math
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+from events import Queued
+
+class AdmissionRejected(Exception):
+    """The wait queue is full or the request waited too long; retry after ``retry_after`` seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Requests-per-second limiter that allows bursts of up to ``burst`` requests.
+
+    A ``rate`` of 0 means unlimited. ``block`` pauses the bucket regardless of
+    its tokens (used when upstream answers 429 with Retry-After).
+    """
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a request may go (0 = now)"""
+        now = self.clock()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self._refill(self.clock())
+            self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+
+    @property
+    def idle(self) -> bool:
+        """Full and not blocked, i.e. indistinguishable from a new bucket"""
+        now = self.clock()
+        self._refill(now)
+        return now >= self.blocked_until and (self.rate <= 0 or self.tokens >= self.burst)
+
+def client_id(api_key: str) -> str:
+    """Stable identifier of an upstream API key that does not reveal it"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class AdmissionController:
+    """Admit upstream calls under a global and a per-key token bucket.
+
+    Calls that cannot go right away wait in one FIFO queue per key, and keys
+    are served round-robin, so a user sending many requests cannot hold up
+    others. At most ``max_queue`` calls wait at once and none longer than
+    ``max_wait`` seconds; both raise AdmissionRejected. ``backoff`` records
+    an upstream 429/503 and pauses the key for its Retry-After, with jitter,
+    so queued calls for that key stop hitting upstream.
+    """
+
+    def __init__(
+        self,
+        rate: float = 0.0,
+        burst: float = 10.0,
+        key_rate: float = 0.0,
+        key_burst: float = 5.0,
+        max_queue: int = 256,
+        max_wait: float = 30.0,
+        retry_base: float = 0.5,
+        jitter: float = 0.25,
+        progress_interval: float = 1.0,
+        max_keys: int = 4096,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.clock = clock
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_base = retry_base
+        self.jitter = jitter
+        self.progress_interval = progress_interval
+        self.max_keys = max_keys
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._waiting = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.retries = 0
+        self.wait_time = 0.0
+        self.max_wait_seen = 0.0
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                for idle in [k for k, b in self._buckets.items() if b.idle and k not in self._queues]:
+                    del self._buckets[idle]
+            bucket = self._buckets[key] = TokenBucket(self.key_rate, self.key_burst, self.clock)
+        return bucket
+
+    @property
+    def saturated(self) -> bool:
+        return self._waiting >= self.max_queue
+
+    def retry_after(self) -> float:
+        """Rough time for the current queue to drain, for Retry-After on rejections"""
+        if self.bucket.rate > 0:
+            return max(1.0, self._waiting / self.bucket.rate)
+        return 1.0
+
+    def _position(self, key: str, future: "asyncio.Future") -> int:
+        """Place in line under round-robin: each other key gets one turn per turn of ours"""
+        queue = self._queues.get(key)
+        if not queue or future not in queue:
+            return 0
+        ahead = queue.index(future)
+        return ahead + 1 + sum(min(len(other), ahead + 1) for k, other in self._queues.items() if k != key)
+
+    def _dispatch(self):
+        """Admit queued calls round-robin across keys while both buckets allow, then sleep until the next can go"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        next_try = math.inf
+        progress = True
+        while progress and self._queues:
+            progress = False
+            for key in list(self._queues):
+                queue = self._queues[key]
+                while queue and queue[0].done():
+                    # Given up (timed out or disconnected) while waiting
+                    queue.popleft()
+                if not queue:
+                    del self._queues[key]
+                    continue
+                delay = max(self.bucket.delay(), self._bucket(key).delay())
+                if delay > 0:
+                    next_try = min(next_try, delay)
+                    continue
+                self.bucket.take()
+                self._bucket(key).take()
+                queue.popleft().set_result(None)
+                self._waiting -= 1
+                progress = True
+                if queue:
+                    self._queues.move_to_end(key)
+                else:
+                    del self._queues[key]
+        if self._queues and next_try < math.inf:
+            self._timer = asyncio.get_running_loop().call_later(next_try, self._dispatch)
+
+    async def admit(self, key: str, timeout: Optional[float] = None) -> AsyncIterator[Queued]:
+        """Wait for a turn, yielding Queued every ``progress_interval`` seconds while waiting"""
+        if not self._queues and self.bucket.delay() == 0 and self._bucket(key).delay() == 0:
+            self.bucket.take()
+            self._bucket(key).take()
+            self.admitted += 1
+            return
+        if self.saturated:
+            self.rejected += 1
+            raise AdmissionRejected("Upstream is busy: too many requests waiting", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(future)
+        self._waiting += 1
+        self.queued += 1
+        started = self.clock()
+        limit = self.max_wait if timeout is None else min(self.max_wait, timeout)
+        try:
+            self._dispatch()
+            while not future.done():
+                waited = self.clock() - started
+                if waited >= limit:
+                    self.rejected += 1
+                    raise AdmissionRejected(f"Upstream is busy: no capacity within {limit:.0f}s", self.retry_after())
+                yield Queued(self._position(key, future), self._waiting, round(waited, 1))
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), min(self.progress_interval, limit - waited))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if not future.done():
+                future.cancel()
+                self._waiting -= 1
+                self._dispatch()
+        waited = self.clock() - started
+        self.admitted += 1
+        self.wait_time += waited
+        self.max_wait_seen = max(self.max_wait_seen, waited)
+
+    async def acquire(self, key: str, timeout: Optional[float] = None):
+        """``admit`` for callers that cannot report progress"""
+        async for _ in self.admit(key, timeout):
+            pass
+
+    def backoff(self, key: str, retry_after: Optional[float], attempt: int) -> float:
+        """Pause ``key`` after an upstream 429/503 and return the delay before retrying.
+
+        Retry-After is honoured when given; otherwise the delay grows
+        exponentially from ``retry_base``. Jitter spreads the retries of
+        requests that were rejected together.
+        """
+        self.retries += 1
+        delay = retry_after if retry_after is not None else self.retry_base * 2 ** attempt
+        delay *= 1 + random.uniform(0, self.jitter)
+        self._bucket(key).block(delay)
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "waiting": self._waiting,
+            "rejected": self.rejected,
+            "upstream_retries": self.retries,
+            "avg_wait_seconds": round(self.wait_time / self.queued, 3) if self.queued else 0.0,
+            "max_wait_seconds": round(self.max_wait_seen, 3),
+        }
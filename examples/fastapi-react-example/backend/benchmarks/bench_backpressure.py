@@ -0,0 +1,94 @@
+"""Measure how a slow client keeps up with a stream, with and without latest-wins coalescing.
+
+A synthetic response (diffusion frames from ``bench_frames`` or streaming
+deltas) is encoded once and read through ``ReplayStream.read`` by a client
+whose link drains ``--bandwidth`` bytes/s plus ``--write-cost`` seconds per
+write. Reports writes and bytes sent, how long after generation finished
+the client got ``[DONE]`` (lag), and checks the client rebuilt the final text.
+
+    python benchmarks/bench_backpressure.py --tokens 200 800 --bandwidth 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_frames import synthetic_frames  # noqa: E402
+from disconnect import StreamStats  # noqa: E402
+from events import DiffusionFrame, Done, TextDelta  # noqa: E402
+from protocol import DELTA, SNAPSHOT, EventEncoder, apply_spans  # noqa: E402
+from resume import ReplayStream  # noqa: E402
+
+def decode(body: bytes) -> str:
+    text = ""
+    for line in body.decode().splitlines():
+        if not line.startswith("data: ") or line == "data: [DONE]":
+            continue
+        payload = json.loads(line[6:])
+        if "patch" in payload:
+            text = apply_spans(text, [tuple(op) for op in payload["patch"]])
+        elif "delta" in payload:
+            text += payload["delta"]
+        else:
+            text = payload["content"]
+    return text
+
+async def run(events: List, interval: float, protocol: str, coalesce: bool, bandwidth: float, write_cost: float) -> Tuple[int, int, float, str]:
+    encoder = EventEncoder(protocol)
+    finished = 0.0
+
+    async def chunks():
+        nonlocal finished
+        for event in events:
+            line = encoder.encode(event)
+            if line:
+                yield line.encode()
+            if interval:
+                await asyncio.sleep(interval)
+        yield encoder.encode(Done()).encode()
+        finished = time.perf_counter()
+
+    stats = StreamStats()
+    stream = ReplayStream("bench", chunks(), 64 * 1024 * 1024, stats, lambda: 0, protocol, encoder, coalesce)
+    writes = 0
+    received = bytearray()
+    async for data in stream.read():
+        writes += 1
+        received += data
+        await asyncio.sleep(write_cost + len(data) / bandwidth)
+    lag = time.perf_counter() - finished
+    await stream.task
+    return writes, len(received), lag, decode(bytes(received))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, nargs="+", default=[200, 800])
+    parser.add_argument("--steps", type=int, default=32, help="diffusion frames per response")
+    parser.add_argument("--frame-interval", type=float, default=0.02, help="seconds between generated frames")
+    parser.add_argument("--token-interval", type=float, default=0.001, help="seconds between generated streaming deltas")
+    parser.add_argument("--bandwidth", type=float, default=100_000, help="client bytes/second")
+    parser.add_argument("--write-cost", type=float, default=0.002, help="client seconds per write")
+    args = parser.parse_args()
+
+    print(f"{'mode':>10} {'protocol':>9} {'tokens':>7} {'events':>7} {'coalesce':>9} {'writes':>7} {'KB sent':>8} {'lag ms':>8} {'final ok':>9}")
+    for n_tokens in args.tokens:
+        frames = synthetic_frames(n_tokens, args.steps)
+        words = [word + " " for word in frames[-1].split(" ") if word]
+        runs = (
+            ("diffusing", [DiffusionFrame(frame) for frame in frames], args.frame_interval, frames[-1]),
+            ("streaming", [TextDelta(word) for word in words], args.token_interval, "".join(words)),
+        )
+        for mode, events, interval, final in runs:
+            for protocol in (SNAPSHOT, DELTA):
+                for coalesce in (False, True):
+                    writes, sent, lag, text = asyncio.run(run(events, interval, protocol, coalesce, args.bandwidth, args.write_cost))
+                    print(f"{mode:>10} {protocol:>9} {n_tokens:>7} {len(events):>7} {str(coalesce):>9} {writes:>7} "
+                          f"{sent / 1024:>8.0f} {lag * 1000:>8.0f} {str(text == final):>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Compare bytes/frame of snapshot vs. patch encoding for diffusing mode.
+
+Generates synthetic denoising runs (noisy tokens resolve to the final
+answer roughly left to right, unresolved tokens are re-sampled with
+probability ``--churn`` per step) and feeds every frame through
+``FrameEncoder`` in both protocols.
+
+    python benchmarks/bench_frames.py --tokens 200 800 3000 --steps 32 --churn 0.3
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from protocol import DELTA, SNAPSHOT, FrameEncoder, apply_spans  # noqa: E402
+
+WORDS = ("the model diffusion token answer quantum network latency stream frame "
+         "python server client request search result update context cache value "
+         "state **bold** `code` - 1. 2. 3. data graph energy system").split()
+
+def synthetic_frames(n_tokens: int, steps: int, churn: float = 0.3, seed: int = 0) -> List[str]:
+    """Frames of a denoising run that converges to a fixed answer"""
+    rng = random.Random(seed)
+    target = [rng.choice(WORDS) + ("\n\n" if rng.random() < 0.05 else " ") for _ in range(n_tokens)]
+    noise = [rng.choice(WORDS) + " " for _ in range(n_tokens)]
+    resolved = [False] * n_tokens
+    frames = []
+    for step in range(1, steps + 1):
+        # Resolve a left-biased slice of the remaining tokens
+        horizon = int(n_tokens * min(1.0, step / (steps * 0.8)))
+        for i in range(n_tokens):
+            if not resolved[i] and (i < horizon or rng.random() < 0.05):
+                resolved[i] = rng.random() < 0.6 or i < horizon - n_tokens // 10
+        if step == steps:
+            resolved = [True] * n_tokens
+        for i in range(n_tokens):
+            if not resolved[i] and rng.random() < churn:
+                noise[i] = rng.choice(WORDS) + " "
+        frames.append("".join(tok if done else noise[i] for i, (tok, done) in enumerate(zip(target, resolved))))
+    return frames
+
+def run(frames: List[str], protocol: str):
+    encoder = FrameEncoder(protocol)
+    sizes = []
+    start = time.perf_counter()
+    lines = []
+    for frame in frames:
+        line = encoder.encode(frame)
+        if line:
+            lines.append(line)
+            sizes.append(len(line.encode("utf-8")))
+    elapsed = time.perf_counter() - start
+    return sizes, elapsed, lines
+
+def decode(lines: List[str]) -> str:
+    text = ""
+    for line in lines:
+        payload = json.loads(line[6:])
+        if "patch" in payload:
+            text = apply_spans(text, [tuple(op) for op in payload["patch"]])
+        else:
+            text = payload["content"]
+    return text
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, nargs="+", default=[200, 800, 3000])
+    parser.add_argument("--steps", type=int, default=32)
+    parser.add_argument("--churn", type=float, default=0.3, help="per-step re-sample probability of unresolved tokens")
+    args = parser.parse_args()
+
+    print(f"{'tokens':>7} {'frames':>7} {'snapshot B/frame':>17} {'patch B/frame':>14} {'ratio':>7} {'encode ms/frame':>16}")
+    for n_tokens in args.tokens:
+        frames = synthetic_frames(n_tokens, args.steps, args.churn)
+        snap_sizes, _, _ = run(frames, SNAPSHOT)
+        patch_sizes, elapsed, lines = run(frames, DELTA)
+        assert decode(lines) == frames[-1], "patch stream did not reproduce the final frame"
+        snap = sum(snap_sizes) / len(frames)
+        patch = sum(patch_sizes) / len(frames)
+        print(f"{n_tokens:>7} {len(frames):>7} {snap:>17.0f} {patch:>14.0f} {snap / patch:>6.1f}x {elapsed * 1000 / len(frames):>16.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Measure the hot-path cost of the /metrics instrumentation.
+
+Reports nanoseconds per recording call, then relays a synthetic completion
+stream through ``relay_completion`` with and without a ``StreamMeter`` (the
+per-chunk hook used on every upstream stream) and prints the overhead per
+chunk and per stream, and the time to render ``/metrics`` for a scrape.
+
+    python benchmarks/bench_metrics.py --chunks 2000 --repeat 7
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import metrics  # noqa: E402
+from bench_sse import synthetic_stream  # noqa: E402
+from main import relay_completion  # noqa: E402
+from sse_parser import Chunk, iter_chunks  # noqa: E402
+
+def per_call(fn: Callable[[], None], calls: int, repeat: int) -> float:
+    """Best-of-``repeat`` nanoseconds per call"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best / calls * 1e9
+
+async def relay(chunks: List[Chunk], diffusing: bool, metered: bool) -> int:
+    async def source():
+        for chunk in chunks:
+            yield chunk
+    meter = metrics.StreamMeter("diffusing" if diffusing else "streaming") if metered else None
+    if meter:
+        meter.send()
+        meter.response(200)
+    count = 0
+    async for _ in relay_completion(source(), diffusing, None, None, meter):
+        count += 1
+    if meter:
+        meter.close()
+    return count
+
+def stream_seconds(chunks: List[Chunk], diffusing: bool, metered: bool, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        asyncio.run(relay(chunks, diffusing, metered))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2000, help="completion chunks per synthetic stream")
+    parser.add_argument("--calls", type=int, default=200000, help="calls per micro-benchmark")
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    counter = metrics.CHAT_REQUESTS.labels("streaming", "completed")
+    histogram = metrics.UPSTREAM_TTFT.labels("streaming")
+    meter = metrics.StreamMeter("streaming")
+    meter.send()
+    print(f"{'operation':>32} {'ns/call':>9}")
+    for name, fn in (
+        ("counter.inc (bound)", lambda: counter.inc()),
+        ("counter.labels(...).inc", lambda: metrics.CHAT_REQUESTS.labels("streaming", "completed").inc()),
+        ("histogram.observe (bound)", lambda: histogram.observe(0.123)),
+        ("histogram.labels(...).observe", lambda: metrics.UPSTREAM_TTFT.labels("streaming").observe(0.123)),
+        ("StreamMeter.output", lambda: meter.output(4)),
+    ):
+        print(f"{name:>32} {per_call(fn, args.calls, args.repeat):>9.0f}")
+
+    print()
+    print(f"{'mode':>10} {'chunks':>7} {'bare ms':>9} {'metered ms':>11} {'ns/chunk':>9} {'overhead':>9}")
+    for diffusing in (False, True):
+        chunks = [chunk for chunk in iter_chunks([synthetic_stream(args.chunks, diffusing)]) if not chunk.done]
+        bare = stream_seconds(chunks, diffusing, False, args.repeat)
+        metered = stream_seconds(chunks, diffusing, True, args.repeat)
+        mode = "diffusing" if diffusing else "streaming"
+        extra = max(metered - bare, 0.0)
+        print(f"{mode:>10} {len(chunks):>7} {bare * 1000:>9.2f} {metered * 1000:>11.2f} "
+              f"{extra / len(chunks) * 1e9:>9.0f} {extra / bare:>8.1%}")
+
+    start = time.perf_counter()
+    text = metrics.REGISTRY.render()
+    print(f"\n/metrics render: {(time.perf_counter() - start) * 1000:.2f} ms for {text.count(chr(10))} lines")
+
+if __name__ == "__main__":
+    main()
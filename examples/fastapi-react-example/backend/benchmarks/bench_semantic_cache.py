@@ -0,0 +1,118 @@
+"""Precision/recall of near-duplicate search query matching per similarity threshold.
+
+Scores a labelled set of query pairs (same search intent or not) with the
+``MinHashIndex`` used by the search cache. For each threshold it reports
+precision and recall of "served from cache" decisions, and the hit rate on
+a replayed query stream where the first query of each intent fetches and
+later paraphrases may hit. Use it to tune ``SEMANTIC_CACHE_THRESHOLD``.
+
+    python benchmarks/bench_semantic_cache.py --thresholds 0.4 0.5 0.6 0.7 0.8
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from semantic_index import MinHashIndex  # noqa: E402
+
+# Each group is one search intent; queries in different groups must not share results
+INTENTS = [
+    ["latest news AI", "AI latest news today", "latest AI news", "news about AI latest", "what is the latest news in AI"],
+    ["weather in Paris tomorrow", "Paris weather tomorrow", "tomorrow's weather Paris", "weather forecast Paris tomorrow"],
+    ["weather in London tomorrow", "London weather tomorrow", "London weather forecast tomorrow"],
+    ["python 3.13 release notes", "Python 3.13 release notes", "release notes for python 3.13", "what's new in python 3.13 release"],
+    ["python 3.12 release notes", "release notes python 3.12"],
+    ["bitcoin price today", "current bitcoin price", "price of bitcoin today", "BTC bitcoin price now"],
+    ["ethereum price today", "current ethereum price"],
+    ["who won the 2024 world series", "2024 world series winner", "world series 2024 champion winner"],
+    ["who won the 2023 world series", "2023 world series winner"],
+    ["best laptops for programming 2025", "best programming laptops 2025", "top laptops for programmers 2025"],
+    ["how to cook rice in a pressure cooker", "pressure cooker rice how to cook", "cooking rice in pressure cooker"],
+    ["nvidia stock earnings", "NVIDIA earnings stock", "nvidia quarterly earnings stock"],
+    ["tesla stock earnings", "Tesla earnings stock"],
+    ["symptoms of vitamin d deficiency", "vitamin D deficiency symptoms", "signs and symptoms of low vitamin d deficiency"],
+    ["fastapi streaming response example", "FastAPI StreamingResponse example", "example of streaming response in fastapi"],
+    ["react useEffect cleanup function", "useEffect cleanup react", "cleanup function in react useEffect"],
+    ["diffusion language models", "diffusion LLMs language models", "language models based on diffusion"],
+    ["inception labs mercury model", "mercury coder inception labs", "Inception Labs Mercury"],
+    ["SpaceX starship launch date", "next starship launch SpaceX date"],
+    ["NASA artemis launch date", "artemis launch date NASA"],
+    # Different entities that share most shingles; serving one's results for the other is wrong
+    ["covid cases in India", "India covid cases"],
+    ["covid cases in Indiana", "Indiana covid cases"],
+    ["best restaurants in New York", "New York best restaurants"],
+    ["best restaurants in New Jersey", "New Jersey best restaurants"],
+    ["tesla news", "news about tesla"],
+    ["tesla recall news", "news on tesla recall"],
+]
+
+def labelled_pairs():
+    pairs = []
+    for i, group in enumerate(INTENTS):
+        for a in range(len(group)):
+            for b in range(a + 1, len(group)):
+                pairs.append((group[a], group[b], True))
+        for other in INTENTS[i + 1:]:
+            for query in group:
+                for other_query in other:
+                    pairs.append((query, other_query, False))
+    return pairs
+
+def pair_scores(pairs, index: MinHashIndex):
+    """Similarity the index assigns to each pair (0 when LSH does not even propose the candidate)"""
+    scores = []
+    for a, b, same in pairs:
+        probe = MinHashIndex(index.threshold, index.bands, index.rows)
+        probe.add("a", "", a)
+        _, score = probe.best_match("", b)
+        scores.append((score, same))
+    return scores
+
+def stream_hit_rate(threshold: float, bands: int, rows: int):
+    """Replay every intent's queries in order; returns (hit rate, wrong hits)"""
+    index = MinHashIndex(threshold, bands, rows)
+    intent_of = {}
+    hits = wrong = lookups = 0
+    for round_ in range(max(len(group) for group in INTENTS)):
+        for intent, group in enumerate(INTENTS):
+            if round_ >= len(group):
+                continue
+            query = group[round_]
+            lookups += 1
+            match = index.lookup("", query)
+            if match is not None:
+                hits += 1
+                wrong += intent_of[match[0]] != intent
+            else:
+                key = f"{intent}:{round_}"
+                intent_of[key] = intent
+                index.add(key, "", query)
+    return hits / lookups, wrong
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.4, 0.5, 0.6, 0.7, 0.8])
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--rows", type=int, default=4)
+    args = parser.parse_args()
+
+    pairs = labelled_pairs()
+    start = time.perf_counter()
+    scores = pair_scores(pairs, MinHashIndex(0.0, args.bands, args.rows))
+    per_pair = (time.perf_counter() - start) / len(pairs)
+    positives = sum(same for _, same in scores)
+    print(f"{len(pairs)} labelled pairs ({positives} duplicates), {per_pair * 1e6:.0f}us per add+lookup")
+    print(f"{'threshold':>9} {'precision':>9} {'recall':>7} {'f1':>6} {'hit rate':>9} {'wrong hits':>10}")
+    for threshold in args.thresholds:
+        tp = sum(1 for score, same in scores if same and score >= threshold)
+        fp = sum(1 for score, same in scores if not same and score >= threshold)
+        precision = tp / (tp + fp) if tp + fp else 1.0
+        recall = tp / positives if positives else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        hit_rate, wrong = stream_hit_rate(threshold, args.bands, args.rows)
+        print(f"{threshold:>9.2f} {precision:>9.3f} {recall:>7.3f} {f1:>6.3f} {hit_rate:>9.1%} {wrong:>10}")
+
+if __name__ == "__main__":
+    main()
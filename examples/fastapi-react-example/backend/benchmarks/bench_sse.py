@@ -0,0 +1,141 @@
+"""Compare chunks/sec of the shared SSE parser against the old per-line loop.
+
+Builds a synthetic Inception completion stream (streaming deltas or full
+diffusion frames), splits it into network-sized byte chunks and parses it
+with:
+
+- ``legacy``: ``iter_lines()`` -> ``startswith('data: ')`` -> ``json.loads``, as the endpoints used to do
+- ``parser/json``: ``iter_chunks`` with the stdlib decoder, decoding only ``choices[0].delta``
+- ``parser/orjson``: ``iter_chunks`` with orjson (when installed)
+
+Before timing, every variant is checked against a full parse on unusual
+chunk layouts (``EDGE_CASES``), such as ``finish_reason`` before ``delta``.
+
+    python benchmarks/bench_sse.py --chunks 5000 --read-size 1024 4096
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, Iterable, List
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sse_parser  # noqa: E402
+from sse_parser import iter_chunks  # noqa: E402
+
+WORDS = ("the model diffusion token answer quantum network latency stream frame "
+         "python server client request search result update context cache value").split()
+
+def synthetic_stream(n_chunks: int, diffusing: bool, seed: int = 0) -> bytes:
+    """An upstream response body with ``n_chunks`` completion chunks and a [DONE] marker"""
+    rng = random.Random(seed)
+    parts = []
+    text = ""
+    for i in range(n_chunks):
+        token = rng.choice(WORDS) + " "
+        text += token
+        chunk = {
+            "id": "chatcmpl-123",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "mercury-coder",
+            "choices": [{"index": 0, "delta": {"content": text[-2000:] if diffusing else token}, "finish_reason": None}],
+        }
+        parts.append(f"data: {json.dumps(chunk)}\n\n")
+    parts.append("data: [DONE]\n\n")
+    return "".join(parts).encode()
+
+def split(body: bytes, read_size: int) -> List[bytes]:
+    return [body[i:i + read_size] for i in range(0, len(body), read_size)]
+
+def legacy(reads: Iterable[bytes]) -> int:
+    count = 0
+    for line in httpx.Response(200, content=iter(reads)).iter_lines():
+        if line.startswith('data: '):
+            data_str = line[6:]
+            if data_str.strip() == '[DONE]':
+                break
+            if data_str.startswith('{'):
+                try:
+                    data = json.loads(data_str)
+                    if 'choices' in data and len(data['choices']) > 0:
+                        delta = data['choices'][0].get('delta', {})
+                        if delta.get('content') is not None:
+                            count += 1
+                except json.JSONDecodeError:
+                    continue
+    return count
+
+def parser(reads: Iterable[bytes]) -> int:
+    count = 0
+    for chunk in iter_chunks(reads):
+        if chunk.done:
+            break
+        if chunk.delta.get('content') is not None:
+            count += 1
+    return count
+
+# Chunk layouts the fast stdlib path must decode exactly like a full parse
+EDGE_CASES = [
+    {"choices": [{"index": 0, "delta": {"content": "hi"}, "finish_reason": None}]},
+    {"choices": [{"index": 0, "delta": {"content": "done"}, "finish_reason": "stop"}], "usage": {"completion_tokens": 3}},
+    {"choices": [{"index": 0, "finish_reason": "tool_calls", "delta": {"tool_calls": [{"index": 0, "function": {"arguments": "}"}}]}}]},
+    {"usage": {"completion_tokens": 3}, "choices": [{"finish_reason": "length", "index": 0, "delta": {}}]},
+    {"choices": [{"index": 0, "delta": {"content": "\"finish_reason\": \"stop\""}, "finish_reason": None}]},
+    {"choices": [{"index": 0, "delta": None, "finish_reason": "stop"}]},
+    {"choices": [], "usage": {"completion_tokens": 3}},
+]
+
+def check_parsers():
+    """Every parser variant must agree with a full ``json.loads`` on EDGE_CASES"""
+    parsers = [sse_parser.parse_chunk_stdlib] + ([sse_parser.parse_chunk_orjson] if sse_parser.orjson is not None else [])
+    for case in EDGE_CASES:
+        data = json.dumps(case).encode()
+        expected = sse_parser._chunk_from_object(json.loads(data))
+        for parse in parsers:
+            assert parse(data) == expected, f"{parse.__name__} decoded {data!r} as {parse(data)}, expected {expected}"
+
+def measure(fn: Callable[[Iterable[bytes]], int], reads: List[bytes], expected: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        assert fn(reads) == expected, f"{fn.__name__} parsed the wrong number of chunks"
+        best = min(best, time.perf_counter() - start)
+    return expected / best
+
+def main():
+    parser_args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser_args.add_argument("--chunks", type=int, default=5000)
+    parser_args.add_argument("--read-size", type=int, nargs="+", default=[1024, 4096, 65536])
+    parser_args.add_argument("--repeat", type=int, default=5)
+    args = parser_args.parse_args()
+    check_parsers()
+
+    variants = [("parser/json", sse_parser.parse_chunk_stdlib)]
+    if sse_parser.orjson is not None:
+        variants.append(("parser/orjson", sse_parser.parse_chunk_orjson))
+    else:
+        print("orjson not installed; skipping parser/orjson")
+    default_parse = sse_parser._parse_object
+
+    print(f"{'mode':>10} {'read B':>7} {'variant':>14} {'chunks/s':>12} {'speedup':>8}")
+    for diffusing in (False, True):
+        body = synthetic_stream(args.chunks, diffusing)
+        for read_size in args.read_size:
+            reads = split(body, read_size)
+            baseline = measure(legacy, reads, args.chunks, args.repeat)
+            mode = "diffusing" if diffusing else "streaming"
+            print(f"{mode:>10} {read_size:>7} {'legacy':>14} {baseline:>12,.0f} {'1.0x':>8}")
+            for name, parse in variants:
+                sse_parser._parse_object = parse
+                rate = measure(parser, reads, args.chunks, args.repeat)
+                print(f"{mode:>10} {read_size:>7} {name:>14} {rate:>12,.0f} {rate / baseline:>7.1f}x")
+            sse_parser._parse_object = default_parse
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Drive ``POST /chat`` with N concurrent clients and report latency percentiles.
+
+For each concurrency level, ``N`` clients send requests back to back until
+``--requests`` have completed. Reports time to first byte (TTFB), time to
+last byte (TTLB), p50/p99 of both, throughput and errors, then the highest
+level that stayed within the latency objective without errors.
+
+With ``--spawn`` it starts ``mock_upstream.py`` and a backend pointed at it,
+so no API keys are needed. The backend has one worker unless ``--workers``
+is given, in which case it runs under ``serve.py``; compare req/s across
+worker counts to check scaling:
+
+    python benchmarks/load_test.py --spawn --concurrency 1 8 32 128 --requests 256
+    python benchmarks/load_test.py --spawn --mode diffusing --tools --token-rate 400
+    python benchmarks/load_test.py --spawn --workers 4 --shared-state sqlite --token-rate 0 --concurrency 64
+    python benchmarks/load_test.py --url http://localhost:8000 --api-key ... --concurrency 1 4
+
+To measure behaviour under overload, give the mock an account rate limit and
+let the backend's admission controller (configured through its environment)
+queue calls instead of relaying 429s:
+
+    python benchmarks/load_test.py --spawn --rate-limit 20 --users 8 --concurrency 16 64
+    UPSTREAM_RATE_LIMIT=18 python benchmarks/load_test.py --spawn --rate-limit 20 --users 8 --concurrency 16 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+class Sample:
+    def __init__(self, ttfb: float, ttlb: float, ok: bool, queued: bool = False):
+        self.ttfb = ttfb
+        self.ttlb = ttlb
+        self.ok = ok
+        self.queued = queued
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+def chat_payload(args, i: int) -> Dict:
+    return {
+        "messages": [{"role": "user", "content": f"Load test question {i}: what changed in the latest release?"}],
+        "mode": args.mode,
+        "inception_api_key": f"{args.api_key}-{i % args.users}" if args.users > 1 else args.api_key,
+        "tavily_api_key": args.tavily_api_key if args.tools else None,
+        "tools_enabled": args.tools,
+        "max_tokens": args.max_tokens,
+    }
+
+async def one_request(client: httpx.AsyncClient, url: str, payload: Dict) -> Sample:
+    start = time.perf_counter()
+    ttfb = None
+    body = []
+    try:
+        async with client.stream("POST", url, json=payload) as response:
+            async for chunk in response.aiter_bytes():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                body.append(chunk)
+            ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    ttlb = time.perf_counter() - start
+    text = b"".join(body)
+    # Errors inside the stream arrive as an "error" payload with a 200 status
+    ok = ok and b'"error"' not in text and b"[DONE]" in text
+    return Sample(ttfb if ttfb is not None else ttlb, ttlb, ok, b'"queued"' in text)
+
+async def run_level(args, concurrency: int, requests: int) -> Dict:
+    url = args.url.rstrip("/") + "/chat"
+    samples: List[Sample] = []
+    issued = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        async def worker():
+            for i in issued:
+                samples.append(await one_request(client, url, chat_payload(args, i)))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    ok = [s for s in samples if s.ok]
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "success_rate": len(ok) / len(samples) if samples else 0.0,
+        "queued": sum(s.queued for s in samples),
+        "rps": len(samples) / elapsed,
+        "ttfb_p50": percentile([s.ttfb for s in ok], 50),
+        "ttfb_p99": percentile([s.ttfb for s in ok], 99),
+        "ttlb_p50": percentile([s.ttlb for s in ok], 50),
+        "ttlb_p99": percentile([s.ttlb for s in ok], 99),
+    }
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for(url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+def spawn(args) -> List[subprocess.Popen]:
+    """Start the mock upstream and the backend workers; point ``args.url`` at the backend"""
+    mock_port, backend_port = free_port(), free_port()
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(BACKEND_DIR, "benchmarks", "mock_upstream.py"), "--port", str(mock_port),
+        "--tokens", str(args.tokens), "--token-rate", str(args.token_rate), "--frames", str(args.frames),
+        "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+        "--rate-limit", str(args.rate_limit), "--rate-burst", str(args.rate_burst),
+    ])
+    env = dict(
+        os.environ,
+        INCEPTION_API_URL=f"http://127.0.0.1:{mock_port}/v1/chat/completions",
+        TAVILY_API_URL=f"http://127.0.0.1:{mock_port}/search",
+        SHARED_STATE=args.shared_state,
+    )
+    if args.workers > 1:
+        command = [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(backend_port), "--workers", str(args.workers)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(backend_port), "--log-level", "warning"]
+    backend = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+    processes = [mock, backend]
+    try:
+        wait_for(f"http://127.0.0.1:{mock_port}/stats")
+        wait_for(f"http://127.0.0.1:{backend_port}/stats")
+    except Exception:
+        stop(processes)
+        raise
+    args.url = f"http://127.0.0.1:{backend_port}"
+    return processes
+
+def stop(processes: List[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def sustainable(results: List[Dict], slo: Optional[float], max_error_rate: float = 0.0) -> Optional[int]:
+    """Highest concurrency within the error budget and with p99 TTLB within ``slo`` (default: 2x the p99 at the lowest level)"""
+    if not results:
+        return None
+    limit = slo if slo is not None else 2 * results[0]["ttlb_p99"]
+    best = None
+    for result in results:
+        if result["errors"] <= max_error_rate * result["requests"] and result["ttlb_p99"] <= limit:
+            best = result["concurrency"]
+        else:
+            break
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="backend base URL (ignored with --spawn)")
+    parser.add_argument("--spawn", action="store_true", help="start mock_upstream.py and a backend pointed at it")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=128, help="requests per concurrency level")
+    parser.add_argument("--mode", choices=["streaming", "diffusing"], default="streaming")
+    parser.add_argument("--tools", action="store_true", help="enable web search (one tool call per request with the mock)")
+    parser.add_argument("--max-tokens", type=int, default=800)
+    parser.add_argument("--api-key", default="mock-key")
+    parser.add_argument("--tavily-api-key", default="mock-key")
+    parser.add_argument("--users", type=int, default=1, help="spread requests over this many API keys")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--slo", type=float, help="p99 TTLB objective in seconds for the sustainable-concurrency check")
+    parser.add_argument("--max-error-rate", type=float, default=0.0, help="error fraction a sustainable level may have")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    mock = parser.add_argument_group("spawned mock upstream and backend (--spawn)")
+    mock.add_argument("--tokens", type=int, default=120)
+    mock.add_argument("--token-rate", type=float, default=200.0)
+    mock.add_argument("--frames", type=int, default=16)
+    mock.add_argument("--latency", type=float, default=0.05)
+    mock.add_argument("--error-rate", type=float, default=0.0)
+    mock.add_argument("--rate-limit", type=float, default=0.0, help="mock completions per second before it answers 429")
+    mock.add_argument("--rate-burst", type=float, default=5.0)
+    mock.add_argument("--workers", type=int, default=1, help="backend worker processes (more than one runs serve.py)")
+    mock.add_argument("--shared-state", default="memory", choices=["memory", "sqlite", "redis"], help="SHARED_STATE for the backend")
+    args = parser.parse_args()
+
+    processes = spawn(args) if args.spawn else []
+    try:
+        asyncio.run(run_level(args, 1, 4))  # warm up connections and caches
+        results = []
+        if not args.json:
+            print(f"{'clients':>7} {'reqs':>5} {'errors':>6} {'ok':>5} {'queued':>6} {'req/s':>8} {'TTFB p50':>9} {'TTFB p99':>9} {'TTLB p50':>9} {'TTLB p99':>9}")
+        for concurrency in args.concurrency:
+            result = asyncio.run(run_level(args, concurrency, args.requests))
+            results.append(result)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"{result['concurrency']:>7} {result['requests']:>5} {result['errors']:>6} {result['success_rate']:>5.0%} {result['queued']:>6} {result['rps']:>8.1f} "
+                      f"{result['ttfb_p50'] * 1000:>7.0f}ms {result['ttfb_p99'] * 1000:>7.0f}ms "
+                      f"{result['ttlb_p50'] * 1000:>7.0f}ms {result['ttlb_p99'] * 1000:>7.0f}ms")
+        best = sustainable(results, args.slo, args.max_error_rate)
+        if not args.json:
+            workers = f"{args.workers} worker(s)" if args.spawn else "the backend"
+            print(f"max sustainable concurrency for {workers}: {best if best is not None else 'none'}")
+    finally:
+        stop(processes)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Minimal Redis-protocol server for testing SHARED_STATE=redis without Redis.
+
+Implements just the commands ``shared_state.RedisStore`` sends (PING, AUTH,
+SELECT, GET, SET with PX/NX, DEL, INCRBY, PTTL, FLUSHDB) over RESP2, with
+lazy expiry. One process, one in-memory keyspace, no persistence.
+
+    python benchmarks/mock_redis.py --port 6379
+    SHARED_STATE=redis SHARED_STATE_URL=redis://127.0.0.1:6379/0 python serve.py --workers 4
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+class Keyspace:
+    def __init__(self):
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+
+    def _live(self, key: bytes) -> Optional[Tuple[bytes, Optional[float]]]:
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def execute(self, command: List[bytes]) -> bytes:
+        name = command[0].upper()
+        args = command[1:]
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name in (b"AUTH", b"SELECT"):
+            return b"+OK\r\n"
+        if name == b"FLUSHDB":
+            self.data.clear()
+            return b"+OK\r\n"
+        if name == b"GET":
+            entry = self._live(args[0])
+            return b"$-1\r\n" if entry is None else b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0])
+        if name == b"SET":
+            key, value, options = args[0], args[1], [option.upper() for option in args[2:]]
+            expires_at = None
+            if b"PX" in options:
+                expires_at = time.monotonic() + int(args[2 + options.index(b"PX") + 1]) / 1000
+            if b"NX" in options and self._live(key) is not None:
+                return b"$-1\r\n"
+            self.data[key] = (value, expires_at)
+            return b"+OK\r\n"
+        if name == b"DEL":
+            return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in args)
+        if name == b"INCRBY":
+            entry = self._live(args[0])
+            value = int(entry[0] if entry else 0) + int(args[1])
+            self.data[args[0]] = (str(value).encode(), entry[1] if entry else None)
+            return b":%d\r\n" % value
+        if name == b"PTTL":
+            entry = self._live(args[0])
+            if entry is None:
+                return b":-2\r\n"
+            return b":-1\r\n" if entry[1] is None else b":%d\r\n" % int((entry[1] - time.monotonic()) * 1000)
+        return b"-ERR unknown command '%s'\r\n" % name
+
+async def read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, e.g. from `nc`
+        return line.split()
+    command = []
+    for _ in range(int(line[1:])):
+        length = int((await reader.readline())[1:])
+        command.append((await reader.readexactly(length + 2))[:-2])
+    return command
+
+def serve(keyspace: Keyspace):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                command = await read_command(reader)
+                if not command:
+                    break
+                writer.write(keyspace.execute(command))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+async def run(host: str, port: int):
+    server = await asyncio.start_server(serve(Keyspace()), host, port)
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    asyncio.run(run(args.host, args.port))
+
+if __name__ == "__main__":
+    main()
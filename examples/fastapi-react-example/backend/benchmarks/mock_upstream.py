@@ -0,0 +1,251 @@
+"""Offline stand-in for the Inception and Tavily APIs.
+
+Serves ``POST /v1/chat/completions`` (non-streaming, streaming deltas,
+``diffusing: true`` frames and ``tool_calls`` deltas when ``tools`` are
+sent) and ``POST /search`` with synthetic text, so the backend can be run
+and load-tested without live keys. ``POST /v1/traces`` stands in for an
+OTLP/HTTP collector (``TRACE_OTLP_ENDPOINT=http://127.0.0.1:9000``) and
+only counts what it receives. Token rate, diffusion frame count,
+latency, error injection and an account rate limit (429 with Retry-After)
+are configurable:
+
+    python benchmarks/mock_upstream.py --port 9000 --token-rate 200 --frames 16 --error-rate 0.01
+    python benchmarks/mock_upstream.py --port 9000 --rate-limit 20 --rate-burst 5
+    INCEPTION_API_URL=http://127.0.0.1:9000/v1/chat/completions \\
+    TAVILY_API_URL=http://127.0.0.1:9000/search python main.py
+
+API keys starting with ``bad`` are rejected with 401.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("the model diffusion token answer quantum network latency stream frame "
+         "python server client request search result update context cache value "
+         "state **bold** `code` data graph energy system").split()
+
+class MockSettings:
+    """Behaviour of the mock upstream; see ``--help`` for the meaning of each field"""
+
+    def __init__(
+        self,
+        tokens: int = 120,
+        token_rate: float = 100.0,
+        frames: int = 16,
+        latency: float = 0.05,
+        search_latency: float = 0.2,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        drop_rate: float = 0.0,
+        tool_calls: bool = True,
+        seed: int = 0,
+        rate_limit: float = 0.0,
+        rate_burst: float = 5.0
+    ):
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.frames = frames
+        self.latency = latency
+        self.search_latency = search_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.drop_rate = drop_rate
+        self.tool_calls = tool_calls
+        self.seed = seed
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+
+class MockStats:
+    def __init__(self):
+        self.completions = 0
+        self.streams = 0
+        self.searches = 0
+        self.errors = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        self.tokens = 0
+        self.trace_exports = 0
+        self.spans = 0
+
+def sse(data: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
+def completion_chunk(delta: Dict[str, Any], finish_reason: str = None, usage: Dict[str, int] = None) -> str:
+    chunk = {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "mercury-coder",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage is not None:
+        chunk["usage"] = usage
+    return sse(chunk)
+
+def usage(messages: List[Dict], completion_tokens: int) -> Dict[str, int]:
+    prompt_tokens = sum(len(str(message.get("content") or "").split()) for message in messages)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+def wants_tool_call(body: Dict[str, Any], settings: MockSettings) -> bool:
+    """Call a tool once per turn: when tools are offered and no tool result has come back yet"""
+    return settings.tool_calls and bool(body.get("tools")) and not any(m.get("role") == "tool" for m in body.get("messages", []))
+
+def last_user_message(messages: List[Dict]) -> str:
+    return next((str(m.get("content") or "") for m in reversed(messages) if m.get("role") == "user"), "")
+
+def diffusion_frames(target: List[str], frames: int, rng: random.Random) -> List[str]:
+    """Frames of a denoising run: each token resolves at a random step, biased to the left"""
+    n = len(target)
+    resolve_at = [min(frames, 1 + int(frames * (0.6 * i / max(n, 1) + 0.4 * rng.random()))) for i in range(n)]
+    return [
+        "".join(token if resolve_at[i] <= step else rng.choice(WORDS) + " " for i, token in enumerate(target))
+        for step in range(1, frames + 1)
+    ]
+
+def create_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI(title="Mock Inception/Tavily upstream")
+    stats = MockStats()
+    counter = iter(range(1 << 62))
+    # Account-wide token bucket for --rate-limit
+    bucket = {"tokens": settings.rate_burst, "updated": time.monotonic()}
+
+    async def stream_completion(body: Dict[str, Any], rng: random.Random, n_tokens: int) -> AsyncIterator[str]:
+        messages = body.get("messages", [])
+        delay = 1.0 / settings.token_rate if settings.token_rate > 0 else 0.0
+        drop_at = rng.randrange(max(n_tokens, 1)) if rng.random() < settings.drop_rate else None
+        await asyncio.sleep(settings.latency)
+        stats.streams += 1
+
+        if wants_tool_call(body, settings):
+            query = last_user_message(messages)[:80] or "latest news"
+            arguments = json.dumps({"query": query})
+            half = len(arguments) // 2
+            yield completion_chunk({"role": "assistant", "content": "Let me search for that."})
+            yield completion_chunk({"tool_calls": [{"index": 0, "id": f"call_{rng.randrange(1 << 30)}", "type": "function",
+                                                    "function": {"name": "web_search", "arguments": arguments[:half]}}]})
+            await asyncio.sleep(delay)
+            yield completion_chunk({"tool_calls": [{"index": 0, "function": {"arguments": arguments[half:]}}]}, "tool_calls")
+            yield "data: [DONE]\n\n"
+            return
+
+        target = [rng.choice(WORDS) + ("\n\n" if rng.random() < 0.05 else " ") for _ in range(n_tokens)]
+        finish_reason = "length" if n_tokens < settings.tokens else "stop"
+        if body.get("diffusing"):
+            frames = diffusion_frames(target, max(settings.frames, 1), rng)
+            frame_delay = delay * n_tokens / len(frames)
+            for step, frame in enumerate(frames):
+                if drop_at is not None and step >= drop_at * len(frames) // max(n_tokens, 1):
+                    stats.dropped += 1
+                    return
+                await asyncio.sleep(frame_delay)
+                last = step == len(frames) - 1
+                yield completion_chunk({"content": frame}, finish_reason if last else None, usage(messages, n_tokens) if last else None)
+        else:
+            for i, token in enumerate(target):
+                if i == drop_at:
+                    stats.dropped += 1
+                    return
+                if delay:
+                    await asyncio.sleep(delay)
+                last = i == n_tokens - 1
+                yield completion_chunk({"content": token}, finish_reason if last else None, usage(messages, n_tokens) if last else None)
+        stats.tokens += n_tokens
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        stats.completions += 1
+        rng = random.Random(settings.seed * 1000003 + next(counter))
+        authorization = request.headers.get("authorization", "")
+        if not authorization.startswith("Bearer ") or authorization[7:].startswith("bad"):
+            return JSONResponse({"error": {"message": "Invalid API key"}}, status_code=401)
+        if settings.rate_limit > 0:
+            now = time.monotonic()
+            bucket["tokens"] = min(settings.rate_burst, bucket["tokens"] + (now - bucket["updated"]) * settings.rate_limit)
+            bucket["updated"] = now
+            if bucket["tokens"] < 1:
+                stats.rate_limited += 1
+                retry_after = math.ceil((1 - bucket["tokens"]) / settings.rate_limit)
+                return JSONResponse({"error": {"message": "Rate limit exceeded"}}, status_code=429, headers={"Retry-After": str(retry_after)})
+            bucket["tokens"] -= 1
+        if rng.random() < settings.error_rate:
+            stats.errors += 1
+            await asyncio.sleep(settings.latency)
+            return JSONResponse({"error": {"message": "Injected failure"}}, status_code=settings.error_status)
+
+        n_tokens = max(1, min(settings.tokens, int(body.get("max_tokens") or settings.tokens)))
+        if body.get("stream"):
+            return StreamingResponse(stream_completion(body, rng, n_tokens), media_type="text/event-stream")
+
+        await asyncio.sleep(settings.latency + (n_tokens / settings.token_rate if settings.token_rate > 0 else 0.0))
+        stats.tokens += n_tokens
+        content = "".join(rng.choice(WORDS) + " " for _ in range(n_tokens)).strip()
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "mercury-coder",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage(body.get("messages", []), n_tokens),
+        }
+
+    @app.post("/search")
+    async def search(request: Request):
+        body = await request.json()
+        stats.searches += 1
+        await asyncio.sleep(settings.search_latency)
+        query = str(body.get("query", ""))
+        results = [
+            {"title": f"Result {i} for {query}", "url": f"https://example.com/{i}", "content": f"Synthetic content about {query}. " * 3}
+            for i in range(1, int(body.get("max_results", 3)) + 1)
+        ]
+        return {"query": query, "answer": f"A synthetic answer about {query}.", "results": results}
+
+    @app.post("/v1/traces")
+    async def traces(request: Request):
+        body = await request.json()
+        stats.trace_exports += 1
+        stats.spans += sum(len(scope.get("spans", [])) for resource in body.get("resourceSpans", []) for scope in resource.get("scopeSpans", []))
+        return {"partialSuccess": {}}
+
+    @app.get("/stats")
+    async def mock_stats():
+        return dict(vars(stats))
+
+    return app
+
+def main():
+    defaults = MockSettings()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="completion length in tokens (capped by max_tokens)")
+    parser.add_argument("--token-rate", type=float, default=defaults.token_rate, help="tokens per second; 0 streams as fast as possible")
+    parser.add_argument("--frames", type=int, default=defaults.frames, help="denoising frames per diffusing completion")
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="seconds before the first byte of a completion")
+    parser.add_argument("--search-latency", type=float, default=defaults.search_latency, help="seconds per search")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="fraction of completions failing with --error-status")
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--drop-rate", type=float, default=defaults.drop_rate, help="fraction of streams cut off without [DONE]")
+    parser.add_argument("--no-tool-calls", dest="tool_calls", action="store_false", help="never answer with tool_calls")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--rate-limit", type=float, default=defaults.rate_limit, help="completions per second before answering 429; 0 = unlimited")
+    parser.add_argument("--rate-burst", type=float, default=defaults.rate_burst, help="completions allowed in a burst under --rate-limit")
+    args = parser.parse_args()
+
+    import uvicorn
+    settings = MockSettings(args.tokens, args.token_rate, args.frames, args.latency, args.search_latency,
+                            args.error_rate, args.error_status, args.drop_rate, args.tool_calls, args.seed,
+                            args.rate_limit, args.rate_burst)
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
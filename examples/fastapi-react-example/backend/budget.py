@@ -0,0 +1,107 @@
+import math
+import time
+from typing import Optional
+
+# Rough characters-per-token ratio used when the upstream does not report usage
+CHARS_PER_TOKEN = 4
+# The upstream is sent max_tokens and stops by itself; the local estimate only cuts a call
+# off once it passes what the call was offered by this factor
+ESTIMATE_MARGIN = 2
+
+class Budget:
+    """Per-request limits on output tokens, wall-clock time and tool hops.
+
+    One budget is created per ``/chat`` request and threaded through every
+    upstream call. ``max_tokens`` is what the client asked for (capped by the
+    server), each upstream call is only offered what is left, and streams are
+    closed as soon as ``exhausted`` returns a reason.
+
+    The upstream enforces each call's ``max_tokens`` itself. Locally a call is
+    only stopped when the upstream's reported usage exceeds what it was
+    offered, or the character estimate exceeds it by ``ESTIMATE_MARGIN``.
+    Diffusion frames are whole-canvas drafts as long as the final answer from
+    the first frame on, so they are counted but never cut off on length.
+    """
+
+    def __init__(self, max_tokens: int, deadline: float, max_tool_hops: int):
+        self.max_tokens = max_tokens
+        self.deadline = time.monotonic() + deadline
+        self.max_tool_hops = max_tool_hops
+        self.tokens_used = 0
+        self.tool_hops = 0
+        # Output of the in-progress call; diffusion frames replace rather than append
+        self._call_chars = 0
+        self._call_usage: Optional[int] = None
+        # Tokens offered to the in-progress call, and whether its output is diffusion frames
+        self._call_limit = max_tokens
+        self._call_frames = False
+
+    @property
+    def call_tokens(self) -> int:
+        if self._call_usage is not None:
+            return self._call_usage
+        return math.ceil(self._call_chars / CHARS_PER_TOKEN)
+
+    def remaining_tokens(self) -> int:
+        return max(0, self.max_tokens - self.tokens_used - self.call_tokens)
+
+    def remaining_time(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def can_use_tools(self) -> bool:
+        return self.tool_hops < self.max_tool_hops
+
+    def start_call(self):
+        """Commit the previous call's usage and start counting a new upstream call"""
+        self.tokens_used += self.call_tokens
+        self._call_chars = 0
+        self._call_usage = None
+        self._call_limit = self.remaining_tokens()
+        self._call_frames = False
+
+    def add_output(self, text: str):
+        """Count appended (streamed) output"""
+        self._call_chars += len(text)
+
+    def set_output(self, text: str):
+        """Count a full diffusion frame, which supersedes the previous one"""
+        self._call_chars = len(text)
+        self._call_frames = True
+
+    def record_usage(self, completion_tokens: int):
+        """Replace the estimate with the upstream's own count when it reports usage"""
+        self._call_usage = completion_tokens
+
+    def discard_call(self):
+        """Drop the in-progress call's output without charging it (e.g. a cancelled speculative call)"""
+        self._call_chars = 0
+        self._call_usage = None
+        self._call_frames = False
+
+    def fork(self) -> "Budget":
+        """Budget for a call running alongside this one: the same deadline and the tokens left now"""
+        child = Budget(self.remaining_tokens(), 0, 0)
+        child.deadline = self.deadline
+        return child
+
+    def merge(self, child: "Budget"):
+        """Charge everything a forked budget used to this one"""
+        self.tokens_used += child.tokens_used + child.call_tokens
+
+    def use_tool_hop(self):
+        self.tool_hops += 1
+
+    def exhausted(self) -> Optional[str]:
+        """Return why the budget is spent ("max_tokens" or "deadline"), or None"""
+        if self._call_limit <= 0 or self._call_over_limit():
+            return "max_tokens"
+        if time.monotonic() >= self.deadline:
+            return "deadline"
+        return None
+
+    def _call_over_limit(self) -> bool:
+        if self._call_usage is not None:
+            return self._call_usage > self._call_limit
+        if self._call_frames:
+            return False
+        return self.call_tokens > self._call_limit * ESTIMATE_MARGIN
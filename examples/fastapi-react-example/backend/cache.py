@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import hmac
+import re
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from semantic_index import MinHashIndex
+from shared_state import Store
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after a TTL.
+
+    Expiry uses wall-clock time so entries loaded from disk keep their
+    original deadline across restarts. With ``max_bytes``, the ``size``
+    given to ``set`` is also totalled and least recently used entries are
+    evicted to keep it under the limit.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 300.0, max_bytes: Optional[int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at, _ = entry
+        if expires_at <= time.time():
+            self.delete(key)
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, expires_at: Optional[float] = None, size: int = 0):
+        if expires_at is None:
+            expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self.delete(key)
+        self._data[key] = (value, expires_at, size)
+        self.bytes += size
+        while len(self._data) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes and len(self._data) > 1):
+            self.bytes -= self._data.popitem(last=False)[1][2]
+            self.evictions += 1
+
+    def delete(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+def normalize_query(query: str) -> str:
+    """Case-fold, trim and collapse whitespace/trailing punctuation so trivially different queries share a key"""
+    return re.sub(r"\s+", " ", query).strip().strip("?!.").strip().lower()
+
+class SearchCache:
+    """TTL + LRU cache for web search results over an optional shared store.
+
+    ``store`` (see ``shared_state``) is a second tier shared with other
+    workers or kept across restarts; each worker keeps its own memory tier.
+
+    Concurrent lookups of the same key share one in-flight upstream call.
+    Error results are never cached. With a ``semantic`` index, a query that
+    misses exactly is served from the closest cached query with the same
+    depth and result count when their similarity clears the index threshold.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 300.0, store: Optional[Store] = None, semantic: Optional[MinHashIndex] = None):
+        self.memory = TTLCache(maxsize, ttl)
+        self.store = store
+        self.semantic = semantic
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.semantic_hits = 0
+        self.near_misses = 0
+        self.semantic_similarity = 0.0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(query: str, max_results: int, search_depth: str) -> str:
+        return f"{search_depth}:{max_results}:{normalize_query(query)}"
+
+    def _remember(self, key: str, value: Any, expires_at: Optional[float] = None):
+        self.memory.set(key, value, expires_at=expires_at)
+        if self.semantic is not None:
+            depth, max_results, query = key.split(":", 2)
+            self.semantic.add(key, f"{depth}:{max_results}", query)
+
+    def _semantic_lookup(self, key: str) -> Optional[Any]:
+        """Cached results of the most similar query, if it clears the threshold and is still cached"""
+        depth, max_results, query = key.split(":", 2)
+        match_key, score = self.semantic.best_match(f"{depth}:{max_results}", query)
+        if match_key is None:
+            return None
+        if score < self.semantic.threshold:
+            # Close calls show whether the threshold is leaving hits on the table
+            if score >= self.semantic.threshold - 0.1:
+                self.near_misses += 1
+            return None
+        value = self.memory.get(match_key)
+        if value is None:
+            # Evicted or expired since it was indexed
+            self.semantic.remove(match_key)
+            return None
+        self.semantic_hits += 1
+        self.semantic_similarity += score
+        return value
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.semantic is not None:
+            value = self._semantic_lookup(key)
+            if value is not None:
+                return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The leading call was cancelled (e.g. its caller timed out); fetch on our own
+                return await self.get_or_fetch(key, fetch)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            if self.store:
+                entry = await asyncio.get_running_loop().run_in_executor(None, self.store.get, key)
+                if entry is not None:
+                    self.disk_hits += 1
+                    self._remember(key, entry[0], expires_at=entry[1])
+                    future.set_result(entry[0])
+                    return entry[0]
+
+            self.misses += 1
+            value = await fetch()
+            if 'error' not in value:
+                self._remember(key, value)
+                if self.store:
+                    await asyncio.get_running_loop().run_in_executor(None, self.store.set, key, value, time.time() + self.memory.ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.semantic_hits + self.misses + self.coalesced
+        return {
+            "size": len(self.memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "semantic_hits": self.semantic_hits,
+            "near_misses": self.near_misses,
+            "avg_semantic_similarity": round(self.semantic_similarity / self.semantic_hits, 4) if self.semantic_hits else 0.0,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.memory.evictions,
+            "expirations": self.memory.expirations,
+            "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        if self.store:
+            self.store.close()
+
+class KeyValidationCache:
+    """Cache of API-key validation results keyed by an HMAC of the key.
+
+    Raw keys are never stored. Valid keys are kept for ``ttl`` seconds and
+    definitive rejections for ``failure_ttl``; transient failures (timeouts,
+    network errors, 5xx) are not cached. Concurrent validations of the same
+    key share one upstream call. Results are also written to ``store`` when
+    given; workers sharing it must share ``secret`` too.
+    """
+
+    def __init__(self, ttl: float = 600.0, failure_ttl: float = 30.0, secret: Optional[str] = None, maxsize: int = 1024, store: Optional[Store] = None):
+        self.memory = TTLCache(maxsize, ttl)
+        self.store = store
+        self.failure_ttl = failure_ttl
+        # A per-process salt is enough for an in-memory cache; set a secret to share keys across workers
+        self._secret = secret.encode() if secret else secrets.token_bytes(32)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def key(self, api_key: str) -> str:
+        return hmac.new(self._secret, api_key.encode(), hashlib.sha256).hexdigest()
+
+    async def get_or_validate(self, api_key: str, validate: Callable[[], Awaitable[Tuple[Dict[str, Any], bool]]]) -> Dict[str, Any]:
+        """Return a cached result or run ``validate``, which returns ``(result, definitive)``"""
+        key = self.key(api_key)
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                return await self.get_or_validate(api_key, validate)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            loop = asyncio.get_running_loop()
+            if self.store:
+                entry = await loop.run_in_executor(None, self.store.get, key)
+                if entry is not None:
+                    self.store_hits += 1
+                    self.memory.set(key, entry[0], expires_at=entry[1])
+                    future.set_result(entry[0])
+                    return entry[0]
+
+            self.misses += 1
+            value, definitive = await validate()
+            if value.get('valid') or definitive:
+                ttl = self.memory.ttl if value.get('valid') else self.failure_ttl
+                self.memory.set(key, value, ttl=ttl)
+                if self.store:
+                    await loop.run_in_executor(None, self.store.set, key, value, time.time() + ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.store_hits + self.misses + self.coalesced
+        return {
+            "size": len(self.memory),
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        if self.store:
+            self.store.close()
@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+from cache import TTLCache
+from shared_state import Store
+from sse_parser import DONE, Chunk
+
+# A recording is a list of [seconds since the call started, delta, finish_reason, usage]
+Recording = List[list]
+
+class StreamRecorder:
+    """Collects the chunks of one upstream completion stream with their timing"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.chunks: Recording = []
+        self.complete = False
+
+    def add(self, chunk: Chunk):
+        if chunk.done:
+            self.complete = True
+            return
+        self.chunks.append([round(time.monotonic() - self.started, 4), chunk.delta, chunk.finish_reason, chunk.usage])
+        if chunk.finish_reason:
+            # Tool-call turns are left before [DONE] arrives; the finish reason already ends the answer
+            self.complete = True
+
+async def replay_chunks(recording: Recording, speed: float = 1.0) -> AsyncIterator[Chunk]:
+    """Yield recorded chunks again, at the recorded pace divided by ``speed`` (0 = no delay)"""
+    started = time.monotonic()
+    for offset, delta, finish_reason, usage in recording:
+        if speed > 0:
+            delay = started + offset / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield Chunk(delta or {}, finish_reason, usage)
+    yield DONE
+
+def recording_size(recording: Recording) -> int:
+    """Approximate memory held by a recording: its size as compact JSON"""
+    return len(json.dumps(recording, separators=(",", ":"), ensure_ascii=False))
+
+class CompletionCache:
+    """Recorded upstream completion streams, keyed by a canonical hash of the request.
+
+    Streaming deltas and diffusion frames are both stored as the chunk
+    sequence the upstream sent, with timings, so a hit goes through the same
+    encoders as a live stream. Memory is bounded by ``maxsize`` entries and
+    ``max_bytes`` of recordings (diffusion recordings hold every full frame);
+    with a ``store``, entries are also written there, shared with other
+    workers and kept across restarts. Only streams that finished (``[DONE]``
+    or a finish reason) are stored.
+
+    Keys include an HMAC of the caller's API key, since hits are replayed
+    before upstream checks the key: a completion is only replayed to the key
+    that paid for it. Workers sharing a store must share ``secret``.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600.0, store: Optional[Store] = None, secret: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.memory = TTLCache(maxsize, ttl, max_bytes)
+        self.store = store
+        self._secret = secret.encode() if secret else secrets.token_bytes(32)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self.oversized = 0
+
+    def key(self, payload: Dict[str, Any], api_key: str) -> str:
+        """Hash of the API key's HMAC, model, messages, tools, max_tokens and mode (streaming or diffusing)"""
+        canonical = {
+            "caller": hmac.new(self._secret, api_key.encode(), hashlib.sha256).hexdigest(),
+            "model": payload.get("model"),
+            "messages": payload.get("messages"),
+            "tools": payload.get("tools"),
+            "max_tokens": payload.get("max_tokens"),
+            "diffusing": bool(payload.get("diffusing")),
+        }
+        encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Recording]:
+        recording = self.memory.get(key)
+        if recording is not None:
+            self.hits += 1
+            return recording
+        if self.store:
+            entry = await asyncio.get_running_loop().run_in_executor(None, self.store.get, key)
+            if entry is not None:
+                self.disk_hits += 1
+                self.memory.set(key, entry[0], expires_at=entry[1], size=recording_size(entry[0]))
+                return entry[0]
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, recording: Recording):
+        """Store a finished stream, unless it alone exceeds ``max_bytes``"""
+        size = recording_size(recording)
+        if self.memory.max_bytes is not None and size > self.memory.max_bytes:
+            self.oversized += 1
+            return
+        self.stores += 1
+        self.memory.set(key, recording, size=size)
+        if self.store:
+            await asyncio.get_running_loop().run_in_executor(None, self.store.set, key, recording, time.time() + self.memory.ttl)
+
+    async def delete(self, key: str):
+        self.invalidations += 1
+        self.memory.delete(key)
+        if self.store:
+            await asyncio.get_running_loop().run_in_executor(None, self.store.delete, key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self.memory),
+            "bytes": self.memory.bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "invalidations": self.invalidations,
+            "oversized": self.oversized,
+            "evictions": self.memory.evictions,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        if self.store:
+            self.store.close()
@@ -0,0 +1,122 @@
+import os
+
+# Upstream endpoints; point them at benchmarks/mock_upstream.py to run without live keys
+INCEPTION_API_URL = os.getenv("INCEPTION_API_URL", "https://api.inceptionlabs.ai/v1/chat/completions")
+TAVILY_API_URL = os.getenv("TAVILY_API_URL", "https://api.tavily.com/search")
+
+# Per-request generation budget: ChatRequest.max_tokens is capped at MAX_OUTPUT_TOKENS,
+# the whole request must finish within REQUEST_DEADLINE seconds, and the model may
+# trigger at most MAX_TOOL_HOPS rounds of tool calls
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "4000"))
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "120"))
+MAX_TOOL_HOPS = int(os.getenv("MAX_TOOL_HOPS", "1"))
+
+# State shared between worker processes (see serve.py): "memory" keeps every cache
+# per process, "sqlite" shares them through SHARED_STATE_PATH on one host, and
+# "redis" through any Redis-protocol server at SHARED_STATE_URL
+SHARED_STATE = os.getenv("SHARED_STATE", "memory").lower()
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "shared_state.db")
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "redis://127.0.0.1:6379/0")
+# Every STORE_PURGE_INTERVAL seconds, expired rows are deleted from the SQLite stores (SHARED_STATE=sqlite
+# or a *_CACHE_PATH) and each table is cut to STORE_MAX_ROWS, dropping the rows that expire soonest
+STORE_PURGE_INTERVAL = float(os.getenv("STORE_PURGE_INTERVAL", "300"))
+STORE_MAX_ROWS = int(os.getenv("STORE_MAX_ROWS", "100000"))
+
+# Web search result cache
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+# SQLite file for results that should survive restarts; unset keeps the cache in memory only
+# unless SHARED_STATE is sqlite or redis
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH")
+# Serve near-duplicate queries ("latest news AI" / "AI latest news today") from the cache (opt-in);
+# only queries with the same content words match. Tune the threshold with benchmarks/bench_semantic_cache.py
+SEMANTIC_SEARCH_CACHE = os.getenv("SEMANTIC_SEARCH_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.6"))
+
+# API-key validation cache: valid keys are remembered for API_KEY_CACHE_TTL seconds,
+# rejected keys for API_KEY_FAILURE_TTL seconds
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "600"))
+API_KEY_FAILURE_TTL = float(os.getenv("API_KEY_FAILURE_TTL", "30"))
+# HMAC secret for API keys in cache keys (validation and completion caches); a random
+# per-process secret is used when unset
+API_KEY_CACHE_SECRET = os.getenv("API_KEY_CACHE_SECRET")
+
+# Chat history sent upstream is trimmed to CONTEXT_MAX_TOKENS (estimated); with
+# CONTEXT_SUMMARY enabled (opt-in: an extra upstream call), trimmed messages are replaced by a cached rolling summary
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+CONTEXT_SUMMARY = os.getenv("CONTEXT_SUMMARY", "false").lower() == "true"
+CONTEXT_SUMMARY_TTL = float(os.getenv("CONTEXT_SUMMARY_TTL", "3600"))
+
+# Upstream connection pools: one keep-alive pool per host, bounded to *_POOL_SIZE
+# connections. UPSTREAM_HTTP2 multiplexes requests over HTTP/2 when the host supports it
+INCEPTION_POOL_SIZE = int(os.getenv("INCEPTION_POOL_SIZE", "100"))
+TAVILY_POOL_SIZE = int(os.getenv("TAVILY_POOL_SIZE", "20"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "true").lower() == "true"
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+# Connections to open per upstream host at startup, so the first requests skip TCP/TLS setup
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "0"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "3"))
+
+# Admission control for Inception calls: token buckets for all traffic and per API key
+# (requests/second, 0 = unlimited). The buckets are per process, so each of the WEB_CONCURRENCY
+# workers gets an even share of the limits whatever its share of traffic.
+# Calls over the limit wait in a queue served round-robin across keys; 429/503 answers
+# are retried after their Retry-After (or an exponential backoff), with jitter
+WORKERS = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", "0"))
+UPSTREAM_BURST = float(os.getenv("UPSTREAM_BURST", "20"))
+UPSTREAM_KEY_RATE_LIMIT = float(os.getenv("UPSTREAM_KEY_RATE_LIMIT", "0"))
+UPSTREAM_KEY_BURST = float(os.getenv("UPSTREAM_KEY_BURST", "5"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "256"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_RETRY_BASE = float(os.getenv("UPSTREAM_RETRY_BASE", "0.5"))
+
+# Diffusing mode with tools (opt-in): start the diffused answer while the tool-decision call runs,
+# keep it when no tools are needed and restart with tool results otherwise. Every such request
+# then makes two upstream calls, each counted against the admission rate limits
+SPECULATIVE_TOOL_CHECK = os.getenv("SPECULATIVE_TOOL_CHECK", "false").lower() == "true"
+
+# Completion cache (opt-in): identical upstream requests replay a recorded stream.
+# Replay runs at COMPLETION_CACHE_REPLAY_SPEED times the recorded pace (0 = no delay)
+COMPLETION_CACHE = os.getenv("COMPLETION_CACHE", "false").lower() == "true"
+COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", "256"))
+# Bytes of recordings kept in memory; a diffusion recording holds every full frame
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+COMPLETION_CACHE_TTL = float(os.getenv("COMPLETION_CACHE_TTL", "3600"))
+COMPLETION_CACHE_PATH = os.getenv("COMPLETION_CACHE_PATH")
+COMPLETION_CACHE_REPLAY_SPEED = float(os.getenv("COMPLETION_CACHE_REPLAY_SPEED", "1"))
+
+# Prometheus metrics at /metrics (per worker process); disabling turns every hook into a no-op
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Request tracing: spans per orchestration stage, upstream call and tool call. The last
+# TRACE_BUFFER_SIZE traces are kept for /debug/trace; finished traces are appended as
+# OTLP/JSON to TRACE_FILE and/or posted to an OTLP/HTTP collector at TRACE_OTLP_ENDPOINT
+TRACING = os.getenv("TRACING", "false").lower() == "true"
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "dllm-backend")
+# Bearer token for /debug/trace, which lists recent requests; the routes answer 404 when unset
+TRACE_DEBUG_TOKEN = os.getenv("TRACE_DEBUG_TOKEN")
+
+# Resumable /chat streams, for requests that send "resumable": true: generation runs detached
+# from the connection and every SSE event gets an id. Other requests are cancelled as soon as
+# the client disconnects. The newest RESUME_BUFFER_BYTES of each stream are kept so a client can reconnect
+# with Last-Event-ID; a stream nobody reads for RESUME_GRACE seconds is cancelled and dropped.
+# At most RESUME_MAX_STREAMS are held per worker (up to RESUME_MAX_STREAMS * RESUME_BUFFER_BYTES)
+RESUMABLE_STREAMS = os.getenv("RESUMABLE_STREAMS", "true").lower() == "true"
+RESUME_GRACE = float(os.getenv("RESUME_GRACE", "30"))
+RESUME_BUFFER_BYTES = int(os.getenv("RESUME_BUFFER_BYTES", str(1024 * 1024)))
+RESUME_MAX_STREAMS = int(os.getenv("RESUME_MAX_STREAMS", "100"))
+
+# Latest-wins sending for resumable streams: a client that falls behind skips diffusion frames
+# and text snapshots superseded by newer ones, and the events it still needs are joined into
+# fewer writes
+STREAM_COALESCING = os.getenv("STREAM_COALESCING", "true").lower() == "true"
+
+# Diffusing requests with "commit_frames": leading text unchanged for this many consecutive
+# frames is sent once as a "commit" event (up to a markdown block boundary); frames then
+# carry only the text after it. 0 disables committing
+COMMIT_STABLE_FRAMES = int(os.getenv("COMMIT_STABLE_FRAMES", "3"))
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import re
+import httpx
+from typing import Awaitable, Callable, Dict, List, Optional
+from admission import AdmissionController, client_id, parse_retry_after
+from budget import Budget
+from cache import TTLCache
+from tracing import KIND_CLIENT, NOOP_SPAN, SpanLike
+from upstream import INCEPTION_API_URL, inception_headers
+
+# Per-message framing overhead (role, separators) in tokens
+MESSAGE_OVERHEAD = 4
+# Tokens reserved for the rolling summary when one is used
+SUMMARY_MAX_TOKENS = 256
+# Trimmed history is summarized in blocks of this many messages, so one summary serves several turns
+SUMMARY_BLOCK = 8
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for use as context in later turns. "
+    "Keep names, numbers, decisions, open questions and user preferences. "
+    "Reply with the summary only, at most 150 words."
+)
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate: punctuation counts as one token, words as one per 4 characters"""
+    return sum((len(piece) + 3) // 4 for piece in _WORD_RE.findall(text or ""))
+
+def message_tokens(message: Dict) -> int:
+    tokens = MESSAGE_OVERHEAD + estimate_tokens(message.get("content") or "")
+    if message.get("tool_calls"):
+        tokens += estimate_tokens(json.dumps(message["tool_calls"]))
+    return tokens
+
+def _group_starts(messages: List[Dict]) -> List[int]:
+    """Indices where a message group starts; tool results stay with the assistant turn that requested them"""
+    return [i for i, message in enumerate(messages) if i == 0 or message.get("role") != "tool"]
+
+def sliding_window(messages: List[Dict], max_tokens: int) -> int:
+    """Index of the oldest message that still fits, walking back from the newest.
+
+    The newest message group is always kept, even when it alone exceeds the budget.
+    """
+    starts = _group_starts(messages)
+    used = 0
+    cut = len(messages)
+    for start in reversed(starts):
+        group_tokens = sum(message_tokens(message) for message in messages[start:cut])
+        if used + group_tokens > max_tokens and cut < len(messages):
+            break
+        used += group_tokens
+        cut = start
+    return cut
+
+def _prefix_hashes(messages: List[Dict]) -> List[str]:
+    """Chained hashes so ``hashes[i]`` identifies ``messages[:i]``"""
+    hashes = [hashlib.sha256(b"").hexdigest()]
+    for message in messages:
+        encoded = json.dumps([message.get("role"), message.get("content")], ensure_ascii=False).encode()
+        hashes.append(hashlib.sha256(hashes[-1].encode() + encoded).hexdigest())
+    return hashes
+
+def summary_message(summary: str) -> Dict:
+    return {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+
+class ContextManager:
+    """Fit chat history into a token budget.
+
+    System messages are pinned and always sent. The rest is a sliding window
+    of the newest messages; what falls out of the window is optionally
+    replaced by a rolling summary. Summaries are cached by a hash of the
+    history they cover and extended block by block, so each part of the
+    conversation is summarized once and reused on later turns.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        summarize: Optional[Callable[[str, List[Dict]], Awaitable[str]]] = None,
+        summary_cache: Optional[TTLCache] = None,
+        block: int = SUMMARY_BLOCK
+    ):
+        self.max_tokens = max_tokens
+        self.summarize = summarize
+        self.summary_cache = summary_cache if summary_cache is not None else TTLCache()
+        self.block = block
+
+    async def fit(self, messages: List[Dict]) -> List[Dict]:
+        pinned = [message for message in messages if message.get("role") == "system"]
+        history = [message for message in messages if message.get("role") != "system"]
+        budget = self.max_tokens - sum(message_tokens(message) for message in pinned)
+        if sum(message_tokens(message) for message in history) <= budget:
+            return messages
+
+        if self.summarize is None:
+            return pinned + history[sliding_window(history, budget):]
+
+        cut = sliding_window(history, budget - SUMMARY_MAX_TOKENS)
+        if cut == 0:
+            return pinned + history
+        # Round the cut up to a block boundary so one summary serves every turn until the window
+        # passes the next block, but never give up more than half of the window for it
+        starts = _group_starts(history)
+        aligned = min(-(-cut // self.block) * self.block, cut + (len(history) - cut) // 2, starts[-1])
+        cut = next(start for start in starts if start >= aligned)
+
+        summary = await self._summary(history, cut)
+        if summary is None:
+            return pinned + history[sliding_window(history, budget):]
+        return pinned + [summary_message(summary)] + history[cut:]
+
+    async def _summary(self, history: List[Dict], cut: int) -> Optional[str]:
+        """Summary of ``history[:cut]``, extending the longest cached summary of a shorter prefix"""
+        hashes = _prefix_hashes(history[:cut])
+        cached = self.summary_cache.get(hashes[cut])
+        if cached is not None:
+            return cached
+
+        start, previous = 0, ""
+        for i in range(cut - 1, 0, -1):
+            value = self.summary_cache.get(hashes[i])
+            if value is not None:
+                start, previous = i, value
+                break
+        try:
+            summary = await self.summarize(previous, history[start:cut])
+        except Exception:
+            return None
+        if not summary:
+            return None
+        self.summary_cache.set(hashes[cut], summary)
+        return summary
+
+def render_transcript(messages: List[Dict]) -> str:
+    lines = []
+    for message in messages:
+        if message.get("role") == "tool":
+            lines.append(f"tool ({message.get('name', '')}): {message.get('content', '')[:500]}")
+        elif message.get("content"):
+            lines.append(f"{message['role']}: {message['content']}")
+    return "\n\n".join(lines)
+
+async def summarize_with_inception(
+    client: httpx.AsyncClient,
+    api_key: str,
+    previous_summary: str,
+    messages: List[Dict],
+    budget: Optional[Budget] = None,
+    admission: Optional[AdmissionController] = None,
+    parent: SpanLike = NOOP_SPAN
+) -> str:
+    """Extend ``previous_summary`` with ``messages`` using a short non-streaming completion.
+
+    Like every Inception call of a request, it waits for ``admission`` and
+    spends the request's ``budget``: it runs on a fork limited to the tokens
+    and time left, and what it used is charged back.
+    """
+    transcript = render_transcript(messages)
+    if previous_summary:
+        transcript = f"Earlier summary:\n{previous_summary}\n\nConversation:\n{transcript}"
+    call_budget = budget.fork() if budget else None
+    max_tokens = min(SUMMARY_MAX_TOKENS, call_budget.remaining_tokens()) if call_budget else SUMMARY_MAX_TOKENS
+    if max_tokens <= 0:
+        return ""
+    with parent.child("inception.completion", KIND_CLIENT, mode="summary") as span:
+        span.set("gen_ai.system", "inception")
+        caller = client_id(api_key)
+        if admission:
+            await admission.acquire(caller, call_budget.remaining_time() if call_budget else None)
+        if call_budget:
+            call_budget.start_call()
+        response = await client.post(
+            INCEPTION_API_URL,
+            headers=inception_headers(api_key),
+            json={
+                "model": "mercury-coder",
+                "messages": [
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": transcript}
+                ],
+                "max_tokens": max_tokens
+            },
+            timeout=min(20.0, call_budget.remaining_time()) if call_budget else 20
+        )
+        span.set("http.response.status_code", response.status_code)
+        if admission and response.status_code in (429, 503):
+            # No retry: the turn goes on with a plain sliding window, but the key backs off
+            admission.backoff(caller, parse_retry_after(response.headers.get("retry-after")), 0)
+        response.raise_for_status()
+        body = response.json()
+        summary = body["choices"][0]["message"]["content"].strip()
+        if call_budget:
+            usage = (body.get("usage") or {}).get("completion_tokens")
+            if usage is not None:
+                call_budget.record_usage(usage)
+            else:
+                call_budget.add_output(summary)
+            budget.merge(call_budget)
+            span.set("gen_ai.usage.output_tokens", call_budget.call_tokens)
+        return summary
@@ -0,0 +1,78 @@
+import asyncio
+from typing import AsyncIterator, Callable, Dict, Any
+from fastapi import Request
+
+# How often to check whether the client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+class StreamStats:
+    """Counters for /chat streams, including those abandoned by the client"""
+
+    def __init__(self):
+        self.started = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.tokens_saved = 0
+        # Events a lagging reader skipped because a later one superseded them, and writes saved by joining the rest
+        self.superseded = 0
+        self.coalesced_writes = 0
+
+    def record_cancel(self, tokens_saved: int):
+        self.cancelled += 1
+        self.tokens_saved += tokens_saved
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "tokens_saved": self.tokens_saved,
+            "superseded": self.superseded,
+            "coalesced_writes": self.coalesced_writes,
+        }
+
+async def cancel_on_disconnect(
+    request: Request,
+    chunks: AsyncIterator[bytes],
+    stats: StreamStats,
+    tokens_left: Callable[[], int],
+    poll_interval: float = DISCONNECT_POLL_INTERVAL
+) -> AsyncIterator[bytes]:
+    """Relay ``chunks`` until the client disconnects, then cancel the producer.
+
+    The producer is cancelled at whatever it is awaiting (an upstream read, a
+    tool call), so its ``async with`` blocks close the upstream response and
+    pending tool tasks are cancelled within ``poll_interval`` of the client
+    going away, even while nothing is being sent. ``tokens_left`` gives the
+    unspent output budget, counted as saved when a stream is cancelled.
+    """
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(poll_interval)
+
+    stats.started += 1
+    watcher = asyncio.ensure_future(watch())
+    next_chunk = None
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.wait({next_chunk, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                break
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                stats.completed += 1
+                return
+            yield chunk
+    except asyncio.CancelledError:
+        # The server noticed the disconnect first and cancelled the response
+        stats.record_cancel(tokens_left())
+        raise
+    finally:
+        watcher.cancel()
+        if next_chunk is not None and not next_chunk.done():
+            next_chunk.cancel()
+            await asyncio.gather(next_chunk, return_exceptions=True)
+        await chunks.aclose()
+    stats.record_cancel(tokens_left())
@@ -0,0 +1,71 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
+
+# Events passed between the chat generators. Nothing below the HTTP boundary
+# formats or parses SSE; ``protocol.EventEncoder`` serializes each event once.
+
+@dataclass
+class TextDelta:
+    """Streaming-mode text appended to the answer"""
+    text: str
+
+@dataclass
+class TextSnapshot:
+    """Streaming-mode answer rewritten as a whole (e.g. when tool results come in)"""
+    content: str
+
+@dataclass
+class DiffusionFrame:
+    """The full text of one diffusing-mode frame"""
+    content: str
+
+@dataclass
+class Committed:
+    """The leading ``text`` of the diffusion output is final; later frames carry only what follows it"""
+    text: str
+
+@dataclass
+class Uncommitted:
+    """A frame changed committed text: everything committed so far goes back into the frames"""
+
+@dataclass
+class ToolCallStarted:
+    """The model finished its turn by requesting tool calls.
+
+    Yielded by ``stream_inception_response`` so the orchestrator can run the
+    tools without asking the model a second time. Not sent to the client.
+    """
+    content: str
+    tool_calls: List[Dict] = field(default_factory=list)
+
+@dataclass
+class ToolResult:
+    """Outcome of one tool call; ``index`` is its position in the model's tool_calls list"""
+    index: int
+    tool_call: Dict
+    query: str
+    result: Dict
+    duration: float = 0.0
+
+@dataclass
+class Queued:
+    """The upstream call is waiting for admission; sent to the client as progress"""
+    position: int
+    waiting: int
+    waited: float
+
+@dataclass
+class Truncated:
+    """The request budget ran out; ``reason`` says which limit was hit"""
+    reason: str
+
+@dataclass
+class Error:
+    message: str
+    retry_after: Optional[float] = None
+
+@dataclass
+class Done:
+    """End of one upstream completion, or of the whole response"""
+
+Event = Union[TextDelta, TextSnapshot, DiffusionFrame, Committed, Uncommitted, ToolCallStarted, ToolResult, Queued, Truncated, Error, Done]
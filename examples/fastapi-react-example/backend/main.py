@@ -1,13 +1,138 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hmac
+import math
+import os
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-import requests
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import httpx
 import json
 import time
-from typing import Dict, Any, Generator, Tuple, List
+from typing import Dict, Any, AsyncGenerator, AsyncIterator, Callable, Tuple, List, Optional
+import config
+from admission import AdmissionController, AdmissionRejected, client_id, parse_retry_after
+from budget import Budget
+from cache import KeyValidationCache, SearchCache, TTLCache
+from completion_cache import CompletionCache, StreamRecorder, replay_chunks
+from context import ContextManager, summarize_with_inception
+from disconnect import StreamStats, cancel_on_disconnect
+from events import DiffusionFrame, Done, Error, Event, Queued, TextDelta, TextSnapshot, ToolCallStarted, ToolResult, Truncated
+from metrics import CHAT_REQUESTS, REGISTRY, ChatMeter, Family, StreamMeter
 from models import ChatRequest, ApiKeyValidation, Message
+from protocol import EventEncoder, resolve_protocol
+from resume import ReplayRegistry, ResumeGap, parse_last_event_id
+from semantic_index import MinHashIndex
+from shared_state import MemoryStore, open_store, run_purger
+from speculation import SpeculationStats, SpeculativeGeneration
+from stable_prefix import StablePrefix
+from sse_parser import Chunk, aiter_chunks, merge_tool_call_deltas
+from tools import TOOL_TURN_TIMEOUT, execute_tool_calls, get_tools
+from tracing import KIND_CLIENT, NOOP_SPAN, FileExporter, OTLPExporter, SpanLike, Tracer, otlp_request, waterfall
+from upstream import INCEPTION_API_URL, TAVILY_API_URL, PoolStats, create_http_client, inception_headers, pool_usage, warm_up
 
-app = FastAPI(title="dLLM Demo API")
+def shared_store(namespace: str, path: Optional[str] = None):
+    """Store for one cache namespace on the SHARED_STATE backend; a per-cache SQLite path wins"""
+    if config.SHARED_STATE == "sqlite":
+        path = path or config.SHARED_STATE_PATH
+    return open_store(config.SHARED_STATE, namespace, path, config.SHARED_STATE_URL)
+
+def state_metrics(state) -> Callable[[], List[Family]]:
+    """Scrape-time metrics read from the caches, connection pools and admission queue"""
+    def collect() -> List[Family]:
+        caches = {"search": state.search_cache.stats(), "api_key": state.key_cache.stats(), "completion": state.completion_cache.stats()}
+        hits = [({"cache": name}, stats["hits"] + stats.get("disk_hits", 0) + stats.get("store_hits", 0) + stats.get("semantic_hits", 0)) for name, stats in caches.items()]
+        pools = {"inception": pool_usage(state.http_client), "tavily": pool_usage(state.search_client)}
+        return [
+            ("dllm_cache_hits_total", "counter", "Cache lookups answered from any tier (memory, shared store, near-duplicate)", hits),
+            ("dllm_cache_misses_total", "counter", "Cache lookups that went upstream", [({"cache": name}, stats["misses"]) for name, stats in caches.items()]),
+            ("dllm_cache_entries", "gauge", "Entries in each in-process cache", [({"cache": name}, stats["size"]) for name, stats in caches.items()]),
+            ("dllm_upstream_pool_connections", "gauge", "Open upstream connections by pool and state (active or idle)",
+             [({"pool": pool, "state": kind}, count) for pool, usage in pools.items() for kind, count in usage.items()]),
+            ("dllm_upstream_pool_size", "gauge", "Maximum connections per upstream pool",
+             [({"pool": "inception"}, config.INCEPTION_POOL_SIZE), ({"pool": "tavily"}, config.TAVILY_POOL_SIZE)]),
+            ("dllm_admission_waiting", "gauge", "Inception API calls waiting for admission", [({}, state.admission.stats()["waiting"])]),
+            ("dllm_admission_rejected_total", "counter", "Inception API calls rejected by admission control", [({}, state.admission.rejected)]),
+        ]
+    return collect
+
+def create_tracer() -> Optional[Tracer]:
+    """Request tracer with the configured exporters, or None when tracing is off"""
+    if not config.TRACING:
+        return None
+    exporters = []
+    if config.TRACE_FILE:
+        exporters.append(FileExporter(config.TRACE_FILE, config.TRACE_SERVICE_NAME))
+    if config.TRACE_OTLP_ENDPOINT:
+        exporters.append(OTLPExporter(config.TRACE_OTLP_ENDPOINT, config.TRACE_SERVICE_NAME))
+    return Tracer(config.TRACE_BUFFER_SIZE, exporters)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the pooled upstream HTTP clients, caches and shared state for the lifetime of the app"""
+    app.state.pool_stats = {"inception": PoolStats(), "tavily": PoolStats()}
+    app.state.http_client = create_http_client(config.INCEPTION_POOL_SIZE, config.UPSTREAM_HTTP2, config.UPSTREAM_KEEPALIVE_EXPIRY, app.state.pool_stats["inception"])
+    app.state.search_client = create_http_client(config.TAVILY_POOL_SIZE, config.UPSTREAM_HTTP2, config.UPSTREAM_KEEPALIVE_EXPIRY, app.state.pool_stats["tavily"])
+    semantic_index = MinHashIndex(config.SEMANTIC_CACHE_THRESHOLD, maxsize=config.SEARCH_CACHE_SIZE) if config.SEMANTIC_SEARCH_CACHE else None
+    app.state.search_cache = SearchCache(config.SEARCH_CACHE_SIZE, config.SEARCH_CACHE_TTL, shared_store("search_cache", config.SEARCH_CACHE_PATH), semantic_index)
+    app.state.key_cache = KeyValidationCache(config.API_KEY_CACHE_TTL, config.API_KEY_FAILURE_TTL, config.API_KEY_CACHE_SECRET, store=shared_store("api_key_cache"))
+    app.state.stream_stats = StreamStats()
+    app.state.speculation_stats = SpeculationStats()
+    app.state.summary_cache = TTLCache(1024, config.CONTEXT_SUMMARY_TTL)
+    app.state.completion_cache = CompletionCache(
+        config.COMPLETION_CACHE_SIZE,
+        config.COMPLETION_CACHE_TTL,
+        shared_store("completion_cache", config.COMPLETION_CACHE_PATH),
+        config.API_KEY_CACHE_SECRET,
+        config.COMPLETION_CACHE_MAX_BYTES
+    )
+    # Request totals add up across all workers on a shared backend
+    app.state.counters = shared_store("counters") or MemoryStore()
+    # Rate limits are per deployment, but the token buckets live in each worker, which enforces
+    # an even share; a worker that gets more than its share of traffic queues while others idle
+    app.state.admission = AdmissionController(
+        config.UPSTREAM_RATE_LIMIT / config.WORKERS,
+        max(config.UPSTREAM_BURST / config.WORKERS, 1),
+        config.UPSTREAM_KEY_RATE_LIMIT / config.WORKERS,
+        max(config.UPSTREAM_KEY_BURST / config.WORKERS, 1),
+        config.ADMISSION_QUEUE_SIZE,
+        config.ADMISSION_MAX_WAIT,
+        config.UPSTREAM_RETRY_BASE
+    )
+    app.state.tracer = create_tracer()
+    app.state.replay = ReplayRegistry(config.RESUME_MAX_STREAMS, config.RESUME_BUFFER_BYTES, config.RESUME_GRACE, app.state.stream_stats, config.STREAM_COALESCING) if config.RESUMABLE_STREAMS else None
+    sweeper = asyncio.create_task(app.state.replay.run_sweeper()) if app.state.replay else None
+    stores = [store for store in (app.state.search_cache.store, app.state.key_cache.store, app.state.completion_cache.store, app.state.counters) if store is not None]
+    purger = asyncio.create_task(run_purger(stores, config.STORE_PURGE_INTERVAL, config.STORE_MAX_ROWS))
+    collector = state_metrics(app.state)
+    REGISTRY.add_collector(collector)
+    if config.WARMUP_CONNECTIONS > 0:
+        await asyncio.gather(
+            warm_up(app.state.http_client, INCEPTION_API_URL, config.WARMUP_CONNECTIONS, config.WARMUP_TIMEOUT),
+            warm_up(app.state.search_client, TAVILY_API_URL, config.WARMUP_CONNECTIONS, config.WARMUP_TIMEOUT)
+        )
+    try:
+        yield
+    finally:
+        REGISTRY.remove_collector(collector)
+        purger.cancel()
+        if app.state.replay:
+            sweeper.cancel()
+            await app.state.replay.aclose()
+        await app.state.http_client.aclose()
+        await app.state.search_client.aclose()
+        app.state.search_cache.close()
+        app.state.key_cache.close()
+        app.state.completion_cache.close()
+        app.state.counters.close()
+        if app.state.tracer:
+            await app.state.tracer.aclose()
+
+app = FastAPI(title="dLLM Demo API", lifespan=lifespan)
+
+SEARCHING_TEXT = '\n\n🔍 **Searching...**\n\n'
+# Upstream answers that mean "not now" rather than "never": retried after a backoff
+RETRYABLE_STATUS = (429, 503)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,250 +140,251 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Read by the frontend: X-Stream-ID to resume a dropped stream, Retry-After on 429s
+    expose_headers=["X-Stream-ID", "X-Stream-Protocol", "X-Request-ID", "Retry-After"],
 )
 
-def search_web(query: str, api_key: str, max_results: int = 3) -> Dict[str, Any]:
-    """Search the web using Tavily API"""
-    try:
-        response = requests.post(
-            'https://api.tavily.com/search',
-            headers={'Content-Type': 'application/json'},
-            json={
-                'api_key': api_key,
-                'query': query,
-                'search_depth': 'basic',
-                'include_answer': True,
-                'max_results': max_results,
-                'include_raw_content': False
-            },
-            timeout=15
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            results = []
-            for result in data.get('results', []):
-                results.append({
-                    'title': result.get('title', ''),
-                    'url': result.get('url', ''),
-                    'content': result.get('content', '')
-                })
-            
-            return {
-                'answer': data.get('answer', ''),
-                'results': results,
-                'query': query
-            }
-        else:
-            return {"error": f"Search failed with status: {response.status_code}"}
-            
-    except Exception as e:
-        return {"error": f"Search error: {str(e)}"}
+def search_result_markdown(tool_result: ToolResult) -> str:
+    """Render one web search result for the streaming transcript"""
+    search_result = tool_result.result
+    if 'error' in search_result:
+        return f"❌ {search_result['error']}"
+    
+    result_text = f"**Search Results for: {tool_result.query}**\n\n"
+    if search_result.get('answer'):
+        result_text += f"**Quick Answer:** {search_result['answer']}\n\n"
+    if search_result.get('results'):
+        result_text += "**Sources:**\n"
+        for i, item in enumerate(search_result['results'][:3], 1):
+            title = item.get('title', 'No title')
+            content = item.get('content', '')[:150] + "..." if len(item.get('content', '')) > 150 else item.get('content', '')
+            url = item.get('url', '')
+            result_text += f"{i}. **{title}**\n   {content}\n   🔗 {url}\n\n"
+    return result_text
 
-def get_tools():
-    """Get tools definition"""
-    return [{
-        "type": "function",
-        "function": {
-            "name": "web_search",
-            "description": "Search the web for current information on any topic",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "query": {"type": "string", "description": "The search query"},
-                    "max_results": {"type": "integer", "description": "Max results (default: 3)", "default": 3}
-                },
-                "required": ["query"]
-            }
-        }
-    }]
+def upstream_max_tokens(budget: Optional[Budget]) -> int:
+    """Output tokens to request from the next upstream call"""
+    return budget.remaining_tokens() if budget else config.MAX_OUTPUT_TOKENS
 
-def get_tool_calls_without_diffusing(messages: List[Dict], api_key: str) -> Tuple[str, List[Dict]]:
+def completion_span(parent: SpanLike, mode: str) -> SpanLike:
+    """Client span for one Inception API completion"""
+    span = parent.child("inception.completion", KIND_CLIENT, mode=mode)
+    span.set("gen_ai.system", "inception")
+    return span
+
+def upstream_timeout(budget: Optional[Budget]) -> Optional[float]:
+    """Per-read timeout for the next upstream call, bounded by the request deadline"""
+    return min(60.0, budget.remaining_time()) if budget else None
+
+async def get_tool_calls_without_diffusing(client: httpx.AsyncClient, messages: List[Dict], api_key: str, budget: Optional[Budget] = None, admission: Optional[AdmissionController] = None, parent: SpanLike = NOOP_SPAN) -> Tuple[str, List[Dict]]:
     """Step 1: Get tool calls without diffusing"""
+    span = completion_span(parent, "tool_check")
+    meter = StreamMeter("tool_check", span)
     try:
         payload = {
             "model": "mercury-coder",
             "messages": messages,
-            "max_tokens": 4000,
+            "max_tokens": upstream_max_tokens(budget),
             "stream": True,
             "diffusing": False,
             "tools": get_tools()
         }
+        if budget:
+            budget.start_call()
         
-        response = requests.post(
-            'https://api.inceptionlabs.ai/v1/chat/completions',
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {api_key}'
-            },
-            json=payload,
-            stream=True
-        )
+        caller = client_id(api_key)
+        attempts = config.UPSTREAM_MAX_RETRIES + 1 if admission else 1
+        for attempt in range(attempts):
+            if admission:
+                await admission.acquire(caller, budget.remaining_time() if budget else None)
+            meter.send()
+            async with client.stream('POST', INCEPTION_API_URL, headers=inception_headers(api_key), json=payload, timeout=upstream_timeout(budget)) as response:
+                meter.response(response.status_code)
+                if response.status_code in RETRYABLE_STATUS and attempt < attempts - 1:
+                    admission.backoff(caller, parse_retry_after(response.headers.get("retry-after")), attempt)
+                    continue
+                if response.status_code != 200:
+                    span.error(f"HTTP {response.status_code}")
+                    return f"Error: API request failed with status {response.status_code}", []
+                
+                full_response = ""
+                tool_calls = []
+                
+                async for chunk in aiter_chunks(response.aiter_bytes()):
+                    if chunk.done:
+                        break
+                    if budget and budget.exhausted():
+                        # Leaving the block closes the upstream stream; half-streamed tool calls are unusable
+                        return full_response, []
+                    
+                    content = chunk.delta.get("content")
+                    if content:
+                        full_response += content
+                        meter.output(len(content))
+                        if budget:
+                            budget.add_output(content)
+                    
+                    if chunk.delta.get("tool_calls"):
+                        arguments = merge_tool_call_deltas(tool_calls, chunk.delta["tool_calls"])
+                        meter.output(len(arguments))
+                        if budget:
+                            budget.add_output(arguments)
+                
+                span.set("tool_calls", len(tool_calls))
+                return full_response, tool_calls
+            
+    except Exception as e:
+        span.error(str(e))
+        return f"Error: {str(e)}", []
+    finally:
+        meter.close()
+        span.end()
+
+async def relay_completion(chunks: AsyncIterator[Chunk], diffusing: bool, budget: Optional[Budget] = None, recorder: Optional[StreamRecorder] = None, meter: Optional[StreamMeter] = None) -> AsyncGenerator[Event, None]:
+    """Turn completion chunks, live or replayed from the cache, into chat events; ``meter`` times live streams"""
+    tool_calls_data = []
+    parts: List[str] = []
+    
+    async for chunk in chunks:
+        if recorder:
+            recorder.add(chunk)
+        if chunk.done:
+            if meter:
+                meter.close()
+            yield Done()
+            break
+        reason = budget and budget.exhausted()
+        if reason:
+            if meter:
+                meter.close()
+            # Returning closes the upstream stream so it stops generating
+            yield Truncated(reason)
+            return
         
-        if response.status_code != 200:
-            return f"Error: API request failed with status {response.status_code}", []
+        if budget and chunk.usage:
+            budget.record_usage(chunk.usage.get('completion_tokens', 0))
         
-        full_response = ""
-        tool_calls = []
+        content = chunk.delta.get('content')
+        if diffusing:
+            if content is not None:
+                if budget:
+                    budget.set_output(content)
+                if meter:
+                    meter.frame(len(content))
+                yield DiffusionFrame(content)
+            continue
         
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    data_str = line[6:]
-                    if data_str.strip() == '[DONE]':
-                        break
-                    if data_str.startswith('{'):
-                        try:
-                            data = json.loads(data_str)
-                            choice = data.get("choices", [{}])[0]
-                            delta = choice.get("delta", {})
-                            
-                            # Handle content
-                            if "content" in delta and delta["content"]:
-                                content = delta["content"]
-                                full_response += content
-                            
-                            # Handle tool calls
-                            if "tool_calls" in delta and delta["tool_calls"]:
-                                for tool_call in delta["tool_calls"]:
-                                    index = tool_call.get("index", 0)
-                                    
-                                    while len(tool_calls) <= index:
-                                        tool_calls.append({
-                                            "id": "",
-                                            "type": "function",
-                                            "function": {"name": "", "arguments": ""}
-                                        })
-                                    
-                                    if "id" in tool_call:
-                                        tool_calls[index]["id"] = tool_call["id"]
-                                    
-                                    if "function" in tool_call:
-                                        func = tool_call["function"]
-                                        if "name" in func:
-                                            tool_calls[index]["function"]["name"] = func["name"]
-                                        if "arguments" in func:
-                                            tool_calls[index]["function"]["arguments"] += func["arguments"]
-                                            
-                        except json.JSONDecodeError:
-                            continue
+        # Handle regular content
+        if content:
+            if budget:
+                budget.add_output(content)
+            if meter:
+                meter.output(len(content))
+            parts.append(content)
+            yield TextDelta(content)
         
-        return full_response, tool_calls
+        # Handle tool calls
+        if chunk.delta.get('tool_calls'):
+            arguments = merge_tool_call_deltas(tool_calls_data, chunk.delta['tool_calls'])
+            if budget:
+                budget.add_output(arguments)
+            if meter:
+                meter.output(len(arguments))
         
-    except Exception as e:
-        return f"Error: {str(e)}", []
+        if chunk.finish_reason == 'tool_calls' and tool_calls_data:
+            if meter:
+                meter.close()
+            yield ToolCallStarted("".join(parts), tool_calls_data)
+            return
 
-def stream_inception_response(messages: List[Dict], api_key: str, diffusing: bool = False, tools: List[Dict] = None) -> Generator[str, None, None]:
-    """Stream response from Inception API"""
+async def stream_inception_response(client: httpx.AsyncClient, messages: List[Dict], api_key: str, diffusing: bool = False, tools: List[Dict] = None, budget: Optional[Budget] = None, cache: Optional[CompletionCache] = None, cache_read: bool = True, admission: Optional[AdmissionController] = None, parent: SpanLike = NOOP_SPAN) -> AsyncGenerator[Event, None]:
+    """Stream response events from Inception API, ending with ToolCallStarted if the model calls tools.
+
+    When the budget runs out the upstream stream is closed and Truncated is yielded instead of Done.
+    With a completion cache, a recorded stream for the same request is replayed instead of calling upstream;
+    ``cache_read=False`` drops the recording and stores a fresh one.
+    With an admission controller the call waits for its turn (yielding Queued meanwhile), and 429/503
+    answers are retried up to UPSTREAM_MAX_RETRIES times after their Retry-After.
+    The call is traced as an ``inception.completion`` span under ``parent``.
+    """
+    mode = "diffusing" if diffusing else "streaming"
+    span = completion_span(parent, mode)
+    meter = StreamMeter(mode, span)
     try:
         payload = {
             "model": "mercury-coder",
             "messages": messages,
-            "max_tokens": 4000,
+            "max_tokens": upstream_max_tokens(budget),
             "stream": True,
             "diffusing": diffusing
         }
         
         if tools:
             payload["tools"] = tools
+        if budget:
+            budget.start_call()
+            reason = budget.exhausted()
+            if reason:
+                yield Truncated(reason)
+                return
         
-        response = requests.post(
-            'https://api.inceptionlabs.ai/v1/chat/completions',
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {api_key}'
-            },
-            json=payload,
-            stream=True
-        )
-        
-        if response.status_code != 200:
-            yield f"data: {json.dumps({'error': f'API request failed with status {response.status_code}'})}\n\n"
-            return
+        if cache:
+            key = cache.key(payload, api_key)
+            span.set("cache", "miss" if cache_read else "refresh")
+            if cache_read:
+                recording = await cache.get(key)
+                if recording is not None:
+                    span.set("cache", "hit")
+                    async for event in relay_completion(replay_chunks(recording, config.COMPLETION_CACHE_REPLAY_SPEED), diffusing, budget):
+                        yield event
+                    return
+            else:
+                await cache.delete(key)
         
-        if diffusing:
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        data_str = line[6:]
-                        if data_str.strip() == '[DONE]':
-                            yield "data: [DONE]\n\n"
-                            break
-                        if data_str.startswith('{'):
-                            try:
-                                data = json.loads(data_str)
-                                if 'choices' in data and len(data['choices']) > 0:
-                                    delta = data['choices'][0].get('delta', {})
-                                    content = delta.get('content', '')
-                                    if content is not None:
-                                        yield f"data: {json.dumps({'content': content, 'mode': 'diffusing'})}\n\n"
-                            except json.JSONDecodeError:
-                                continue
-        else:
-            accumulated_content = ""
-            tool_calls_data = []
-            
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        data_str = line[6:]
-                        if data_str.strip() == '[DONE]':
-                            yield "data: [DONE]\n\n"
-                            break
-                        if data_str.startswith('{'):
-                            try:
-                                data = json.loads(data_str)
-                                if 'choices' in data and len(data['choices']) > 0:
-                                    choice = data['choices'][0]
-                                    delta = choice.get('delta', {})
-                                    
-                                    # Handle regular content
-                                    content = delta.get('content', '')
-                                    if content:
-                                        accumulated_content += content
-                                        yield f"data: {json.dumps({'content': accumulated_content, 'mode': 'streaming'})}\n\n"
-                                    
-                                    # Handle tool calls
-                                    tool_calls = delta.get('tool_calls')
-                                    if tool_calls is not None:
-                                        for tool_call in tool_calls:
-                                            idx = tool_call.get('index', 0)
-                                            
-                                            while len(tool_calls_data) <= idx:
-                                                tool_calls_data.append({'function': {'name': '', 'arguments': ''}})
-                                            
-                                            if 'function' in tool_call:
-                                                if 'name' in tool_call['function']:
-                                                    tool_calls_data[idx]['function']['name'] = tool_call['function']['name']
-                                                if 'arguments' in tool_call['function']:
-                                                    tool_calls_data[idx]['function']['arguments'] += tool_call['function']['arguments']
-                                    
-                                    finish_reason = choice.get('finish_reason')
-                                    if finish_reason == 'tool_calls' and tool_calls_data:
-                                        search_text = '\n\n🔍 **Searching...**\n\n'
-                                        yield f"data: {json.dumps({'content': accumulated_content + search_text, 'mode': 'streaming'})}\n\n"
-                                        return 
-                                        
-                            except json.JSONDecodeError:
-                                continue
-                                
+        caller = client_id(api_key)
+        attempts = config.UPSTREAM_MAX_RETRIES + 1 if admission else 1
+        for attempt in range(attempts):
+            if admission:
+                async for queued in admission.admit(caller, budget.remaining_time() if budget else None):
+                    span.event("queued", position=queued.position)
+                    yield queued
+            meter.send()
+            async with client.stream('POST', INCEPTION_API_URL, headers=inception_headers(api_key), json=payload, timeout=upstream_timeout(budget)) as response:
+                meter.response(response.status_code)
+                if response.status_code in RETRYABLE_STATUS and attempt < attempts - 1:
+                    # Pause this key for Retry-After; the next admission waits it out and reports progress
+                    admission.backoff(caller, parse_retry_after(response.headers.get("retry-after")), attempt)
+                    continue
+                if response.status_code != 200:
+                    span.error(f"HTTP {response.status_code}")
+                    yield Error(f'API request failed with status {response.status_code}')
+                    return
+                
+                recorder = StreamRecorder() if cache else None
+                async for event in relay_completion(aiter_chunks(response.aiter_bytes()), diffusing, budget, recorder, meter):
+                    # Store as soon as the answer is complete; callers stop reading after tool calls
+                    if recorder and recorder.complete:
+                        await cache.put(key, recorder.chunks)
+                        recorder = None
+                    yield event
+                return
+    
+    except AdmissionRejected as e:
+        span.error(str(e))
+        yield Error(str(e), e.retry_after)
     except Exception as e:
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        span.error(str(e))
+        yield Error(str(e))
+    finally:
+        meter.close()
+        span.end()
 
-@app.post("/validate-api-key")
-async def validate_api_key(request: ApiKeyValidation):
-    """Validate Inception Labs API key"""
+async def check_api_key(client: httpx.AsyncClient, api_key: str) -> Tuple[Dict[str, Any], bool]:
+    """Validate an API key upstream; the flag says whether a failure is definitive (worth caching)"""
     try:
-        response = requests.post(
-            'https://api.inceptionlabs.ai/v1/chat/completions',
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {request.api_key}'
-            },
+        response = await client.post(
+            INCEPTION_API_URL,
+            headers=inception_headers(api_key),
             json={
                 'model': 'mercury-coder',
                 'messages': [{"role": "user", "content": "Hi"}],
@@ -267,101 +393,247 @@ async def validate_api_key(request: ApiKeyValidation):
             timeout=10
         )
         if response.status_code == 200:
-            return {"valid": True, "error": None}
+            return {"valid": True, "error": None}, True
         else:
             try:
                 error_data = response.json()
                 error_msg = error_data.get("error", f"API request failed with status {response.status_code}")
             except:
                 error_msg = f"API request failed with status {response.status_code}"
-            return {"valid": False, "error": error_msg}
+            # Rate limits and server errors say nothing about the key itself
+            definitive = 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+            return {"valid": False, "error": error_msg}, definitive
             
-    except requests.exceptions.Timeout:
-        return {"valid": False, "error": "Request timed out"}
-    except requests.exceptions.RequestException as e:
-        return {"valid": False, "error": f"Network error: {str(e)}"}
+    except httpx.TimeoutException:
+        return {"valid": False, "error": "Request timed out"}, False
+    except httpx.HTTPError as e:
+        return {"valid": False, "error": f"Network error: {str(e)}"}, False
     except Exception as e:
-        return {"valid": False, "error": f"Unexpected error: {str(e)}"}
+        return {"valid": False, "error": f"Unexpected error: {str(e)}"}, False
+
+@app.post("/validate-api-key")
+async def validate_api_key(request: ApiKeyValidation, http_request: Request):
+    """Validate Inception Labs API key"""
+    client = http_request.app.state.http_client
+    return await http_request.app.state.key_cache.get_or_validate(
+        request.api_key,
+        lambda: check_api_key(client, request.api_key)
+    )
+
+@app.get("/stats")
+async def stats(http_request: Request):
+    """Cache, stream, speculation and connection pool counters for monitoring.
+
+    Everything but ``shared`` is per worker process; ``worker`` says which one answered.
+    """
+    counters = http_request.app.state.counters
+    chat_requests = await asyncio.get_running_loop().run_in_executor(None, counters.get, "chat_requests")
+    return {
+        "worker": os.getpid(),
+        "shared": {"backend": config.SHARED_STATE, "chat_requests": chat_requests[0] if chat_requests else 0},
+        "search_cache": http_request.app.state.search_cache.stats(),
+        "api_key_cache": http_request.app.state.key_cache.stats(),
+        "completion_cache": http_request.app.state.completion_cache.stats(),
+        "streams": http_request.app.state.stream_stats.stats(),
+        "replay": http_request.app.state.replay.stats() if http_request.app.state.replay else None,
+        "speculation": http_request.app.state.speculation_stats.stats(),
+        "admission": http_request.app.state.admission.stats(),
+        "http_pools": {name: pool.stats() for name, pool in http_request.app.state.pool_stats.items()}
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    if not REGISTRY.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def debug_tracer(http_request: Request) -> Tracer:
+    """The tracer, for callers presenting ``Authorization: Bearer <TRACE_DEBUG_TOKEN>``"""
+    tracer = http_request.app.state.tracer
+    if tracer is None or not config.TRACE_DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Tracing or TRACE_DEBUG_TOKEN is not enabled")
+    scheme, _, token = http_request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), config.TRACE_DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="A valid trace debug token is required", headers={"WWW-Authenticate": "Bearer"})
+    return tracer
+
+@app.get("/debug/trace")
+async def recent_traces(http_request: Request):
+    """Request ids of the traces held for /debug/trace/{request_id}, newest first"""
+    tracer = debug_tracer(http_request)
+    return [
+        {
+            "request_id": trace.request_id,
+            "trace_id": trace.trace_id,
+            "name": trace.root.name,
+            "mode": trace.root.attributes.get("mode"),
+            "outcome": trace.root.attributes.get("outcome", "running"),
+            "duration_ms": round(((trace.root.end_ns or time.time_ns()) - trace.root.start_ns) / 1e6, 1),
+            "spans": len(trace.spans),
+        }
+        for trace in tracer.recent()
+    ]
+
+@app.get("/debug/trace/{request_id}")
+async def trace_waterfall(request_id: str, http_request: Request, format: str = "text"):
+    """Waterfall of one recent request's spans; ``?format=otlp`` returns them as OTLP/JSON"""
+    trace = debug_tracer(http_request).get(request_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="No recent trace with that request id")
+    if format == "otlp":
+        return otlp_request([trace], config.TRACE_SERVICE_NAME)
+    return PlainTextResponse(waterfall(trace))
+
+def stream_headers(protocol: str) -> Dict[str, str]:
+    return {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "X-Stream-Protocol": protocol,
+    }
+
+@app.get("/chat/{stream_id}")
+async def resume_chat(stream_id: str, http_request: Request, last_event_id: Optional[str] = None):
+    """Continue a /chat stream after the event named by the ``Last-Event-ID`` header (or ``?last_event_id=``).
+
+    Answers 404 once the stream has expired or on another worker, 410 when
+    the requested events have already left the replay buffer, and 400 for
+    an id the stream has not reached.
+    """
+    replay = http_request.app.state.replay
+    stream = replay.get(stream_id) if replay else None
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired stream")
+    after = parse_last_event_id(http_request.headers.get("last-event-id") or last_event_id)
+    try:
+        stream.check(after)
+    except ResumeGap as e:
+        replay.gaps += 1
+        raise HTTPException(status_code=410, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    replay.resumed += 1
+    headers = stream_headers(stream.protocol)
+    headers["X-Stream-ID"] = stream.stream_id
+    return StreamingResponse(stream.read(after), media_type="text/plain", headers=headers)
+
+@app.delete("/chat/{stream_id}", status_code=204)
+async def cancel_chat(stream_id: str, http_request: Request):
+    """Stop a stream the client no longer wants instead of letting it run out its grace period"""
+    replay = http_request.app.state.replay
+    if not replay or not replay.cancel(stream_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired stream")
 
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """Main chat endpoint with streaming support"""
+    received = time.perf_counter()
+    # Metric label; any mode other than "streaming" is served as diffusing
+    mode = "streaming" if request.mode == "streaming" else "diffusing"
+    if http_request.app.state.admission.saturated:
+        CHAT_REQUESTS.labels(mode, "rejected").inc()
+        # Shed load before streaming starts, so clients get a real 429 they can back off on
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests are waiting for upstream capacity",
+            headers={"Retry-After": str(math.ceil(http_request.app.state.admission.retry_after()))}
+        )
+    await asyncio.get_running_loop().run_in_executor(None, http_request.app.state.counters.incr, "chat_requests")
+    client = http_request.app.state.http_client
+    search_client = http_request.app.state.search_client
+    search_cache = http_request.app.state.search_cache
+    protocol = resolve_protocol(request.stream_protocol, http_request.headers.get("x-stream-protocol"))
+    budget = Budget(min(max(request.max_tokens, 1), config.MAX_OUTPUT_TOKENS), config.REQUEST_DEADLINE, config.MAX_TOOL_HOPS)
+    completion_cache = http_request.app.state.completion_cache if config.COMPLETION_CACHE and not request.cache_bypass else None
+    admission = http_request.app.state.admission
+    upstream_options = {"cache": completion_cache, "cache_read": not request.cache_invalidate, "admission": admission}
+    tracer = http_request.app.state.tracer
+    root = tracer.start("chat", http_request.headers.get("traceparent"), mode=mode, protocol=protocol, tools=request.tools_enabled, messages=len(request.messages)) if tracer else NOOP_SPAN
+    summarize = (lambda previous, messages: summarize_with_inception(client, request.inception_api_key, previous, messages, budget, admission, root)) if config.CONTEXT_SUMMARY else None
+    context = ContextManager(config.CONTEXT_MAX_TOKENS, summarize, http_request.app.state.summary_cache)
+    
+    def relayed(event: Event) -> bool:
+        """Whether an inner completion's event goes to the client; the response ends with a single Done"""
+        return not isinstance(event, Done)
     
-    def generate_response():
+    async def generate_response() -> AsyncGenerator[Event, None]:
         try:
-            messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+            with root.child("context.fit") as span:
+                messages = await context.fit([{"role": msg.role, "content": msg.content} for msg in request.messages])
+                span.set("messages_sent", len(messages))
             
             if request.mode == "streaming":
-                tools = get_tools() if request.tools_enabled and request.tavily_api_key else None
+                tools = get_tools() if request.tools_enabled and request.tavily_api_key and budget.can_use_tools() else None
                 
                 if tools and request.tavily_api_key:
-                    accumulated_content = ""
-                    tool_calls_found = False
+                    tool_request = None
                     
-                    for chunk in stream_inception_response(messages, request.inception_api_key, False, tools):
-                        if chunk.startswith("data: "):
-                            data_str = chunk[6:].strip()
-                            if data_str == "[DONE]":
-                                break
-                            try:
-                                data = json.loads(data_str)
-                                if 'content' in data:
-                                    accumulated_content = data['content']
-                                    yield chunk
-                                    if "🔍 **Searching...**" in accumulated_content:
-                                        tool_calls_found = True
-                                        break
-                            except:
-                                continue
+                    async for event in stream_inception_response(client, messages, request.inception_api_key, False, tools, budget, **upstream_options, parent=root):
+                        if isinstance(event, ToolCallStarted):
+                            tool_request = event
+                            break
+                        if isinstance(event, Done):
+                            break
+                        yield event
                     
-                    if tool_calls_found:
-                        assistant_response, tool_calls = get_tool_calls_without_diffusing(messages, request.inception_api_key)
+                    if tool_request:
+                        yield TextDelta(SEARCHING_TEXT)
+                        # Tool calls were already parsed from the first stream; no second round-trip needed.
+                        # All searches run concurrently and each result is shown as soon as it arrives.
+                        tool_calls = tool_request.tool_calls
+                        sections = {}
+                        budget.use_tool_hop()
                         
-                        if tool_calls:
-                            for tool_call in tool_calls:
-                                if tool_call["function"]["name"] == "web_search":
-                                    try:
-                                        args = json.loads(tool_call["function"]["arguments"])
-                                        query = args.get('query', '')
-                                        search_result = search_web(query, request.tavily_api_key)
-                                        
-                                        if 'error' not in search_result:
-                                            result_text = f"**Search Results for: {query}**\n\n"
-                                            if search_result.get('answer'):
-                                                result_text += f"**Quick Answer:** {search_result['answer']}\n\n"
-                                            if search_result.get('results'):
-                                                result_text += "**Sources:**\n"
-                                                for i, item in enumerate(search_result['results'][:3], 1):
-                                                    title = item.get('title', 'No title')
-                                                    content = item.get('content', '')[:150] + "..." if len(item.get('content', '')) > 150 else item.get('content', '')
-                                                    url = item.get('url', '')
-                                                    result_text += f"{i}. **{title}**\n   {content}\n   🔗 {url}\n\n"
-                                            
-                                            final_content = accumulated_content.replace("🔍 **Searching...**", result_text)
-                                            yield f"data: {json.dumps({'content': final_content, 'mode': 'streaming'})}\n\n"
-                                        else:
-                                            error_content = accumulated_content.replace("🔍 **Searching...**", f"❌ {search_result['error']}")
-                                            yield f"data: {json.dumps({'content': error_content, 'mode': 'streaming'})}\n\n"
-                                    except:
-                                        error_content = accumulated_content.replace("🔍 **Searching...**", "❌ **Search failed**")
-                                        yield f"data: {json.dumps({'content': error_content, 'mode': 'streaming'})}\n\n"
+                        with root.child("tools", calls=len(tool_calls)) as stage:
+                            async for tool_result in execute_tool_calls(search_client, tool_calls, request.tavily_api_key, search_cache, turn_timeout=min(TOOL_TURN_TIMEOUT, budget.remaining_time()), span=stage):
+                                sections[tool_result.index] = search_result_markdown(tool_result)
+                                content = tool_request.content + "\n\n" + "".join(sections[i] + "\n\n" for i in sorted(sections))
+                                if len(sections) < len(tool_calls):
+                                    content += "🔍 **Searching...**\n\n"
+                                yield TextSnapshot(content)
                 else:
                     # Regular streaming without tools
-                    for chunk in stream_inception_response(messages, request.inception_api_key, False, None):
-                        yield chunk
+                    async for event in stream_inception_response(client, messages, request.inception_api_key, False, None, budget, **upstream_options, parent=root):
+                        if relayed(event):
+                            yield event
                         
             else:
                 # Diffusing mode with two-step approach
-                if request.tools_enabled and request.tavily_api_key:
-                    step1_text = '🔧 **Step 1: Checking if tools are needed...**\n\n'
-                    yield f"data: {json.dumps({'content': step1_text, 'mode': 'diffusing'})}\n\n"
-                    
-                    # Step 1: Get tool calls without diffusing
-                    assistant_response, tool_calls = get_tool_calls_without_diffusing(messages, request.inception_api_key)
+                if request.tools_enabled and request.tavily_api_key and budget.can_use_tools():
+                    if config.SPECULATIVE_TOOL_CHECK:
+                        # Start the diffused answer right away and decide on tools alongside it
+                        check_budget = budget.fork()
+                        
+                        with root.child("step1.speculation") as stage:
+                            async def tool_check():
+                                try:
+                                    return await get_tool_calls_without_diffusing(client, messages, request.inception_api_key, check_budget, admission, stage)
+                                finally:
+                                    budget.merge(check_budget)
+                            
+                            speculation = SpeculativeGeneration(
+                                stream_inception_response(client, messages, request.inception_api_key, True, None, budget, **upstream_options, parent=stage),
+                                tool_check(),
+                                http_request.app.state.speculation_stats,
+                                budget
+                            )
+                            async for event in speculation.stream():
+                                if relayed(event):
+                                    yield event
+                            assistant_response, tool_calls = speculation.assistant_response, speculation.tool_calls
+                            stage.set("kept", not tool_calls)
+                    else:
+                        step1_text = '🔧 **Step 1: Checking if tools are needed...**\n\n'
+                        yield DiffusionFrame(step1_text)
+                        
+                        # Step 1: Get tool calls without diffusing
+                        with root.child("step1.tool_decision") as stage:
+                            assistant_response, tool_calls = await get_tool_calls_without_diffusing(client, messages, request.inception_api_key, budget, admission, stage)
+                            stage.set("tool_calls", len(tool_calls))
                     
                     if tool_calls:
                         found_text = f'🔍 **Found {len(tool_calls)} tool call(s). Executing...**\n\n'
-                        yield f"data: {json.dumps({'content': found_text, 'mode': 'diffusing'})}\n\n"
+                        yield DiffusionFrame(found_text)
                         
                         # Execute tool calls
                         final_messages = messages.copy()
@@ -371,88 +643,133 @@ async def chat_endpoint(request: ChatRequest):
                             "tool_calls": tool_calls
                         })
                         
-                        search_results_text = ""
-                        
+                        queries = []
                         for tool_call in tool_calls:
-                            function_name = tool_call["function"]["name"]
-                            arguments = tool_call["function"]["arguments"]
-                            
-                            if function_name == "web_search":
-                                try:
-                                    function_args = json.loads(arguments)
-                                    query = function_args.get('query', '')
-                                    
-                                    searching_text = f'🔍 **Searching for: {query}**\n\n'
-                                    yield f"data: {json.dumps({'content': searching_text, 'mode': 'diffusing'})}\n\n"
-                                    
-                                    search_result = search_web(query, request.tavily_api_key)
-                                    
-                                    final_messages.append({
-                                        "role": "tool",
-                                        "tool_call_id": tool_call["id"],
-                                        "name": function_name,
-                                        "content": json.dumps(search_result)
-                                    })
-                                    
-                                    if 'error' not in search_result:
-                                        search_results_text = "🔍 **Search completed!**\n\n"
-                                        for i, result in enumerate(search_result.get('results', [])[:3], 1):
-                                            title = result.get('title', 'No title')
-                                            content = result.get('content', '')[:150] + "..." if len(result.get('content', '')) > 150 else result.get('content', '')
-                                            url = result.get('url', '')
-                                            search_results_text += f"{i}. **{title}**\n   {content}\n   🔗 {url}\n\n"
-                                        search_results_text += "**AI Response:**\n\n"
-                                        
-                                        completed_text = '✅ **Search completed! Getting final response with diffusing...**\n\n'
-                                        yield f"data: {json.dumps({'content': completed_text, 'mode': 'diffusing'})}\n\n"
-                                    else:
-                                        error_text = f'❌ **Search failed: {search_result["error"]}**\n\n'
-                                        yield f"data: {json.dumps({'content': error_text, 'mode': 'diffusing'})}\n\n"
-                                        return
-                                        
-                                except Exception as e:
-                                    error_text = f'❌ **Error: {str(e)}**\n\n'
-                                    yield f"data: {json.dumps({'content': error_text, 'mode': 'diffusing'})}\n\n"
-                                    return
+                            try:
+                                queries.append(json.loads(tool_call["function"]["arguments"]).get('query', ''))
+                            except json.JSONDecodeError:
+                                continue
+                        searching_text = f'🔍 **Searching for: {", ".join(queries)}**\n\n'
+                        yield DiffusionFrame(searching_text)
+                        
+                        # Run all searches concurrently, reporting each as it completes
+                        tool_results: List[ToolResult] = []
+                        budget.use_tool_hop()
+                        with root.child("tools", calls=len(tool_calls)) as stage:
+                            async for tool_result in execute_tool_calls(search_client, tool_calls, request.tavily_api_key, search_cache, turn_timeout=min(TOOL_TURN_TIMEOUT, budget.remaining_time()), span=stage):
+                                tool_results.append(tool_result)
+                                if 'error' not in tool_result.result:
+                                    progress_text = f'✅ **Search completed for: {tool_result.query}** ({len(tool_results)}/{len(tool_calls)})\n\n'
+                                else:
+                                    progress_text = f'❌ **Search failed: {tool_result.result["error"]}** ({len(tool_results)}/{len(tool_calls)})\n\n'
+                                yield DiffusionFrame(progress_text)
+                        
+                        tool_results.sort(key=lambda tool_result: tool_result.index)
+                        for tool_result in tool_results:
+                            final_messages.append({
+                                "role": "tool",
+                                "tool_call_id": tool_result.tool_call["id"],
+                                "name": tool_result.tool_call["function"]["name"],
+                                "content": json.dumps(tool_result.result)
+                            })
+                        
+                        successful = [tool_result.result for tool_result in tool_results if 'error' not in tool_result.result]
+                        if not successful:
+                            return
+                        
+                        search_results_text = "🔍 **Search completed!**\n\n"
+                        sources = [result for search_result in successful for result in search_result.get('results', [])[:3]]
+                        for i, result in enumerate(sources, 1):
+                            title = result.get('title', 'No title')
+                            content = result.get('content', '')[:150] + "..." if len(result.get('content', '')) > 150 else result.get('content', '')
+                            url = result.get('url', '')
+                            search_results_text += f"{i}. **{title}**\n   {content}\n   🔗 {url}\n\n"
+                        search_results_text += "**AI Response:**\n\n"
                         
                         # Step 2: Get final response with diffusing
                         step2_text = '✨ **Step 2: Generating diffused response...**\n\n'
-                        yield f"data: {json.dumps({'content': step2_text, 'mode': 'diffusing'})}\n\n"
+                        yield DiffusionFrame(step2_text)
                         
-                        for chunk in stream_inception_response(final_messages, request.inception_api_key, True, None):
-                            if chunk.startswith("data: "):
-                                data_str = chunk[6:].strip()
-                                if data_str == "[DONE]":
-                                    break
-                                try:
-                                    data = json.loads(data_str)
-                                    if 'content' in data:
-                                        complete_response = search_results_text + data['content']
-                                        yield f"data: {json.dumps({'content': complete_response, 'mode': 'diffusing'})}\n\n"
-                                except:
-                                    continue
-                    else:
+                        # aclosing: the break below must end the completion's span now, not at garbage collection
+                        with root.child("step2.generate") as stage:
+                            async with aclosing(stream_inception_response(client, final_messages, request.inception_api_key, True, None, budget, **upstream_options, parent=stage)) as events:
+                                async for event in events:
+                                    if isinstance(event, Done):
+                                        break
+                                    if isinstance(event, DiffusionFrame):
+                                        yield DiffusionFrame(search_results_text + event.content)
+                                    elif isinstance(event, (Truncated, Queued, Error)):
+                                        yield event
+                    elif not config.SPECULATIVE_TOOL_CHECK:
                         no_tools_text = 'ℹ️ **No tools needed. Getting direct response with diffusing...**\n\n'
-                        yield f"data: {json.dumps({'content': no_tools_text, 'mode': 'diffusing'})}\n\n"
-                        for chunk in stream_inception_response(messages, request.inception_api_key, True, None):
-                            yield chunk
+                        yield DiffusionFrame(no_tools_text)
+                        async for event in stream_inception_response(client, messages, request.inception_api_key, True, None, budget, **upstream_options, parent=root):
+                            if relayed(event):
+                                yield event
                 else:
                     # No tools enabled, direct diffusing
-                    for chunk in stream_inception_response(messages, request.inception_api_key, True, None):
-                        yield chunk
+                    async for event in stream_inception_response(client, messages, request.inception_api_key, True, None, budget, **upstream_options, parent=root):
+                        if relayed(event):
+                            yield event
             
-            yield "data: [DONE]\n\n"
+            yield Done()
             
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield Error(str(e))
     
+    encoder = EventEncoder(protocol)
+    # Diffusing clients that render settled text once get it as commit events, then only the changing tail
+    commits = StablePrefix(config.COMMIT_STABLE_FRAMES) if request.commit_frames and mode == "diffusing" and config.COMMIT_STABLE_FRAMES > 0 else None
+
+    async def serialize() -> AsyncIterator[bytes]:
+        """The one place events become SSE lines; encoders return None for frames that need not be sent"""
+        meter = ChatMeter(mode, received)
+        meter.start()
+        try:
+            async for event in generate_response():
+                if isinstance(event, Error):
+                    meter.outcome = "error"
+                    root.error(event.message)
+                elif isinstance(event, Truncated):
+                    meter.outcome = "truncated"
+                for part in commits.split(event) if commits else (event,):
+                    line = encoder.encode(part)
+                    if line:
+                        # Encoded here rather than by the response, so counting bytes costs nothing extra
+                        data = line.encode()
+                        meter.sent(len(data))
+                        yield data
+        except (asyncio.CancelledError, GeneratorExit):
+            meter.outcome = "cancelled"
+            raise
+        finally:
+            meter.finish()
+            root.set("outcome", meter.outcome)
+            root.set("gen_ai.usage.output_tokens", budget.tokens_used + budget.call_tokens)
+            root.set("response.bytes", meter.bytes)
+            root.end()
+    
+    headers = stream_headers(protocol)
+    if root.request_id:
+        # Look the request up at /debug/trace/{id}
+        headers["X-Request-ID"] = root.request_id
+    replay = http_request.app.state.replay
+    # Only a client that asked to resume keeps generation alive after it disconnects
+    stream = replay.start(serialize(), budget.remaining_tokens, protocol, encoder) if replay and request.resumable else None
+    if stream:
+        # Generation runs on without the connection; a dropped client resumes at GET /chat/{stream_id}
+        headers["X-Stream-ID"] = stream.stream_id
+        return StreamingResponse(stream.read(), media_type="text/plain", headers=headers)
+    # If the client goes away, generation is cancelled so upstream streams close and pending searches are dropped
     return StreamingResponse(
-        generate_response(),
+        cancel_on_disconnect(
+            http_request,
+            serialize(),
+            http_request.app.state.stream_stats,
+            budget.remaining_tokens
+        ),
         media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+        headers=headers
     )
 
 if __name__ == "__main__":
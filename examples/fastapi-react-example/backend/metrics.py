@@ -0,0 +1,329 @@
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import config
+from budget import CHARS_PER_TOKEN
+from tracing import KIND_CLIENT, NOOP_SPAN, SpanLike
+
+# Seconds, from a cached reply to a long diffused answer
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Tokens or diffusion frames per second of one stream
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# A metric family as produced by a collector: (name, type, help, [(labels, value), ...])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per bound plus +Inf; cumulated only when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class _Noop:
+    """Stands in for every labelled value when metrics are disabled"""
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def dec(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+NOOP = _Noop()
+
+class Metric:
+    """One metric family; ``labels(...)`` returns the value for one label combination.
+
+    Values are plain attributes updated from the event loop thread, so
+    recording is a dict lookup and an addition. Hot paths can keep the
+    result of ``labels`` instead of looking it up per event.
+    """
+
+    kind = ""
+
+    def __init__(self, registry: "Registry", name: str, help: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _new(self):
+        return _Value()
+
+    def labels(self, *values: str):
+        if not self.registry.enabled:
+            return NOOP
+        value = self._values.get(values)
+        if value is None:
+            value = self._values[values] = self._new()
+        return value
+
+    def _render(self, lines: List[str]):
+        for values, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(value.value)}")
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "Registry", name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render(self, lines: List[str]):
+        for values, value in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), value.counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_number(value.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+class Registry:
+    """Metrics of one worker process, rendered in the Prometheus text format.
+
+    Collectors are called at scrape time for values that already live
+    elsewhere (cache statistics, pool usage), so they cost nothing between
+    scrapes. With ``enabled=False`` every metric records into a no-op.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(self, name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(self, name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(self, name, help, labelnames, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]):
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], Iterable[Family]]):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            metric._render(lines)
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry(config.METRICS_ENABLED)
+
+CHAT_REQUESTS = REGISTRY.counter("dllm_chat_requests_total", "Chat requests by mode and outcome (completed, truncated, error, cancelled, rejected)", ("mode", "outcome"))
+CHAT_TTFB = REGISTRY.histogram("dllm_chat_ttfb_seconds", "Time from receiving a chat request to its first streamed byte", ("mode",))
+CHAT_TTLB = REGISTRY.histogram("dllm_chat_ttlb_seconds", "Time from receiving a chat request to its last streamed byte", ("mode",))
+CHAT_BYTES = REGISTRY.counter("dllm_chat_response_bytes_total", "Bytes streamed to chat clients", ("mode",))
+CHAT_IN_FLIGHT = REGISTRY.gauge("dllm_chat_streams_in_flight", "Chat responses currently streaming")
+CHAT_IN_FLIGHT.set(0)
+
+UPSTREAM_REQUESTS = REGISTRY.counter("dllm_upstream_requests_total", "Inception API calls by mode and HTTP status ('error' when no response arrived)", ("mode", "status"))
+UPSTREAM_CONNECT = REGISTRY.histogram("dllm_upstream_connect_seconds", "Time from sending an Inception API call to its response headers, including connection setup", ("mode",))
+UPSTREAM_TTFT = REGISTRY.histogram("dllm_upstream_ttft_seconds", "Time from sending an Inception API call to its first output", ("mode",))
+UPSTREAM_TOKENS = REGISTRY.counter("dllm_upstream_output_tokens_total", "Estimated output tokens streamed by the Inception API", ("mode",))
+UPSTREAM_TOKEN_RATE = REGISTRY.histogram("dllm_upstream_tokens_per_second", "Estimated output tokens per second of one Inception API stream, after the first output", ("mode",), RATE_BUCKETS)
+DIFFUSION_FRAMES = REGISTRY.counter("dllm_diffusion_frames_total", "Diffusion frames received from the Inception API")
+DIFFUSION_FRAME_RATE = REGISTRY.histogram("dllm_diffusion_frames_per_second", "Diffusion frames per second of one diffusing stream, after the first frame", (), RATE_BUCKETS)
+
+TOOL_DURATION = REGISTRY.histogram("dllm_tool_duration_seconds", "Time to run one tool call, including cache lookups", ("tool", "outcome"))
+
+class StreamMeter:
+    """Timings of one upstream completion across its attempts.
+
+    Call ``send`` before each attempt, ``response`` once its headers are in
+    and ``output`` or ``frame`` for every piece of output. ``close``, as soon
+    as the stream ends, records the rates (per-chunk calls do not read the
+    clock) and counts an attempt that never got a response as an error;
+    closing again is a no-op. With a ``span``, each attempt becomes an
+    ``inception.connect`` child span, the first output an event and the
+    token and frame counts attributes.
+    """
+
+    __slots__ = ("mode", "span", "connect", "attempts", "sent", "answered", "first", "chars", "frames")
+
+    def __init__(self, mode: str, span: SpanLike = NOOP_SPAN):
+        self.mode = mode
+        self.span = span
+        self.connect = NOOP_SPAN
+        self.attempts = 0
+        self.sent: Optional[float] = None
+        self.answered = True
+        self.first: Optional[float] = None
+        self.chars = 0
+        self.frames = 0
+
+    def _unanswered(self):
+        UPSTREAM_REQUESTS.labels(self.mode, "error").inc()
+        self.connect.error("no response")
+        self.connect.end()
+
+    def send(self):
+        if not self.answered:
+            self._unanswered()
+        self.attempts += 1
+        self.connect = self.span.child("inception.connect", KIND_CLIENT, attempt=self.attempts)
+        self.sent = time.perf_counter()
+        self.answered = False
+
+    def response(self, status: int):
+        self.answered = True
+        UPSTREAM_CONNECT.labels(self.mode).observe(time.perf_counter() - self.sent)
+        UPSTREAM_REQUESTS.labels(self.mode, str(status)).inc()
+        self.connect.set("http.response.status_code", status)
+        if status >= 400:
+            self.connect.error(f"HTTP {status}")
+        self.connect.end()
+
+    def _first_output(self):
+        self.first = time.perf_counter()
+        UPSTREAM_TTFT.labels(self.mode).observe(self.first - self.sent)
+        self.span.event("first_token")
+
+    def output(self, chars: int):
+        """Count ``chars`` characters of streamed text"""
+        if self.first is None:
+            self._first_output()
+        self.chars += chars
+
+    def frame(self, chars: int):
+        """Count a diffusion frame of ``chars`` characters, which replaces the previous one"""
+        if self.first is None:
+            self._first_output()
+        self.frames += 1
+        self.chars = chars
+
+    def close(self):
+        if not self.answered:
+            self._unanswered()
+            self.answered = True
+        if self.first is None:
+            return
+        tokens = math.ceil(self.chars / CHARS_PER_TOKEN)
+        UPSTREAM_TOKENS.labels(self.mode).inc(tokens)
+        self.span.set("gen_ai.usage.output_tokens", tokens)
+        if self.frames:
+            self.span.set("diffusion.frames", self.frames)
+        elapsed = time.perf_counter() - self.first
+        if elapsed > 0:
+            UPSTREAM_TOKEN_RATE.labels(self.mode).observe(tokens / elapsed)
+        if self.frames:
+            DIFFUSION_FRAMES.inc(self.frames)
+            if elapsed > 0:
+                DIFFUSION_FRAME_RATE.observe((self.frames - 1) / elapsed)
+        self.first = None
+
+class ChatMeter:
+    """Timings and outcome of one streamed chat response"""
+
+    __slots__ = ("mode", "received", "first", "outcome", "bytes")
+
+    def __init__(self, mode: str, received: float):
+        self.mode = mode
+        self.received = received
+        self.first: Optional[float] = None
+        self.outcome = "completed"
+        self.bytes = 0
+
+    def start(self):
+        CHAT_IN_FLIGHT.inc()
+
+    def sent(self, size: int):
+        if self.first is None:
+            self.first = time.perf_counter()
+            CHAT_TTFB.labels(self.mode).observe(self.first - self.received)
+        self.bytes += size
+
+    def finish(self):
+        CHAT_IN_FLIGHT.dec()
+        CHAT_REQUESTS.labels(self.mode, self.outcome).inc()
+        CHAT_BYTES.labels(self.mode).inc(self.bytes)
+        if self.first is not None:
+            CHAT_TTLB.labels(self.mode).observe(time.perf_counter() - self.received)
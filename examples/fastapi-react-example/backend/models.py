@@ -12,6 +12,11 @@ class ChatRequest(BaseModel):
     tavily_api_key: Optional[str] = None
     tools_enabled: bool = False
     max_tokens: int = 800
+    stream_protocol: Optional[str] = None  # "snapshot" (default) or "delta"
+    cache_bypass: bool = False  # skip the completion cache for this request
+    cache_invalidate: bool = False  # drop cached completions for this request and store fresh ones
+    commit_frames: bool = False  # diffusing: send settled leading text once as "commit" events, then only the rest
+    resumable: bool = False  # keep generating for RESUME_GRACE after a disconnect so GET /chat/{stream_id} can resume
 
 class ApiKeyValidation(BaseModel):
     api_key: str
\ No newline at end of file
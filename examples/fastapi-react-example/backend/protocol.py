@@ -0,0 +1,317 @@
+import json
+import math
+import re
+from typing import Dict, Any, List, Optional, Tuple
+from events import Committed, DiffusionFrame, Done, Error, Event, Queued, TextDelta, TextSnapshot, Truncated, Uncommitted
+
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+PROTOCOLS = (SNAPSHOT, DELTA)
+
+# Number of deltas between full-content checkpoints in delta mode
+CHECKPOINT_INTERVAL = 64
+# Number of patched diffusion frames between full keyframes in delta mode
+KEYFRAME_INTERVAL = 20
+# How far ahead (in tokens) to look for a resync point after a mismatch
+RESYNC_WINDOW = 24
+# Consecutive matching tokens required to treat a position as resynced
+RESYNC_ANCHOR = 3
+# Ops separated by at most this many unchanged characters are merged
+MERGE_GAP = 8
+
+# What an encoded line carries, so a sender that falls behind can tell which lines supersede earlier ones
+FULL_FRAME, PATCH_FRAME, FULL_TEXT, TEXT_DELTA, COMMIT = "frame", "patch", "content", "delta", "commit"
+
+_TOKEN_RE = re.compile(r'\s+|\w+|[^\w\s]')
+
+def sse(payload: Dict[str, Any]) -> str:
+    """Format a payload as a single SSE data line"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+def resolve_protocol(requested: Optional[str], header: Optional[str] = None) -> str:
+    """Pick the wire protocol from the request body field or the X-Stream-Protocol header"""
+    for value in (requested, header):
+        if value and value.lower() in PROTOCOLS:
+            return value.lower()
+    return SNAPSHOT
+
+class StreamingEncoder:
+    """Encode streaming-mode text either as accumulated snapshots or as appended deltas.
+
+    In delta mode each token is sent once as ``{"delta": ...}`` and a full
+    ``{"content": ..., "checkpoint": true}`` snapshot is sent every
+    ``checkpoint_interval`` deltas so clients can resync.
+    """
+
+    def __init__(self, protocol: str = SNAPSHOT, checkpoint_interval: int = CHECKPOINT_INTERVAL):
+        self.protocol = protocol
+        self.checkpoint_interval = checkpoint_interval
+        self._parts: List[str] = []
+        self._since_checkpoint = 0
+        # FULL_TEXT or TEXT_DELTA, for the last line returned
+        self.kind = FULL_TEXT
+
+    @property
+    def content(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def append(self, text: str) -> str:
+        """Append text and return the SSE line announcing it"""
+        self._parts.append(text)
+        if self.protocol == SNAPSHOT:
+            self.kind = FULL_TEXT
+            return sse({'content': self.content, 'mode': 'streaming'})
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= self.checkpoint_interval:
+            return self.checkpoint()
+        self.kind = TEXT_DELTA
+        return sse({'delta': text, 'mode': 'streaming'})
+
+    def replace(self, text: str) -> str:
+        """Replace the whole content (e.g. when a tool result rewrites it)"""
+        self._parts = [text]
+        return self.checkpoint()
+
+    def checkpoint(self) -> str:
+        """Return a full snapshot of the current content"""
+        self._since_checkpoint = 0
+        self.kind = FULL_TEXT
+        payload = {'content': self.content, 'mode': 'streaming'}
+        if self.protocol == DELTA:
+            payload['checkpoint'] = True
+        return sse(payload)
+
+def _resync_opcodes(old: List[str], new: List[str]) -> List[Tuple[int, int, int, int]]:
+    """Linear-time token diff: on a mismatch, skip ahead to the nearest point where both sides agree again"""
+    opcodes = []
+    i = j = 0
+    n, m = len(old), len(new)
+    while i < n and j < m:
+        if old[i] == new[j]:
+            i += 1
+            j += 1
+            continue
+        resync = None
+        for distance in range(1, 2 * RESYNC_WINDOW + 1):
+            for skip_old in range(max(0, distance - RESYNC_WINDOW), min(distance, RESYNC_WINDOW) + 1):
+                skip_new = distance - skip_old
+                a, b = i + skip_old, j + skip_new
+                if a < n and b < m and old[a:a + RESYNC_ANCHOR] == new[b:b + RESYNC_ANCHOR]:
+                    resync = (a, b)
+                    break
+            if resync:
+                break
+        if resync is None:
+            break
+        opcodes.append((i, resync[0], j, resync[1]))
+        i, j = resync
+    if i < n or j < m:
+        opcodes.append((i, n, j, m))
+    return opcodes
+
+def diff_spans(old: str, new: str) -> List[Tuple[int, int, str]]:
+    """Edit script turning ``old`` into ``new`` as ascending ``(pos, delete_count, insert)`` ops.
+
+    Positions refer to ``old`` in code points. The common prefix/suffix is
+    skipped, then the changed middle is diffed at word granularity with a
+    bounded look-ahead, so cost stays linear in the frame length.
+    """
+    limit = min(len(old), len(new))
+    start = 0
+    while start < limit and old[start] == new[start]:
+        start += 1
+    end_old, end_new = len(old), len(new)
+    while end_old > start and end_new > start and old[end_old - 1] == new[end_new - 1]:
+        end_old -= 1
+        end_new -= 1
+    if start == end_old and start == end_new:
+        return []
+
+    old_mid, new_mid = old[start:end_old], new[start:end_new]
+    old_tokens = _TOKEN_RE.findall(old_mid)
+    new_tokens = _TOKEN_RE.findall(new_mid)
+    if not old_tokens or not new_tokens:
+        return [(start, end_old - start, new_mid)]
+
+    old_offsets = [0]
+    for token in old_tokens:
+        old_offsets.append(old_offsets[-1] + len(token))
+    new_offsets = [0]
+    for token in new_tokens:
+        new_offsets.append(new_offsets[-1] + len(token))
+
+    if len(old_tokens) == len(new_tokens):
+        # Tokens re-sampled in place: align positionally
+        opcodes = []
+        i = 0
+        while i < len(old_tokens):
+            if old_tokens[i] == new_tokens[i]:
+                i += 1
+                continue
+            j = i
+            while j < len(old_tokens) and old_tokens[j] != new_tokens[j]:
+                j += 1
+            opcodes.append((i, j, i, j))
+            i = j
+    else:
+        opcodes = _resync_opcodes(old_tokens, new_tokens)
+
+    ops = []
+    for i1, i2, j1, j2 in opcodes:
+        pos = start + old_offsets[i1]
+        delete_count = old_offsets[i2] - old_offsets[i1]
+        insert = new_mid[new_offsets[j1]:new_offsets[j2]]
+        if ops:
+            prev_pos, prev_delete, prev_insert = ops[-1]
+            gap = pos - (prev_pos + prev_delete)
+            if gap <= MERGE_GAP:
+                # Sending a few unchanged characters is cheaper than another op
+                gap_text = old[prev_pos + prev_delete:pos]
+                ops[-1] = (prev_pos, prev_delete + gap + delete_count, prev_insert + gap_text + insert)
+                continue
+        ops.append((pos, delete_count, insert))
+    return ops
+
+def apply_spans(old: str, ops: List[Tuple[int, int, str]]) -> str:
+    """Apply an edit script produced by ``diff_spans``"""
+    parts = []
+    cursor = 0
+    for pos, delete_count, insert in ops:
+        parts.append(old[cursor:pos])
+        parts.append(insert)
+        cursor = pos + delete_count
+    parts.append(old[cursor:])
+    return "".join(parts)
+
+def _to_utf16(text: str, ops: List[Tuple[int, int, str]]) -> List[List]:
+    """Convert op positions/lengths from code points to UTF-16 code units (JS string indices)"""
+    if text.isascii():
+        return [[pos, delete_count, insert] for pos, delete_count, insert in ops]
+    converted = []
+    cursor = 0
+    astral = 0
+    for pos, delete_count, insert in ops:
+        astral += sum(1 for ch in text[cursor:pos] if ord(ch) > 0xFFFF)
+        deleted_astral = sum(1 for ch in text[pos:pos + delete_count] if ord(ch) > 0xFFFF)
+        converted.append([pos + astral, delete_count + deleted_astral, insert])
+        astral += deleted_astral
+        cursor = pos + delete_count
+    return converted
+
+class FrameEncoder:
+    """Encode diffusion frames either as full snapshots or as patches against the previous frame.
+
+    In delta mode a frame is sent as ``{"patch": [[pos, delete, insert], ...]}``
+    (UTF-16 positions in the previous frame), with a full
+    ``{"content": ..., "keyframe": true}`` every ``keyframe_interval`` frames
+    or whenever the patch would not be smaller than the frame itself.
+    Unchanged frames are skipped.
+    """
+
+    def __init__(self, protocol: str = SNAPSHOT, keyframe_interval: int = KEYFRAME_INTERVAL):
+        self.protocol = protocol
+        self.keyframe_interval = keyframe_interval
+        self.previous: Optional[str] = None
+        self._since_keyframe = 0
+        # FULL_FRAME or PATCH_FRAME, for the last line returned
+        self.kind = FULL_FRAME
+        # Text committed ahead of the frames; frames after a commit carry only what follows it
+        self.committed = ""
+
+    def encode(self, frame: str) -> Optional[str]:
+        """Return the SSE line for a frame, or None if nothing needs to be sent"""
+        if self.protocol == SNAPSHOT:
+            self.previous = frame
+            self.kind = FULL_FRAME
+            return sse({'content': frame, 'mode': 'diffusing'})
+        if frame == self.previous:
+            return None
+
+        previous = self.previous
+        self.previous = frame
+        if previous is None or self._since_keyframe >= self.keyframe_interval:
+            return self.keyframe()
+
+        patch = _to_utf16(previous, diff_spans(previous, frame))
+        line = sse({'patch': patch, 'mode': 'diffusing'})
+        if len(line) >= len(frame):
+            return self.keyframe()
+        self._since_keyframe += 1
+        self.kind = PATCH_FRAME
+        return line
+
+    def keyframe(self) -> str:
+        """Return a full snapshot of the latest frame"""
+        self._since_keyframe = 0
+        self.kind = FULL_FRAME
+        return keyframe_line(self.previous or "")
+
+    def commit(self, text: str) -> str:
+        """Move ``text``, the start of the previous frame, out of the frames.
+
+        The client already has the text, so only its length (UTF-16 code
+        units) is sent and the client moves that much of its frame.
+        """
+        self.committed += text
+        self.previous = (self.previous or "")[len(text):]
+        return sse({'commit': len(text.encode('utf-16-le')) // 2, 'mode': 'diffusing'})
+
+    def uncommit(self) -> str:
+        """Put the committed text back in front of the previous frame"""
+        self.previous = self.committed + (self.previous or "")
+        self.committed = ""
+        return sse({'uncommit': True, 'mode': 'diffusing'})
+
+def keyframe_line(frame: str) -> str:
+    """A diffusion frame sent in full, which a client applies regardless of what it had before"""
+    return sse({'content': frame, 'mode': 'diffusing', 'keyframe': True})
+
+DONE_LINE = "data: [DONE]\n\n"
+
+class EventEncoder:
+    """Serialize chat events to SSE lines with the negotiated protocol.
+
+    One encoder is used per response, so delta patches and checkpoints are
+    always relative to what this client has already received. Events that
+    are internal to the orchestrator (tool calls, tool results) encode to None.
+    """
+
+    def __init__(self, protocol: str = SNAPSHOT):
+        self.text = StreamingEncoder(protocol)
+        self.frames = FrameEncoder(protocol)
+        # Kind of the last line encoded (FULL_FRAME, PATCH_FRAME, FULL_TEXT, TEXT_DELTA, COMMIT), None for other events
+        self.kind: Optional[str] = None
+
+    def encode(self, event: Event) -> Optional[str]:
+        self.kind = None
+        if isinstance(event, TextDelta):
+            line = self.text.append(event.text)
+            self.kind = self.text.kind
+            return line
+        if isinstance(event, DiffusionFrame):
+            line = self.frames.encode(event.content)
+            self.kind = self.frames.kind
+            return line
+        if isinstance(event, TextSnapshot):
+            line = self.text.replace(event.content)
+            self.kind = self.text.kind
+            return line
+        if isinstance(event, Committed):
+            self.kind = COMMIT
+            return self.frames.commit(event.text)
+        if isinstance(event, Uncommitted):
+            self.kind = COMMIT
+            return self.frames.uncommit()
+        if isinstance(event, Truncated):
+            return sse({'truncated': event.reason})
+        if isinstance(event, Queued):
+            return sse({'queued': {'position': event.position, 'waiting': event.waiting, 'waited': event.waited}})
+        if isinstance(event, Error):
+            if event.retry_after is not None:
+                return sse({'error': event.message, 'retry_after': math.ceil(event.retry_after)})
+            return sse({'error': event.message})
+        if isinstance(event, Done):
+            return DONE_LINE
+        return None
@@ -0,0 +1,262 @@
+import asyncio
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from disconnect import StreamStats
+from protocol import COMMIT, FULL_FRAME, FULL_TEXT, PATCH_FRAME, TEXT_DELTA, EventEncoder, keyframe_line
+
+# Event kinds as stored per event; see protocol.FULL_FRAME etc.
+OTHER, FRAME, PATCH, TEXT, DELTA, MOVE = range(6)
+_KIND_CODES = {FULL_FRAME: FRAME, PATCH_FRAME: PATCH, FULL_TEXT: TEXT, TEXT_DELTA: DELTA, COMMIT: MOVE}
+# Largest single write when a lagging reader's events are joined
+MAX_WRITE = 64 * 1024
+
+class ResumeGap(Exception):
+    """The events after the requested id have already left the replay buffer"""
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """Numeric ``Last-Event-ID``; anything else means "from the start\""""
+    try:
+        return max(int((value or "").strip()), 0)
+    except ValueError:
+        return 0
+
+class ReplayStream:
+    """One /chat response generated in the background and buffered for replay.
+
+    Every SSE event gets a monotonic ``id:``, starting at 1. The newest
+    events are kept up to ``max_bytes``, so a client that reconnects with
+    ``Last-Event-ID`` continues from the next event while generation carries
+    on regardless of who is connected.
+
+    With ``coalesce``, a reader that is more than one event behind gets only
+    the newest state: diffusion frames and text superseded by a later full
+    frame or snapshot are skipped, and the rest go out in as few writes as
+    possible. ``encoder`` is the response's EventEncoder, which says what
+    each event carries.
+    """
+
+    def __init__(self, stream_id: str, chunks: AsyncIterator[bytes], max_bytes: int, stats: StreamStats, tokens_left: Callable[[], int], protocol: str, encoder: Optional[EventEncoder] = None, coalesce: bool = True):
+        self.stream_id = stream_id
+        self.protocol = protocol
+        self.max_bytes = max_bytes
+        self.coalesce = coalesce and encoder is not None
+        # Event n is events[n - 1]; trimmed events are set to None, so lookups by id stay O(1)
+        self.events: List[Optional[bytes]] = []
+        self.kinds = bytearray()
+        # Id and text of the newest diffusion frame, to resend it whole when the frames before it are skipped
+        self.frame_id = 0
+        self.frame: Optional[str] = None
+        self._encoder = encoder
+        self.first_id = 1
+        self.bytes = 0
+        self.done = False
+        self.readers = 0
+        # When the stream last had no reader (it starts detached until the first response attaches)
+        self.idle_since = time.monotonic()
+        self._stats = stats
+        self._tokens_left = tokens_left
+        self._changed = asyncio.Event()
+        stats.started += 1
+        self.task = asyncio.get_running_loop().create_task(self._produce(chunks))
+
+    @property
+    def next_id(self) -> int:
+        return len(self.events) + 1
+
+    async def _produce(self, chunks: AsyncIterator[bytes]):
+        try:
+            async for chunk in chunks:
+                self._append(chunk)
+            self._stats.completed += 1
+        except asyncio.CancelledError:
+            self._stats.record_cancel(self._tokens_left())
+        finally:
+            await chunks.aclose()
+            self.done = True
+            self._notify()
+
+    def _append(self, chunk: bytes):
+        data = b"id: %d\n" % self.next_id + chunk
+        kind = _KIND_CODES.get(self._encoder.kind, OTHER) if self._encoder else OTHER
+        if kind in (FRAME, PATCH):
+            self.frame_id = self.next_id
+            self.frame = self._encoder.frames.previous
+        self.events.append(data)
+        self.kinds.append(kind)
+        self.bytes += len(data)
+        # Always keep the newest event, however large
+        while self.bytes > self.max_bytes and self.first_id < self.next_id - 1:
+            self.bytes -= len(self.events[self.first_id - 1])
+            self.events[self.first_id - 1] = None
+            self.first_id += 1
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def check(self, after: int):
+        """Raise ResumeGap unless every event after ``after`` is still buffered, ValueError for an id never sent"""
+        if after >= self.next_id:
+            raise ValueError(f"event {after} has not been sent; the last is {self.next_id - 1}")
+        if after + 1 < self.first_id:
+            raise ResumeGap(f"events {after + 1}-{self.first_id - 1} are no longer buffered")
+
+    async def read(self, after: int = 0) -> AsyncIterator[bytes]:
+        """Buffered events after id ``after``, then new ones as they are generated, until the stream ends.
+
+        Leaving early (the client went away) only detaches this reader;
+        generation continues for a later reconnect.
+        """
+        self.readers += 1
+        position = after
+        try:
+            while True:
+                changed = self._changed
+                if position + 1 < self.first_id:
+                    # This reader fell further behind than the buffer holds; a reconnect gets ResumeGap
+                    return
+                pending = self.events[position:]
+                for data in (self._batch(position, pending) if self.coalesce and len(pending) > 1 else pending):
+                    yield data
+                position += len(pending)
+                if self.done and position >= self.next_id - 1:
+                    return
+                if not pending:
+                    await changed.wait()
+        finally:
+            self.readers -= 1
+            if not self.readers:
+                self.idle_since = time.monotonic()
+
+    def _batch(self, position: int, pending: List[bytes]) -> List[bytes]:
+        """The writes for a reader at ``position`` that has ``pending`` to catch up on, newest state only"""
+        kinds = self.kinds[position:position + len(pending)]
+        last_frame = max(kinds.rfind(FRAME), kinds.rfind(PATCH))
+        last_text = kinds.rfind(TEXT)
+        # A commit moves the start of the client's current frame, so the frames before it must all arrive
+        last_commit = kinds.rfind(MOVE)
+        kept: List[bytes] = []
+        frames_skipped = texts_skipped = 0
+        for i, (kind, data) in enumerate(zip(kinds, pending)):
+            if kind in (FRAME, PATCH) and last_commit < i < last_frame:
+                frames_skipped += 1
+                continue
+            if kind in (TEXT, DELTA) and i < last_text:
+                texts_skipped += 1
+                continue
+            if i == last_frame and kind == PATCH and frames_skipped:
+                # The frame this patch applies to was skipped: send the newest frame whole instead
+                data = b"id: %d\n" % self.frame_id + keyframe_line(self.frame or "").encode()
+            kept.append(data)
+        self._stats.superseded += frames_skipped + texts_skipped
+
+        writes: List[bytes] = []
+        size = MAX_WRITE
+        for data in kept:
+            if size + len(data) > MAX_WRITE:
+                writes.append(bytearray())
+                size = 0
+            writes[-1] += data
+            size += len(data)
+        self._stats.coalesced_writes += len(pending) - len(writes)
+        return [bytes(write) for write in writes]
+
+    def cancel(self):
+        self.task.cancel()
+
+class ReplayRegistry:
+    """Resumable streams of this worker, bounded in number and in bytes per stream.
+
+    A stream with no reader is kept for ``grace`` seconds, running or
+    finished; after that an unfinished one is cancelled (its unspent tokens
+    counted as saved) and it is dropped. When ``max_streams`` are held, a new
+    stream evicts the longest-idle one without a reader, or is not made
+    resumable if every stream has one.
+    """
+
+    def __init__(self, max_streams: int, max_bytes: int, grace: float, stats: StreamStats, coalesce: bool = True):
+        self.max_streams = max_streams
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self.coalesce = coalesce
+        self.stream_stats = stats
+        self._streams: "OrderedDict[str, ReplayStream]" = OrderedDict()
+        self.resumed = 0
+        self.gaps = 0
+        self.expired = 0
+        self.evicted = 0
+        self.cancelled = 0
+        self.unbuffered = 0
+
+    def start(self, chunks: AsyncIterator[bytes], tokens_left: Callable[[], int], protocol: str, encoder: Optional[EventEncoder] = None) -> Optional[ReplayStream]:
+        """Generate ``chunks`` in the background, or return None when no slot can be freed"""
+        self.sweep()
+        if len(self._streams) >= self.max_streams and not self._evict_one():
+            self.unbuffered += 1
+            return None
+        stream = ReplayStream(secrets.token_urlsafe(16), chunks, self.max_bytes, self.stream_stats, tokens_left, protocol, encoder, self.coalesce)
+        self._streams[stream.stream_id] = stream
+        return stream
+
+    def get(self, stream_id: str) -> Optional[ReplayStream]:
+        return self._streams.get(stream_id)
+
+    def cancel(self, stream_id: str) -> bool:
+        """Stop generating a stream its client gave up on and drop its buffer"""
+        stream = self._streams.pop(stream_id, None)
+        if stream is None:
+            return False
+        stream.cancel()
+        self.cancelled += 1
+        return True
+
+    def _evict_one(self) -> bool:
+        idle = [stream for stream in self._streams.values() if not stream.readers]
+        if not idle:
+            return False
+        # Finished streams go first: evicting them wastes no generation
+        victim = min(idle, key=lambda stream: (not stream.done, stream.idle_since))
+        self._streams.pop(victim.stream_id)
+        victim.cancel()
+        self.evicted += 1
+        return True
+
+    def sweep(self) -> int:
+        """Drop streams that have had no reader for longer than the grace period"""
+        cutoff = time.monotonic() - self.grace
+        expired = [stream for stream in self._streams.values() if not stream.readers and stream.idle_since < cutoff]
+        for stream in expired:
+            self._streams.pop(stream.stream_id)
+            stream.cancel()
+        self.expired += len(expired)
+        return len(expired)
+
+    async def run_sweeper(self, interval: float = 1.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+    async def aclose(self):
+        streams = list(self._streams.values())
+        self._streams.clear()
+        for stream in streams:
+            stream.cancel()
+        await asyncio.gather(*(stream.task for stream in streams), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        streams = list(self._streams.values())
+        return {
+            "streams": len(streams),
+            "running": sum(not stream.done for stream in streams),
+            "detached": sum(not stream.readers for stream in streams),
+            "buffered_bytes": sum(stream.bytes for stream in streams),
+            "resumed": self.resumed,
+            "gaps": self.gaps,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "cancelled": self.cancelled,
+            "unbuffered": self.unbuffered,
+        }
@@ -0,0 +1,45 @@
+"""Production entry point: run the API in several worker processes.
+
+Each worker is a separate uvicorn process with its own event loop and
+connection pools, so throughput scales with cores. Caches and counters are
+shared through the ``SHARED_STATE`` backend (``sqlite`` on one host,
+``redis`` across hosts); with the default ``memory`` backend every worker
+keeps its own.
+
+    python serve.py --workers 4
+    SHARED_STATE=sqlite python serve.py --workers 8 --port 8000
+    SHARED_STATE=redis SHARED_STATE_URL=redis://cache:6379/0 python serve.py
+"""
+import argparse
+import os
+import secrets
+import sys
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+                        help="worker processes (default: WEB_CONCURRENCY or the number of cores)")
+    parser.add_argument("--warmup", type=int, default=2, help="connections each worker opens per upstream host at startup")
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+
+    # Workers read their settings from the environment, so set these before config is imported anywhere
+    os.environ.setdefault("WARMUP_CONNECTIONS", str(args.warmup))
+    # Rate limits are divided between the workers
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    # Validation cache keys are HMACs; workers sharing the cache must share the secret
+    os.environ.setdefault("API_KEY_CACHE_SECRET", secrets.token_hex(32))
+
+    import config
+    import uvicorn
+
+    if args.workers > 1 and config.SHARED_STATE == "memory":
+        print("serve.py: SHARED_STATE=memory, so each worker keeps its own caches and counters", file=sys.stderr)
+    # The workers import main:app themselves; the backend directory must be importable
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import select
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import urlparse
+
+# Expiry for entries that should not expire (counters created without a TTL)
+NEVER = float("inf")
+
+class StoreError(Exception):
+    """The shared-state backend rejected a command"""
+
+class MemoryStore:
+    """In-process key/value store with per-entry expiry; every worker has its own"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[str, tuple] = {}
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (value, expires_at) for a live entry"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.time():
+                return None
+            return entry
+
+    def set(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add ``amount`` to a counter and return the new value; ``ttl`` applies when the counter is created"""
+        with self._lock:
+            now = time.time()
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= now:
+                entry = (0, now + ttl if ttl else NEVER)
+            value = entry[0] + amount
+            self._data[key] = (value, entry[1])
+            return value
+
+    def purge_expired(self, max_rows: Optional[int] = None) -> int:
+        """Delete expired entries, then the soonest to expire beyond ``max_rows``; returns how many went"""
+        with self._lock:
+            now = time.time()
+            expired = [key for key, (_, expires_at) in self._data.items() if expires_at <= now]
+            if max_rows is not None and len(self._data) - len(expired) > max_rows:
+                live = sorted((expires_at, key) for key, (_, expires_at) in self._data.items() if expires_at > now)
+                expired += [key for _, key in live[:len(live) - max_rows]]
+            for key in expired:
+                del self._data[key]
+            return len(expired)
+
+    def close(self):
+        pass
+
+class SQLiteStore:
+    """Tiny persistent key/value table with per-entry expiry.
+
+    Safe to share between worker processes on one host: the database runs in
+    WAL mode and writers wait up to ``timeout`` seconds for each other.
+    """
+
+    def __init__(self, path: str, table: str = "cache", timeout: float = 5.0):
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (value, expires_at) for a live entry"""
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add ``amount`` to a counter and return the new value; ``ttl`` applies when the counter is created"""
+        with self._lock:
+            now = time.time()
+            # IMMEDIATE takes the write lock up front so concurrent workers cannot lose increments
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                if row is None or row[1] <= now:
+                    value, expires_at = amount, now + ttl if ttl else NEVER
+                else:
+                    value, expires_at = json.loads(row[0]) + amount, row[1]
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def purge_expired(self, max_rows: Optional[int] = None) -> int:
+        """Delete expired rows, then the soonest to expire beyond ``max_rows``; returns how many went"""
+        with self._lock:
+            deleted = self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),)).rowcount
+            if max_rows is not None:
+                excess = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - max_rows
+                if excess > 0:
+                    deleted += self._conn.execute(
+                        f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY expires_at LIMIT ?)",
+                        (excess,)
+                    ).rowcount
+            return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class RedisStore:
+    """Key/value store on any server speaking the Redis protocol (RESP2).
+
+    Keys are prefixed with ``namespace`` and values stored as JSON with a
+    millisecond expiry, so the server drops stale entries itself. Commands
+    go over one connection guarded by a lock (callers run them in executor
+    threads). A dropped connection is reopened and the commands resent only
+    when they are all idempotent, so a failed INCRBY that may have reached
+    the server is never applied twice. The URL form is
+    ``redis://[:password@]host[:port][/db]``.
+    """
+
+    # Commands that are safe to resend after a failure of unknown outcome
+    IDEMPOTENT = frozenset({"GET", "PTTL", "SET", "DEL", "PING"})
+
+    def __init__(self, url: str, namespace: str = "cache", timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.namespace = namespace
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", str(self.db)))
+        if setup:
+            self._roundtrip(setup)
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+        self._sock = self._reader = None
+
+    def _stale(self) -> bool:
+        """Whether the server closed the idle connection (checked before sending)"""
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            # An idle connection has nothing to read unless the server hung up
+            return bool(readable) and self._sock.recv(1, socket.MSG_PEEK) == b""
+        except (OSError, ValueError):
+            return True
+
+    @staticmethod
+    def _encode(command: tuple) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self) -> Any:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by the shared-state server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            return StoreError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return self._reader.read(length + 2)[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise StoreError(f"unexpected reply {line!r}")
+
+    def _roundtrip(self, commands: List[tuple]) -> List[Any]:
+        self._sock.sendall(b"".join(self._encode(command) for command in commands))
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, StoreError):
+                raise reply
+        return replies
+
+    def execute(self, *commands: tuple) -> List[Any]:
+        """Send the commands pipelined and return their replies"""
+        with self._lock:
+            if self._sock is not None and self._stale():
+                self._disconnect()
+            for attempt in range(2):
+                if self._sock is None:
+                    self._connect()
+                try:
+                    return self._roundtrip(list(commands))
+                except (OSError, ConnectionError):
+                    self._disconnect()
+                    if attempt or not all(command[0] in self.IDEMPOTENT for command in commands):
+                        raise
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (value, expires_at) for a live entry"""
+        value, ttl_ms = self.execute(("GET", self._key(key)), ("PTTL", self._key(key)))
+        if value is None:
+            return None
+        return json.loads(value), NEVER if ttl_ms < 0 else time.time() + ttl_ms / 1000
+
+    def set(self, key: str, value: Any, expires_at: float):
+        ttl_ms = int((expires_at - time.time()) * 1000)
+        if ttl_ms > 0:
+            self.execute(("SET", self._key(key), json.dumps(value), "PX", ttl_ms))
+
+    def delete(self, key: str):
+        self.execute(("DEL", self._key(key)))
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add ``amount`` to a counter and return the new value; ``ttl`` applies when the counter is created"""
+        if not ttl:
+            return self.execute(("INCRBY", self._key(key), amount))[0]
+        # SET NX creates the counter with its expiry; INCRBY keeps an existing expiry
+        return self.execute(("SET", self._key(key), 0, "PX", int(ttl * 1000), "NX"), ("INCRBY", self._key(key), amount))[1]
+
+    def ping(self) -> bool:
+        return self.execute(("PING",))[0] == "PONG"
+
+    def purge_expired(self, max_rows: Optional[int] = None) -> int:
+        """The server expires keys itself; bound its size with maxmemory instead of ``max_rows``"""
+        return 0
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+Store = Union[MemoryStore, SQLiteStore, RedisStore]
+
+async def run_purger(stores: List[Store], interval: float, max_rows: Optional[int] = None):
+    """Purge expired entries from ``stores`` every ``interval`` seconds, keeping at most ``max_rows`` each"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        for store in stores:
+            try:
+                await loop.run_in_executor(None, store.purge_expired, max_rows)
+            except (StoreError, OSError, sqlite3.Error):
+                # A store that is unavailable now is purged on a later round
+                pass
+
+def open_store(backend: str, namespace: str, path: Optional[str] = None, url: Optional[str] = None) -> Optional[Store]:
+    """Store for one cache or counter namespace on the configured backend.
+
+    ``memory`` returns a SQLite store when a per-cache ``path`` is set and
+    None otherwise (the caches already keep an in-process tier), ``sqlite``
+    uses ``path`` as the database file and ``redis`` connects to ``url``.
+    """
+    if backend == "redis":
+        return RedisStore(url or "redis://127.0.0.1:6379/0", namespace)
+    if backend == "sqlite":
+        return SQLiteStore(path, namespace)
+    if backend == "memory":
+        return SQLiteStore(path, namespace) if path else None
+    raise ValueError(f"unknown shared-state backend {backend!r} (expected memory, sqlite or redis)")
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple
+from budget import Budget
+from events import Done, Event
+
+class SpeculationStats:
+    """How often the speculative diffused answer was kept, and what that saved"""
+
+    def __init__(self):
+        self.attempts = 0
+        self.kept = 0
+        self.cancelled = 0
+        self.latency_saved = 0.0
+        self.tokens_wasted = 0
+
+    def stats(self) -> Dict[str, Any]:
+        decided = self.kept + self.cancelled
+        return {
+            "attempts": self.attempts,
+            "kept": self.kept,
+            "cancelled": self.cancelled,
+            "win_rate": self.kept / decided if decided else 0.0,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+            "avg_latency_saved_seconds": round(self.latency_saved / self.kept, 3) if self.kept else 0.0,
+            "tokens_wasted": self.tokens_wasted,
+        }
+
+class SpeculativeGeneration:
+    """Relay a diffused generation while the tool-decision call runs alongside it.
+
+    Without speculation the diffused answer only starts once the tool check
+    has finished. Here both start together and frames are relayed as they
+    arrive. If the check comes back without tool calls, the generation
+    continues and the time the two calls overlapped is counted as latency
+    saved. If it
+    asks for tools, the generation is closed (which closes its upstream
+    stream), its output is not charged to ``budget``, and ``stream`` ends with
+    ``tool_calls`` set so the caller can run the tools and restart. The
+    generation's ``Done`` event is held back until the decision is known.
+    """
+
+    def __init__(
+        self,
+        generation: AsyncIterator[Event],
+        check: Awaitable[Tuple[str, List[Dict]]],
+        stats: SpeculationStats,
+        budget: Optional[Budget] = None
+    ):
+        self.generation = generation
+        self.check = check
+        self.stats = stats
+        self.budget = budget
+        self.assistant_response = ""
+        self.tool_calls: List[Dict] = []
+        self._generation_done: Optional[float] = None
+
+    async def stream(self) -> AsyncIterator[Event]:
+        self.stats.attempts += 1
+        started = time.monotonic()
+        check = asyncio.ensure_future(self.check)
+        next_event = None
+        held: List[Event] = []
+        try:
+            while True:
+                next_event = asyncio.ensure_future(self.generation.__anext__())
+                if not check.done():
+                    await asyncio.wait({next_event, check}, return_when=asyncio.FIRST_COMPLETED)
+                    if check.done() and self._decide(check, started):
+                        return
+                try:
+                    event = await next_event
+                except StopAsyncIteration:
+                    self._generation_done = time.monotonic()
+                    break
+                if isinstance(event, Done) and not check.done():
+                    self._generation_done = time.monotonic()
+                    held.append(event)
+                else:
+                    yield event
+
+            if not check.done():
+                await asyncio.wait({check})
+                if self._decide(check, started):
+                    return
+            for event in held:
+                yield event
+        finally:
+            if not check.done():
+                check.cancel()
+                await asyncio.gather(check, return_exceptions=True)
+            if next_event is not None and not next_event.done():
+                next_event.cancel()
+                await asyncio.gather(next_event, return_exceptions=True)
+            await self.generation.aclose()
+
+    def _decide(self, check: "asyncio.Future", started: float) -> bool:
+        """Record the check's outcome; True when tools are needed and the generation must be dropped"""
+        try:
+            self.assistant_response, self.tool_calls = check.result()
+        except Exception:
+            # A failed check cannot ask for tools, so the speculative answer stands
+            self.assistant_response, self.tool_calls = "", []
+        if not self.tool_calls:
+            # Run one after the other, the answer would have started only after the check,
+            # so the overlap of the two is what speculation saved
+            overlap_end = min(time.monotonic(), self._generation_done or time.monotonic())
+            self.stats.kept += 1
+            self.stats.latency_saved += overlap_end - started
+            return False
+        self.stats.cancelled += 1
+        if self.budget:
+            self.stats.tokens_wasted += self.budget.call_tokens
+            self.budget.discard_call()
+        return True
@@ -0,0 +1,209 @@
+import json
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_EMPTY: Dict[str, Any] = {}
+_BOM = b"\xef\xbb\xbf"
+
+class SSEEvent(NamedTuple):
+    """One dispatched server-sent event; ``data`` is the raw UTF-8 payload"""
+    data: bytes
+    event: Optional[str] = None
+    id: Optional[str] = None
+
+class SSEParser:
+    """Incremental server-sent events parser that works on raw bytes.
+
+    Follows the HTML event-stream rules: CR, LF and CRLF line endings, a
+    leading BOM, ``:`` comments, ``data``/``event``/``id``/``retry`` fields
+    with one optional space after the colon, multi-line ``data`` joined with
+    LF, and dispatch on a blank line. Input may be split anywhere, including
+    inside a line or between CR and LF. Lines are only decoded for the
+    ``event``/``id`` fields; ``data`` stays as bytes for the JSON parser.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._data: List[bytes] = []
+        self._event: Optional[str] = None
+        self._last_id: Optional[str] = None
+        self._started = False
+        self.retry: Optional[int] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """Parse a chunk of the stream and return the events it completed"""
+        buffer = self._buffer + chunk if self._buffer else chunk
+        if not self._started:
+            if len(buffer) < 3 and _BOM.startswith(buffer):
+                # Not enough bytes yet to tell whether the stream starts with a BOM
+                self._buffer = buffer
+                return []
+            if buffer.startswith(_BOM):
+                buffer = buffer[3:]
+            self._started = True
+        if b"\r" in buffer:
+            # A trailing CR may be the first half of a CRLF split across chunks
+            if buffer.endswith(b"\r"):
+                buffer, held = buffer[:-1], b"\r"
+            else:
+                held = b""
+            buffer = buffer.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            lines = buffer.split(b"\n")
+            self._buffer = lines.pop() + held
+        else:
+            lines = buffer.split(b"\n")
+            self._buffer = lines.pop()
+
+        events = []
+        for line in lines:
+            if not line:
+                if self._data:
+                    events.append(SSEEvent(b"\n".join(self._data), self._event, self._last_id))
+                self._data = []
+                self._event = None
+            elif line.startswith(b"data:"):
+                self._data.append(line[6:] if line[5:6] == b" " else line[5:])
+            else:
+                self._field(line)
+        return events
+
+    def close(self) -> List[SSEEvent]:
+        """Flush at end of stream, dispatching an event that lacks its trailing blank line"""
+        events = self.feed(b"\n\n") if self._buffer.rstrip(b"\r") or self._data else []
+        self._buffer = b""
+        return events
+
+    def _field(self, line: bytes):
+        if line.startswith(b":"):
+            return
+        name, sep, value = line.partition(b":")
+        if sep and value.startswith(b" "):
+            value = value[1:]
+        if name == b"event":
+            self._event = value.decode("utf-8", "replace")
+        elif name == b"id":
+            if b"\0" not in value:
+                self._last_id = value.decode("utf-8", "replace")
+        elif name == b"retry":
+            if value.isdigit():
+                self.retry = int(value)
+        elif name == b"data":
+            # "data" with no colon is an empty data line
+            self._data.append(value)
+
+class Chunk(NamedTuple):
+    """The parts of an OpenAI-style completion chunk the streaming loops use"""
+    delta: Dict[str, Any]
+    finish_reason: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+    done: bool = False
+
+DONE = Chunk(_EMPTY, None, None, True)
+
+def _chunk_from_object(parsed: Dict[str, Any]) -> Chunk:
+    choices = parsed.get("choices")
+    if choices:
+        choice = choices[0]
+        return Chunk(choice.get("delta") or _EMPTY, choice.get("finish_reason"), parsed.get("usage"))
+    return Chunk(_EMPTY, None, parsed.get("usage"))
+
+def _field_value(text: str, key: str, start: int = 0):
+    """Decode the JSON value following ``key`` (e.g. '"delta":') without parsing the rest of the object"""
+    position = text.find(key, start)
+    if position == -1:
+        return None, -1
+    position += len(key)
+    while text[position] in " \t\r\n":
+        position += 1
+    return _raw_decode(text, position)
+
+def parse_chunk_orjson(data: bytes) -> Optional[Chunk]:
+    """orjson parses the whole chunk faster than the stdlib can parse a part of it"""
+    try:
+        return _chunk_from_object(orjson.loads(data))
+    except ValueError:
+        return None
+
+def parse_chunk_stdlib(data: bytes) -> Optional[Chunk]:
+    """Decode only ``delta``, ``finish_reason`` and ``usage`` with the stdlib decoder.
+
+    An unescaped ``"delta":`` cannot occur inside a JSON string, so locating
+    the keys textually is safe. ``finish_reason`` is only looked for after
+    the delta, the order upstream sends; a chunk laid out any other way (or
+    without an object delta) gets a full parse.
+    """
+    try:
+        text = data.decode("utf-8")
+        delta, end = _field_value(text, '"delta":')
+        if end == -1 or not isinstance(delta, dict) or -1 < text.find('"finish_reason":') < end:
+            return _chunk_from_object(json.loads(text))
+        finish_reason, _ = _field_value(text, '"finish_reason":', end)
+        usage = _field_value(text, '"usage":')[0] if '"usage":' in text else None
+        return Chunk(delta, finish_reason, usage)
+    except (ValueError, IndexError):
+        return None
+
+_raw_decode = json.JSONDecoder().raw_decode
+_parse_object = parse_chunk_orjson if orjson is not None else parse_chunk_stdlib
+
+def parse_chunk(data: bytes) -> Optional[Chunk]:
+    """Decode one ``data`` payload into ``choices[0].delta`` (plus finish reason and usage).
+
+    Returns ``DONE`` for the ``[DONE]`` sentinel and None for payloads that
+    are not JSON objects.
+    """
+    if data[:1] != b"{":
+        return DONE if data.strip() == b"[DONE]" else None
+    return _parse_object(data)
+
+def iter_chunks(byte_chunks: Iterable[bytes]) -> Iterator[Chunk]:
+    """Completion chunks from a byte stream, ending after ``[DONE]``"""
+    parser = SSEParser()
+    for raw in byte_chunks:
+        for event in parser.feed(raw):
+            chunk = parse_chunk(event.data)
+            if chunk is not None:
+                yield chunk
+                if chunk.done:
+                    return
+    for event in parser.close():
+        chunk = parse_chunk(event.data)
+        if chunk is not None:
+            yield chunk
+
+async def aiter_chunks(byte_chunks: AsyncIterator[bytes]) -> AsyncIterator[Chunk]:
+    """Completion chunks from an async byte stream (e.g. ``response.aiter_bytes()``), ending after ``[DONE]``"""
+    parser = SSEParser()
+    async for raw in byte_chunks:
+        for event in parser.feed(raw):
+            chunk = parse_chunk(event.data)
+            if chunk is not None:
+                yield chunk
+                if chunk.done:
+                    return
+    for event in parser.close():
+        chunk = parse_chunk(event.data)
+        if chunk is not None:
+            yield chunk
+
+def merge_tool_call_deltas(tool_calls: List[Dict], deltas: List[Dict]) -> str:
+    """Fold streamed tool-call fragments into ``tool_calls``; returns the argument text added"""
+    added = []
+    for tool_call in deltas:
+        index = tool_call.get("index", 0)
+        while len(tool_calls) <= index:
+            tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+        if "id" in tool_call:
+            tool_calls[index]["id"] = tool_call["id"]
+        function = tool_call.get("function")
+        if function:
+            if "name" in function:
+                tool_calls[index]["function"]["name"] = function["name"]
+            if function.get("arguments"):
+                tool_calls[index]["function"]["arguments"] += function["arguments"]
+                added.append(function["arguments"])
+    return "".join(added)
@@ -0,0 +1,77 @@
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+from events import Committed, DiffusionFrame, Event, Uncommitted
+
+# Frames a leading region must survive unchanged before it is committed
+STABLE_FRAMES = 3
+
+def common_prefix(a: str, b: str, start: int = 0) -> int:
+    """Length of the common prefix of ``a`` and ``b``, known to match up to ``start``"""
+    lo, hi = start, min(len(a), len(b))
+    # Binary search over slice comparisons, which run in C
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[start:mid] == b[start:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def block_boundary(text: str, start: int, end: int) -> int:
+    """Last markdown block boundary (after a blank line, outside a code fence) in ``text[start:end]``, or ``start``"""
+    position = text.rfind("\n\n", start, end)
+    while position != -1:
+        boundary = position + 2
+        # An odd number of fences before the boundary means it falls inside a code block
+        if text.count("```", 0, boundary) % 2 == 0:
+            return boundary
+        position = text.rfind("\n\n", start, position)
+    return start
+
+class StablePrefix:
+    """Find the leading part of successive diffusion frames that has stopped changing.
+
+    Diffusion output usually settles from left to right. Once a region has
+    been identical for ``frames`` consecutive frames it is committed, up to
+    the last markdown block boundary inside it, so clients can render it
+    once and re-render only the rest. ``update`` returns the newly committed
+    text; a frame that no longer starts with the committed text uncommits
+    everything.
+    """
+
+    def __init__(self, frames: int = STABLE_FRAMES):
+        self.frames = frames
+        self.committed = ""
+        self._previous: Optional[str] = None
+        # Common prefix lengths of the last ``frames`` pairs of consecutive frames
+        self._stable: Deque[int] = deque(maxlen=frames)
+
+    def update(self, frame: str) -> Tuple[Optional[str], bool]:
+        """(newly committed text or None, whether the earlier commits were withdrawn) for the next frame"""
+        reset = False
+        if not frame.startswith(self.committed):
+            self.committed = ""
+            self._stable.clear()
+            reset = True
+        elif self._previous is not None:
+            self._stable.append(common_prefix(self._previous, frame, len(self.committed)))
+        self._previous = frame
+        if len(self._stable) < self.frames:
+            return None, reset
+        boundary = block_boundary(frame, len(self.committed), min(self._stable))
+        if boundary <= len(self.committed):
+            return None, reset
+        commit = frame[len(self.committed):boundary]
+        self.committed = frame[:boundary]
+        return commit, reset
+
+    def split(self, event: Event) -> List[Event]:
+        """The events to send for ``event``: a diffusion frame becomes any commit events plus the uncommitted tail"""
+        if not isinstance(event, DiffusionFrame):
+            return [event]
+        commit, reset = self.update(event.content)
+        events: List[Event] = [Uncommitted()] if reset else []
+        if commit:
+            events.append(Committed(commit))
+        events.append(DiffusionFrame(event.content[len(self.committed):]))
+        return events
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import time
+import httpx
+from typing import Dict, Any, AsyncGenerator, List, Optional
+from cache import SearchCache
+from events import ToolResult
+from metrics import TOOL_DURATION
+from tracing import KIND_CLIENT, NOOP_SPAN, SpanLike
+from upstream import TAVILY_API_URL
+
+# Deadline for a single tool call and for all tool calls of one model turn
+TOOL_CALL_TIMEOUT = 15.0
+TOOL_TURN_TIMEOUT = 30.0
+
+async def fetch_search_results(client: httpx.AsyncClient, query: str, api_key: str, max_results: int = 3, search_depth: str = 'basic') -> Dict[str, Any]:
+    """Search the web using Tavily API"""
+    try:
+        response = await client.post(
+            TAVILY_API_URL,
+            headers={'Content-Type': 'application/json'},
+            json={
+                'api_key': api_key,
+                'query': query,
+                'search_depth': search_depth,
+                'include_answer': True,
+                'max_results': max_results,
+                'include_raw_content': False
+            },
+            timeout=15
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            
+            results = []
+            for result in data.get('results', []):
+                results.append({
+                    'title': result.get('title', ''),
+                    'url': result.get('url', ''),
+                    'content': result.get('content', '')
+                })
+            
+            return {
+                'answer': data.get('answer', ''),
+                'results': results,
+                'query': query
+            }
+        else:
+            return {"error": f"Search failed with status: {response.status_code}"}
+            
+    except Exception as e:
+        return {"error": f"Search error: {str(e)}"}
+
+async def search_web(client: httpx.AsyncClient, query: str, api_key: str, max_results: int = 3, search_depth: str = 'basic', cache: Optional[SearchCache] = None, span: SpanLike = NOOP_SPAN) -> Dict[str, Any]:
+    """Search the web, serving repeated queries from the cache when one is given"""
+    started = time.perf_counter()
+    outcome = "cancelled"
+    try:
+        if cache is None:
+            span.set("cache", "off")
+            result = await fetch_search_results(client, query, api_key, max_results, search_depth)
+        else:
+            key = SearchCache.key(query, max_results, search_depth)
+            span.set("cache", "hit")
+            
+            def fetch():
+                # Only called on a miss (and not for requests coalesced onto another's fetch)
+                span.set("cache", "miss")
+                return fetch_search_results(client, query, api_key, max_results, search_depth)
+            
+            result = await cache.get_or_fetch(key, fetch)
+        outcome = "error" if "error" in result else "ok"
+        if outcome == "error":
+            span.error(result["error"])
+        return result
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        # Timed-out searches are cancelled, so they are recorded as such
+        TOOL_DURATION.labels("web_search", outcome).observe(time.perf_counter() - started)
+
+def get_tools():
+    """Get tools definition"""
+    return [{
+        "type": "function",
+        "function": {
+            "name": "web_search",
+            "description": "Search the web for current information on any topic",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "The search query"},
+                    "max_results": {"type": "integer", "description": "Max results (default: 3)", "default": 3}
+                },
+                "required": ["query"]
+            }
+        }
+    }]
+
+def _parse_arguments(tool_call: Dict) -> Dict[str, Any]:
+    return json.loads(tool_call["function"].get("arguments") or "{}")
+
+async def run_tool_call(client: httpx.AsyncClient, index: int, tool_call: Dict, tavily_api_key: str, cache: Optional[SearchCache] = None, parent: SpanLike = NOOP_SPAN) -> ToolResult:
+    """Execute a single tool call requested by the model"""
+    started = time.monotonic()
+    function_name = tool_call["function"]["name"]
+    with parent.child(f"tool.{function_name}", KIND_CLIENT, index=index) as span:
+        if function_name != "web_search":
+            span.error("unknown tool")
+            return ToolResult(index, tool_call, "", {"error": f"Unknown tool: {function_name}"})
+        try:
+            args = _parse_arguments(tool_call)
+        except json.JSONDecodeError as e:
+            span.error("invalid arguments")
+            return ToolResult(index, tool_call, "", {"error": f"Error parsing arguments: {e}"})
+        query = args.get('query', '')
+        # Only the length: the search text is user content and traces are exported and listed at /debug/trace
+        span.set("query.length", len(query))
+        result = await search_web(client, query, tavily_api_key, args.get('max_results', 3), cache=cache, span=span)
+        return ToolResult(index, tool_call, query, result, time.monotonic() - started)
+
+async def execute_tool_calls(
+    client: httpx.AsyncClient,
+    tool_calls: List[Dict],
+    tavily_api_key: str,
+    cache: Optional[SearchCache] = None,
+    call_timeout: float = TOOL_CALL_TIMEOUT,
+    turn_timeout: float = TOOL_TURN_TIMEOUT,
+    span: SpanLike = NOOP_SPAN
+) -> AsyncGenerator[ToolResult, None]:
+    """Run all tool calls of one model turn concurrently, yielding each result as it completes.
+
+    Calls exceeding ``call_timeout``, or still running when ``turn_timeout``
+    expires, are cancelled and reported as error results, so every tool call
+    gets exactly one result. Each call is traced as a child of ``span``.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + turn_timeout
+    tasks = {
+        asyncio.ensure_future(asyncio.wait_for(run_tool_call(client, index, tool_call, tavily_api_key, cache, span), call_timeout)): index
+        for index, tool_call in enumerate(tool_calls)
+    }
+    pending = set(tasks)
+
+    def timed_out(index: int, limit: float) -> ToolResult:
+        tool_call = tool_calls[index]
+        try:
+            query = _parse_arguments(tool_call).get('query', '')
+        except json.JSONDecodeError:
+            query = ''
+        return ToolResult(index, tool_call, query, {"error": f"Search timed out after {limit:g}s"}, limit)
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                try:
+                    yield task.result()
+                except asyncio.TimeoutError:
+                    yield timed_out(tasks[task], call_timeout)
+        for task in pending:
+            task.cancel()
+            yield timed_out(tasks[task], turn_timeout)
+    finally:
+        for task in pending:
+            task.cancel()
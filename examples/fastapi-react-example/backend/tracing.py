@@ -0,0 +1,356 @@
+import asyncio
+import json
+import random
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+import httpx
+
+# OTLP span status codes
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+# OTLP span kinds
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+
+TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(trace_id, parent span_id) from a W3C ``traceparent`` header, so a caller's trace continues here"""
+    match = TRACEPARENT.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2)
+
+def _any_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # int64 is a string in OTLP/JSON
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_any_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+def _attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _any_value(value)} for key, value in attributes.items()]
+
+class Span:
+    """One timed stage of a request, following the OpenTelemetry span model.
+
+    Spans are passed explicitly to the code they cover, like the request's
+    Budget, and ``child`` starts a nested span. Used as a context manager a
+    span ends on exit, and an exception marks it as failed (a cancelled
+    stream is only flagged, not failed).
+    """
+
+    __slots__ = ("trace", "name", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "events", "status", "status_message")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+        self.events: List[Tuple[str, int, Dict[str, Any]]] = []
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    @property
+    def request_id(self) -> str:
+        return self.trace.request_id
+
+    def child(self, name: str, kind: int = KIND_INTERNAL, **attributes: Any) -> "Span":
+        return self.trace.add(Span(self.trace, name, self.span_id, kind, attributes))
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def event(self, name: str, **attributes: Any):
+        self.events.append((name, time.time_ns(), attributes))
+
+    def error(self, message: str):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self is self.trace.root:
+                self.trace.finish()
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            if issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+                self.set("cancelled", True)
+            else:
+                self.error(f"{exc_type.__name__}: {exc}")
+        self.end()
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": _attributes(self.attributes),
+            "status": {"code": self.status, "message": self.status_message} if self.status_message else {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.events:
+            span["events"] = [{"name": name, "timeUnixNano": str(at), "attributes": _attributes(attributes)} for name, at, attributes in self.events]
+        return span
+
+class NoopSpan:
+    """Span that records nothing, passed where tracing is off"""
+
+    trace_id = None
+    request_id = None
+
+    def child(self, name: str, kind: int = KIND_INTERNAL, **attributes: Any) -> "NoopSpan":
+        return self
+
+    def set(self, key: str, value: Any):
+        pass
+
+    def event(self, name: str, **attributes: Any):
+        pass
+
+    def error(self, message: str):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self) -> "NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+class Trace:
+    """All spans of one request.
+
+    ``request_id`` is unique per request; ``trace_id`` may be shared with
+    other requests when callers continue one trace with ``traceparent``.
+    """
+
+    def __init__(self, tracer: "Tracer", trace_id: str, request_id: str):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.request_id = request_id
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self.dropped = 0
+
+    def add(self, span: Span) -> Span:
+        if len(self.spans) < self.tracer.max_spans:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+        return span
+
+    @property
+    def finished(self) -> bool:
+        return self.root is not None and self.root.end_ns is not None
+
+    def finish(self):
+        """Close spans left open (streams abandoned by their consumer) at the root's end, then export"""
+        for span in self.spans:
+            if span.end_ns is None:
+                span.end_ns = self.root.end_ns
+                span.set("unfinished", True)
+        self.tracer.export(self)
+
+def otlp_request(traces: List[Trace], service: str) -> Dict[str, Any]:
+    """OTLP/JSON ExportTraceServiceRequest body for ``traces``"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": service})},
+            "scopeSpans": [{
+                "scope": {"name": "dllm-backend.tracing"},
+                "spans": [span.to_otlp() for trace in traces for span in trace.spans],
+            }],
+        }]
+    }
+
+class FileExporter:
+    """Appends one OTLP/JSON export request per finished trace to a JSONL file.
+
+    Serializing and writing run on one background thread, in export order,
+    so disk latency never blocks the event loop; failed writes are counted.
+    """
+
+    def __init__(self, path: str, service: str):
+        self.path = path
+        self.service = service
+        self._file = open(path, "a", encoding="utf-8")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-file")
+        self.exported = 0
+        self.failed = 0
+
+    def export(self, trace: Trace):
+        # The request body is built here, so the writer thread never reads spans the loop may still touch
+        self._writer.submit(self._write, otlp_request([trace], self.service))
+
+    def _write(self, body: Dict[str, Any]):
+        try:
+            self._file.write(json.dumps(body, separators=(",", ":")) + "\n")
+            self._file.flush()
+            self.exported += 1
+        except (OSError, ValueError):
+            self.failed += 1
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._writer.shutdown)
+        self._file.close()
+
+class OTLPExporter:
+    """Posts finished traces to an OTLP/HTTP collector (``{endpoint}/v1/traces``, JSON encoding).
+
+    Posts run in the background so a slow or missing collector never delays
+    a response; failures are counted and the traces dropped.
+    """
+
+    def __init__(self, endpoint: str, service: str, timeout: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service = service
+        self.client = httpx.AsyncClient(timeout=timeout)
+        self.exported = 0
+        self.failed = 0
+        self._pending: Set[asyncio.Task] = set()
+
+    def export(self, trace: Trace):
+        task = asyncio.get_running_loop().create_task(self._post(trace))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _post(self, trace: Trace):
+        try:
+            response = await self.client.post(self.url, json=otlp_request([trace], self.service))
+            response.raise_for_status()
+            self.exported += 1
+        except httpx.HTTPError:
+            self.failed += 1
+
+    async def aclose(self):
+        if self._pending:
+            await asyncio.wait(self._pending, timeout=self.client.timeout.read)
+        await self.client.aclose()
+
+class Tracer:
+    """Starts request traces and keeps the last ``buffer_size`` of them for /debug/trace.
+
+    Finished traces are handed to every exporter; traces still running are
+    in the buffer too, so a slow request can be inspected while it runs.
+    """
+
+    def __init__(self, buffer_size: int = 200, exporters: Optional[List[Any]] = None, max_spans: int = 256):
+        self.buffer_size = buffer_size
+        self.exporters = exporters or []
+        self.max_spans = max_spans
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+
+    def start(self, name: str, traceparent: Optional[str] = None, kind: int = KIND_SERVER, **attributes: Any) -> Span:
+        """Root span of a new request, continuing the caller's trace when ``traceparent`` is valid.
+
+        The trace is held under a fresh ``request_id``, never the caller's
+        trace id, so concurrent requests in one trace each keep their own.
+        """
+        parent = parse_traceparent(traceparent)
+        trace_id, parent_id = parent if parent else (f"{random.getrandbits(128):032x}", None)
+        request_id = f"{random.getrandbits(128):032x}"
+        trace = Trace(self, trace_id, request_id)
+        trace.root = trace.add(Span(trace, name, parent_id, kind, attributes))
+        trace.root.set("request.id", request_id)
+        self._traces[request_id] = trace
+        while len(self._traces) > self.buffer_size:
+            self._traces.popitem(last=False)
+        return trace.root
+
+    def get(self, request_id: str) -> Optional[Trace]:
+        return self._traces.get(request_id)
+
+    def recent(self) -> List[Trace]:
+        return list(reversed(self._traces.values()))
+
+    def export(self, trace: Trace):
+        for exporter in self.exporters:
+            try:
+                exporter.export(trace)
+            except Exception:
+                # Tracing must never break the request it describes
+                pass
+
+    async def aclose(self):
+        for exporter in self.exporters:
+            await exporter.aclose()
+
+def _ms(ns: int) -> float:
+    return ns / 1e6
+
+def waterfall(trace: Trace, width: int = 50) -> str:
+    """Plain-text waterfall: one row per span in tree order, with a bar on the request's timeline"""
+    root = trace.root
+    now = time.time_ns()
+    end = max((span.end_ns or now) for span in trace.spans)
+    total = max(end - root.start_ns, 1)
+    children: Dict[Optional[str], List[Span]] = {}
+    for span in trace.spans:
+        children.setdefault(span.parent_id if span is not root else None, []).append(span)
+
+    rows: List[Tuple[int, Span]] = []
+    def walk(span: Span, depth: int):
+        rows.append((depth, span))
+        for child in sorted(children.get(span.span_id, []), key=lambda child: child.start_ns):
+            walk(child, depth + 1)
+    walk(root, 0)
+
+    label_width = max(len("  " * depth + span.name) for depth, span in rows) + 2
+    state = "running" if root.end_ns is None else root.attributes.get("outcome", "finished")
+    lines = [
+        f"request {trace.request_id}  trace {trace.trace_id}  {root.name}  {_ms(total):.1f}ms  {state}",
+        f"{'':<{label_width}}|0ms{'':<{width - 9}}{_ms(total):>6.0f}ms|",
+    ]
+    for depth, span in rows:
+        start = span.start_ns - root.start_ns
+        stop = (span.end_ns or now) - root.start_ns
+        left = int(start / total * width)
+        length = max(1, int(stop / total * width) - left)
+        bar = [" "] * width
+        for i in range(left, min(left + length, width)):
+            bar[i] = "#" if span.status != STATUS_ERROR else "!"
+        for _, at, _ in span.events:
+            position = min(int((at - root.start_ns) / total * width), width - 1)
+            bar[position] = "|"
+        details = " ".join(f"{key}={value}" for key, value in span.attributes.items())
+        if span.status == STATUS_ERROR:
+            details = f"error={span.status_message!r} {details}"
+        if span.end_ns is None:
+            details = f"(running) {details}"
+        label = "  " * depth + span.name
+        lines.append(f"{label:<{label_width}}|{''.join(bar)}| {_ms(stop - start):>8.1f}ms  {details}".rstrip())
+    if trace.dropped:
+        lines.append(f"({trace.dropped} spans dropped over the per-trace limit)")
+    lines.append("| on a bar marks an event such as the first token")
+    return "\n".join(lines) + "\n"
+
+# What traced code accepts as its parent: a real span, or NOOP_SPAN when tracing is off
+SpanLike = Union[Span, NoopSpan]
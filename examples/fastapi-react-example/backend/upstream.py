@@ -0,0 +1,94 @@
+import asyncio
+import httpx
+from typing import Any, Dict, Optional
+import config
+
+INCEPTION_API_URL = config.INCEPTION_API_URL
+TAVILY_API_URL = config.TAVILY_API_URL
+
+class PoolStats:
+    """Connection reuse counters for one upstream connection pool"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.http2_responses = 0
+
+    async def on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def on_response(self, response: httpx.Response):
+        if response.http_version == "HTTP/2":
+            self.http2_responses += 1
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]):
+        # httpcore only opens a TCP connection when no pooled one can take the request
+        if event_name == "connection.connect_tcp.complete":
+            self.connections += 1
+
+    def stats(self) -> Dict[str, Any]:
+        reused = max(self.requests - self.connections, 0)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections,
+            "reused": reused,
+            "reuse_rate": reused / self.requests if self.requests else 0.0,
+            "http2_responses": self.http2_responses,
+        }
+
+def pool_usage(client: httpx.AsyncClient) -> Dict[str, int]:
+    """Open connections of a client's pool by state; empty if the transport is not httpx's default"""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    if pool is None:
+        return {}
+    connections = list(pool.connections)
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {"active": len(connections) - idle, "idle": idle}
+
+def create_http_client(
+    pool_size: int = 50,
+    http2: bool = True,
+    keepalive_expiry: float = 30.0,
+    stats: Optional[PoolStats] = None
+) -> httpx.AsyncClient:
+    """Create a pooled keep-alive client for one upstream host.
+
+    At most ``pool_size`` connections are open at once and all of them are
+    kept alive between requests. HTTP/2 (which multiplexes requests over one
+    connection) is used when the server offers it and ``h2`` is installed.
+    """
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            http2 = False
+    event_hooks = {"request": [stats.on_request], "response": [stats.on_response]} if stats is not None else None
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=keepalive_expiry),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        event_hooks=event_hooks
+    )
+
+async def warm_up(client: httpx.AsyncClient, url: str, connections: int = 2, timeout: float = 3.0) -> int:
+    """Open up to ``connections`` pooled connections to ``url``'s host; returns how many came up.
+
+    Any HTTP response proves the connection (the endpoint may well reject a
+    bare HEAD), and failures are ignored so an unreachable host never blocks
+    startup for longer than ``timeout``.
+    """
+    async def touch() -> bool:
+        try:
+            await client.head(url, timeout=timeout)
+            return True
+        except httpx.HTTPError:
+            return False
+    return sum(await asyncio.gather(*(touch() for _ in range(connections))))
+
+def inception_headers(api_key: str) -> dict:
+    """Request headers for the Inception Labs API"""
+    return {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {api_key}'
+    }
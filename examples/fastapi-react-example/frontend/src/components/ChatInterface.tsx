@@ -1,4 +1,4 @@
-import { useState, useCallback, useEffect } from 'react';
+import { useState, useCallback, useEffect, useRef } from 'react';
 import { Settings, Trash2 } from 'lucide-react';
 import { Button } from '@/components/ui/button';
 import { ModeToggle } from './mode-toggle';
@@ -15,6 +15,7 @@ import ChatInput from './ChatInput';
 import ApiKeySetup from './ApiKeySetup';
 import LoadingSkeleton from './LoadingSkeleton';
 import { useAPIKeyStore, useChatModeStore, useChatStore } from '@/lib/stores';
+import { ContentAssembler, readResumableSSE, type StreamPayload } from '@/lib/stream';
 
 const API_BASE_URL = 'http://localhost:8000';
 
@@ -23,6 +24,8 @@ const ChatInterface = () => {
   const [initializing, setInitializing] = useState(true);
   const [showApiKeyDialog, setShowApiKeyDialog] = useState(false);
   const [abortController, setAbortController] = useState<AbortController | null>(null);
+  // URL of the response being streamed, to resume it after a dropped connection or cancel it on stop
+  const streamUrl = useRef<string | null>(null);
   
   const { hasRequiredKeys, apiKeys, validationResult } = useAPIKeyStore();
   const { mode } = useChatModeStore();
@@ -47,6 +50,8 @@ const ChatInterface = () => {
 
   const handleStop = useCallback(() => {
     if (abortController) {
+      // Generation outlives the connection so it can be resumed; stopping must end it explicitly
+      if (streamUrl.current) fetch(streamUrl.current, { method: 'DELETE' }).catch(() => {});
       abortController.abort();
       setAbortController(null);
       setLoading(false);
@@ -84,6 +89,9 @@ const ChatInterface = () => {
           tavily_api_key: apiKeys.tavily || null,
           tools_enabled: toolsEnabled && !!apiKeys.tavily,
           max_tokens: 800,
+          stream_protocol: 'delta',
+          commit_frames: true,
+          resumable: true,
         }),
         signal: controller.signal,
       });
@@ -102,7 +110,10 @@ const ChatInterface = () => {
           errorMessage = 'Invalid API key. Please check your credentials.';
           toast.error('Authentication failed - Please check your API key');
         } else if (response.status === 429) {
-          errorMessage = 'Rate limit exceeded. Please try again later.';
+          const retryAfter = response.headers.get('Retry-After');
+          errorMessage = retryAfter
+            ? `Rate limit exceeded. Please try again in ${retryAfter}s.`
+            : 'Rate limit exceeded. Please try again later.';
           toast.error('Rate limit exceeded - Please wait before sending another message');
         } else if (response.status >= 500) {
           errorMessage = 'Server error occurred. Please try again.';
@@ -119,58 +130,57 @@ const ChatInterface = () => {
         return;
       }
 
-      const reader = response.body?.getReader();
-      const decoder = new TextDecoder();
-      let accumulatedContent = '';
+      const streamId = response.headers.get('X-Stream-ID');
+      streamUrl.current = streamId ? `${API_BASE_URL}/chat/${streamId}` : null;
+      const assembler = new ContentAssembler();
 
-      if (reader) {
-        while (true) {
-          const { done, value } = await reader.read();
-          if (done) break;
+      if (response.body) {
+        for await (const jsonStr of readResumableSSE(response, streamUrl.current, controller.signal)) {
+          if (jsonStr === '[DONE]' || !jsonStr.startsWith('{')) continue;
 
-          const chunk = decoder.decode(value);
-          const lines = chunk.split('\n');
+          let data: StreamPayload;
+          try {
+            data = JSON.parse(jsonStr);
+          } catch (parseError: any) {
+            console.error('JSON parsing error:', parseError);
+            toast.error('Failed to parse response data');
+            continue;
+          }
+
+          if (data.error) {
+            throw new Error(data.retry_after
+              ? `${data.error} (retry in ${data.retry_after}s)`
+              : data.error);
+          }
 
-          for (const line of lines) {
-            const trimmed = line.trim();
-            if (!trimmed || !trimmed.startsWith('data: ')) continue;
-            if (trimmed === 'data: [DONE]') continue;
+          if (data.queued && !assembler.text) {
+            updateMessage(assistantMessageId, {
+              content: `_Waiting for upstream capacity (position ${data.queued.position})…_`,
+              isStreaming: true
+            });
+          }
 
-            const jsonStr = trimmed.substring(6);
-            if (!jsonStr.startsWith('{')) continue;
+          if (data.truncated) {
+            toast.warning(data.truncated === 'deadline'
+              ? 'Response stopped: request time limit reached'
+              : 'Response stopped: token limit reached');
+          }
 
-            try {
-              const data = JSON.parse(jsonStr);
-              
-              if (data.error) {
-                throw new Error(data.error);
-              }
-              
-              if (data.content !== undefined) {
-                if (mode === 'streaming') {
-                  // Streaming: accumulate content
-                  accumulatedContent += data.content;
-                  updateMessage(assistantMessageId, {
-                    content: accumulatedContent,
-                    isStreaming: true
-                  });
-                } else {
-                  // Diffusing: replace entire content
-                  updateMessage(assistantMessageId, {
-                    content: data.content || '',
-                    isStreaming: true
-                  });
-                }
-              }
-            } catch (parseError: any) {
-              console.error('JSON parsing error:', parseError);
-              toast.error('Failed to parse response data');
-            }
+          if (data.delta !== undefined || data.patch !== undefined || data.content !== undefined
+              || data.commit !== undefined || data.uncommit) {
+            // Deltas are appended and patches applied locally; snapshots replace the text.
+            // Committed blocks keep their identity, so only the tail after them re-renders
+            updateMessage(assistantMessageId, {
+              content: assembler.apply(data),
+              committed: assembler.committed,
+              isStreaming: true
+            });
           }
         }
       }
 
-      updateMessage(assistantMessageId, { isStreaming: false });
+      // The finished message renders as one document, as before streaming split it
+      updateMessage(assistantMessageId, { isStreaming: false, committed: undefined });
       toast.success('Response completed');
 
     } catch (error: any) {
@@ -179,7 +189,8 @@ const ChatInterface = () => {
       if (error.name === 'AbortError') {
         updateMessage(assistantMessageId, {
           content: '**Response cancelled by user.**',
-          isStreaming: false
+          isStreaming: false,
+          committed: undefined
         });
         return;
       } else if (error.message) {
@@ -192,9 +203,11 @@ const ChatInterface = () => {
       updateMessage(assistantMessageId, {
         content: `**Error:** ${errorMessage}`,
         isStreaming: false,
-        isError: true
+        isError: true,
+        committed: undefined
       });
     } finally {
+      streamUrl.current = null;
       setLoading(false);
       setAbortController(null);
     }
@@ -74,10 +74,22 @@ function MessageComponent({ message, isStreaming = false }: MessageProps) {
             <div className={cn(
               message.isError && "text-red-600 dark:text-red-400"
             )}>
-              <MemoizedMarkdown 
-                content={message.content} 
-                id={message.id}
-              />
+              {message.committed?.length ? (
+                <>
+                  {message.committed.map((block, i) => (
+                    <MemoizedMarkdown key={i} content={block} id={`${message.id}-${i}`} />
+                  ))}
+                  <MemoizedMarkdown
+                    content={message.content.slice(message.committed.reduce((length, block) => length + block.length, 0))}
+                    id={`${message.id}-tail`}
+                  />
+                </>
+              ) : (
+                <MemoizedMarkdown 
+                  content={message.content} 
+                  id={message.id}
+                />
+              )}
             </div>
           ) : (
             <div className="flex items-center space-x-2 py-2">
@@ -115,6 +127,7 @@ const Message = memo(MessageComponent, (prevProps, nextProps) => {
   return (
     prevProps.message.id === nextProps.message.id &&
     prevProps.message.content === nextProps.message.content &&
+    prevProps.message.committed === nextProps.message.committed &&
     prevProps.isStreaming === nextProps.isStreaming &&
     prevProps.message.isError === nextProps.message.isError
   );
@@ -7,6 +7,8 @@ export interface Message {
   content: string;
   isStreaming?: boolean;
   isError?: boolean;
+  /** While streaming: leading markdown blocks that will not change, each rendered once */
+  committed?: string[];
   timestamp: Date;
 }
 
@@ -0,0 +1,156 @@
+export type StreamProtocol = 'snapshot' | 'delta';
+
+/** Edit op against the previous diffusion frame: [position, deleteCount, insert] */
+export type PatchOp = [number, number, string];
+
+export interface StreamPayload {
+  content?: string;
+  delta?: string;
+  patch?: PatchOp[];
+  checkpoint?: boolean;
+  keyframe?: boolean;
+  mode?: string;
+  error?: string;
+  /** Seconds to wait before retrying, sent with errors caused by upstream load */
+  retry_after?: number;
+  /** Sent while the request waits for upstream capacity */
+  queued?: { position: number; waiting: number; waited: number };
+  /** Set when the server cut the response short: 'max_tokens' or 'deadline' */
+  truncated?: string;
+  /** Diffusing with `commit_frames`: this many UTF-16 units at the start of the frame are final */
+  commit?: number;
+  /** A frame changed committed text: it all belongs to the frame again */
+  uncommit?: boolean;
+}
+
+/**
+ * Splits a fetch body into SSE `data:` payloads, keeping partial lines
+ * buffered across reads so no event is lost at chunk boundaries. Event
+ * `id:` lines are passed to `onEventId` before their payload is yielded.
+ */
+export async function* readSSE(reader: ReadableStreamDefaultReader<Uint8Array>, onEventId?: (id: string) => void): AsyncGenerator<string> {
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    buffer += done ? decoder.decode() : decoder.decode(value, { stream: true });
+
+    let newline = buffer.indexOf('\n');
+    while (newline !== -1) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (line.startsWith('id: ')) onEventId?.(line.substring(4));
+      else if (line.startsWith('data: ')) yield line.substring(6);
+      newline = buffer.indexOf('\n');
+    }
+
+    if (done) {
+      const rest = buffer.trim();
+      if (rest.startsWith('data: ')) yield rest.substring(6);
+      return;
+    }
+  }
+}
+
+/**
+ * Reads a /chat response like `readSSE`, reconnecting when the connection
+ * drops before `[DONE]`. The reconnect asks `resumeUrl` for the events after
+ * the last id seen, so generation is not paid for twice. Gives up after
+ * `maxRetries` reconnects in a row that deliver no new event.
+ */
+export async function* readResumableSSE(
+  response: Response,
+  resumeUrl: string | null,
+  signal: AbortSignal,
+  maxRetries = 3,
+): AsyncGenerator<string> {
+  let body = response.body;
+  let lastEventId = '0';
+  let retries = 0;
+
+  while (true) {
+    try {
+      if (!body) {
+        const resumed = await fetch(resumeUrl!, { headers: { 'Last-Event-ID': lastEventId }, signal });
+        if (!resumed.ok) {
+          throw new Error(resumed.status === 410
+            ? 'Connection lost for too long to resume the response'
+            : `Connection lost and the response could not be resumed (HTTP ${resumed.status})`);
+        }
+        body = resumed.body;
+        if (!body) return;
+      }
+      for await (const data of readSSE(body.getReader(), id => { lastEventId = id; retries = 0; })) {
+        yield data;
+        if (data === '[DONE]') return;
+      }
+      // The body ended without [DONE]: resumable only if the server sent event ids
+      if (!resumeUrl) return;
+    } catch (error) {
+      // Network failures surface as TypeError; anything else (aborts, HTTP errors) is final
+      if (!resumeUrl || signal.aborted || retries >= maxRetries || !(error instanceof TypeError)) throw error;
+    }
+    if (retries >= maxRetries) throw new Error('Connection lost and the response could not be resumed');
+    body = null;
+    await new Promise(resolve => setTimeout(resolve, 500 * 2 ** retries));
+    retries += 1;
+  }
+}
+
+/**
+ * Rebuilds message text from the delta protocol: deltas are appended to a
+ * local buffer, diffusion patches edit the previous frame, and full
+ * `content` snapshots (checkpoints/keyframes) replace it. Committed blocks
+ * are moved off the front of the frame, which from then on holds only the
+ * text after them.
+ */
+export class ContentAssembler {
+  private parts: string[] = [];
+  private committedText = '';
+  /** Final leading blocks, oldest first; replaced (not mutated) when it changes */
+  committed: string[] = [];
+
+  apply(payload: StreamPayload): string {
+    if (payload.delta !== undefined) {
+      this.parts.push(payload.delta);
+    } else if (payload.patch !== undefined) {
+      this.parts = [applyPatch(this.tail, payload.patch)];
+    } else if (payload.content !== undefined) {
+      this.parts = [payload.content];
+    } else if (payload.commit !== undefined) {
+      const tail = this.tail;
+      const block = tail.slice(0, payload.commit);
+      this.committed = [...this.committed, block];
+      this.committedText += block;
+      this.parts = [tail.slice(payload.commit)];
+    } else if (payload.uncommit) {
+      this.parts = [this.committedText + this.tail];
+      this.committed = [];
+      this.committedText = '';
+    }
+    return this.text;
+  }
+
+  /** The text after the committed blocks */
+  get tail(): string {
+    if (this.parts.length > 1) this.parts = [this.parts.join('')];
+    return this.parts[0] ?? '';
+  }
+
+  get text(): string {
+    return this.committedText + this.tail;
+  }
+}
+
+/** Applies ascending [position, deleteCount, insert] ops that reference the previous frame. */
+export function applyPatch(previous: string, ops: PatchOp[]): string {
+  const out: string[] = [];
+  let cursor = 0;
+  for (const [position, deleteCount, insert] of ops) {
+    out.push(previous.slice(cursor, position), insert);
+    cursor = position + deleteCount;
+  }
+  out.push(previous.slice(cursor));
+  return out.join('');
+}
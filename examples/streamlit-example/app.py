@@ -1,8 +1,11 @@
 import streamlit as st
 import requests
-import json
-import time
-from typing import Generator
+from typing import Generator, Tuple
+from context import fit_messages, summarize_with_inception
+from http_session import PooledSession, create_session
+from key_cache import KeyValidationCache, create_key_cache
+from render import DiffusionRenderer, RenderScheduler
+from sse_parser import iter_chunks
 
 st.set_page_config(
     page_title="AI Chat Assistant",
@@ -20,16 +23,35 @@ if "api_key_valid" not in st.session_state:
     st.session_state.api_key_valid = None
 if "validating" not in st.session_state:
     st.session_state.validating = False
+if "context_tokens" not in st.session_state:
+    st.session_state.context_tokens = 6000
+if "summarize_history" not in st.session_state:
+    st.session_state.summarize_history = True
+if "summary_cache" not in st.session_state:
+    st.session_state.summary_cache = {}
 if "max_tokens" not in st.session_state:
     st.session_state.max_tokens = 2000
 
+@st.cache_resource
+def get_http_session() -> PooledSession:
+    """Process-wide keep-alive session so Inception and Tavily calls reuse open connections across reruns"""
+    return create_session()
+
+@st.cache_resource
+def get_key_cache() -> KeyValidationCache:
+    """Process-wide validation cache so reruns and repeated keys skip the paid upstream check"""
+    return create_key_cache()
+
 def validate_api_key(api_key: str) -> dict:
-    """Validate the API key by making an actual API request"""
+    """Validate the API key, reusing a recent result for the same key"""
     if not api_key or len(api_key.strip()) < 10:
         return {"valid": False, "error": "API key is too short"}
-    
+    return get_key_cache().get_or_validate(api_key, lambda: check_api_key(api_key))
+
+def check_api_key(api_key: str) -> Tuple[dict, bool]:
+    """Validate the API key by making an actual API request; the flag says whether a failure is definitive"""
     try:
-        response = requests.post(
+        response = get_http_session().post(
             'https://api.inceptionlabs.ai/v1/chat/completions',
             headers={
                 'Content-Type': 'application/json',
@@ -44,26 +66,28 @@ def validate_api_key(api_key: str) -> dict:
         )
         
         if response.status_code == 200:
-            return {"valid": True, "error": None}
+            return {"valid": True, "error": None}, True
         else:
             try:
                 error_data = response.json()
                 error_msg = error_data.get("error", f"API request failed with status {response.status_code}")
             except:
                 error_msg = f"API request failed with status {response.status_code}"
-            return {"valid": False, "error": error_msg}
+            # Rate limits and server errors say nothing about the key itself
+            definitive = 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+            return {"valid": False, "error": error_msg}, definitive
             
     except requests.exceptions.Timeout:
-        return {"valid": False, "error": "Request timed out"}
+        return {"valid": False, "error": "Request timed out"}, False
     except requests.exceptions.RequestException as e:
-        return {"valid": False, "error": f"Network error: {str(e)}"}
+        return {"valid": False, "error": f"Network error: {str(e)}"}, False
     except Exception as e:
-        return {"valid": False, "error": f"Unexpected error: {str(e)}"}
+        return {"valid": False, "error": f"Unexpected error: {str(e)}"}, False
 
 def stream_response(messages: list, api_key: str, max_tokens: int) -> Generator[str, None, None]:
-    """Stream response"""
+    """Stream response, yielding only the newly generated text of each chunk"""
     try:
-        response = requests.post(
+        with get_http_session().post(
             'https://api.inceptionlabs.ai/v1/chat/completions',
             headers={
                 'Content-Type': 'application/json',
@@ -76,32 +100,17 @@ def stream_response(messages: list, api_key: str, max_tokens: int) -> Generator[
                 'stream': True
             },
             stream=True
-        )
-        
-        if response.status_code != 200:
-            yield f"Error: API request failed with status {response.status_code}"
-            return
+        ) as response:
+            if response.status_code != 200:
+                yield f"Error: API request failed with status {response.status_code}"
+                return
 
-        accumulated_content = ""
-        
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    data_str = line[6:]  
-                    if data_str.strip() == '[DONE]':
-                        break
-                    if data_str.startswith('{'):
-                        try:
-                            data = json.loads(data_str)
-                            if 'choices' in data and len(data['choices']) > 0:
-                                delta = data['choices'][0].get('delta', {})
-                                content = delta.get('content', '')
-                                if content:
-                                    accumulated_content += content
-                                    yield accumulated_content
-                        except json.JSONDecodeError:
-                            continue
+            for chunk in iter_chunks(response.iter_content(chunk_size=None)):
+                if chunk.done:
+                    break
+                content = chunk.delta.get('content')
+                if content:
+                    yield content
                             
     except Exception as e:
         yield f"Error: {str(e)}"
@@ -109,7 +118,7 @@ def stream_response(messages: list, api_key: str, max_tokens: int) -> Generator[
 def diffuse_response(messages: list, api_key: str, max_tokens: int) -> Generator[str, None, None]:
     """Get diffusing response"""
     try:
-        response = requests.post(
+        with get_http_session().post(
             'https://api.inceptionlabs.ai/v1/chat/completions',
             headers={
                 'Content-Type': 'application/json',
@@ -123,29 +132,21 @@ def diffuse_response(messages: list, api_key: str, max_tokens: int) -> Generator
                 'diffusing': True  
             },
             stream=True
-        )
+        ) as response:
+            if response.status_code != 200:
+                yield f"Error: API request failed with status {response.status_code}"
+                return
         
-        if response.status_code != 200:
-            yield f"Error: API request failed with status {response.status_code}"
-            return
+            previous_content = None
         
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    data_str = line[6:]  
-                    if data_str.strip() == '[DONE]':
-                        break
-                    if data_str.startswith('{'):
-                        try:
-                            data = json.loads(data_str)
-                            if 'choices' in data and len(data['choices']) > 0:
-                                delta = data['choices'][0].get('delta', {})
-                                content = delta.get('content', '')
-                                if content is not None:
-                                    yield content
-                        except json.JSONDecodeError:
-                            continue
+            for chunk in iter_chunks(response.iter_content(chunk_size=None)):
+                if chunk.done:
+                    break
+                content = chunk.delta.get('content')
+                # Unchanged denoising steps would only trigger a redundant re-render
+                if content is not None and content != previous_content:
+                    previous_content = content
+                    yield content
                             
     except Exception as e:
         yield f"Error: {str(e)}"
@@ -165,7 +166,9 @@ with st.sidebar:
     
     if api_key != st.session_state.api_key:
         st.session_state.api_key = api_key
-        st.session_state.api_key_valid = None
+        cached_result = get_key_cache().peek(api_key) if api_key else None
+        st.session_state.api_key_valid = cached_result["valid"] if cached_result else None
+        st.session_state.validation_error = cached_result["error"] if cached_result else None
     
     # Validate button
     col1, col2 = st.columns([1, 1])
@@ -208,6 +211,22 @@ with st.sidebar:
      
     
     
+    st.subheader("🧠 Context")
+    context_tokens = st.slider(
+        "Context Budget (tokens)",
+        min_value=500,
+        max_value=32000,
+        value=st.session_state.context_tokens,
+        step=500,
+        help="Older messages are dropped (or summarized) to keep the prompt within this budget"
+    )
+    st.session_state.context_tokens = context_tokens
+    st.session_state.summarize_history = st.checkbox(
+        "Summarize older messages",
+        value=st.session_state.summarize_history,
+        help="Replace messages that no longer fit with a rolling summary instead of dropping them"
+    )
+    
     st.subheader("🔄 Chat Mode")
     mode = st.radio(
         "Select mode:",
@@ -219,9 +238,13 @@ with st.sidebar:
     if mode != st.session_state.chat_mode:
         st.session_state.chat_mode = mode
      
+    pool_stats = get_http_session().pool_stats()
+    if pool_stats:
+        st.caption("🔌 Connection reuse: " + ", ".join(f"{host} {stats['reuse_rate']:.0%} of {stats['requests']}" for host, stats in pool_stats.items()))
     
     if st.button("🗑️ Clear Chat", use_container_width=True):
         st.session_state.messages = []
+        st.session_state.summary_cache = {}
         st.rerun()
 
 st.subheader(f"💬 Chat ({st.session_state.chat_mode.title()} Mode - {st.session_state.max_tokens} tokens)")
@@ -241,26 +264,34 @@ if prompt := st.chat_input("Type your message here...", disabled=not (st.session
     
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
-        api_messages = [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
+        summarize = (lambda previous, messages: summarize_with_inception(st.session_state.api_key, previous, messages, get_http_session())) if st.session_state.summarize_history else None
+        api_messages = fit_messages(
+            [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages],
+            st.session_state.context_tokens,
+            summarize,
+            st.session_state.summary_cache
+        )
         
         try:
             if st.session_state.chat_mode == "streaming":
                 # Streaming mode 
                 full_response = ""
+                renderer = RenderScheduler(message_placeholder)
                 for chunk in stream_response(api_messages, st.session_state.api_key, st.session_state.max_tokens):
-                    full_response = chunk
-                    message_placeholder.markdown(full_response + "▌")
-                message_placeholder.markdown(full_response)
+                    full_response += chunk
+                    renderer.update(full_response, "▌")
+                renderer.finish(full_response)
                 
             else:
                 # Diffusing mode 
                 with st.spinner("🔄 Diffusing response..."):
                     current_response = ""
+                    # Leading blocks that stop changing are drawn once; only the rest is repainted
+                    renderer = DiffusionRenderer(message_placeholder)
                     for chunk in diffuse_response(api_messages, st.session_state.api_key, st.session_state.max_tokens):
                         current_response = chunk
-                        message_placeholder.markdown(current_response + " ✨")
-                        time.sleep(0.05)
-                    message_placeholder.markdown(current_response)
+                        renderer.update(current_response, " ✨")
+                    renderer.finish(current_response)
                     full_response = current_response
             
             st.session_state.messages.append({"role": "assistant", "content": full_response})
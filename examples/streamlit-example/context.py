@@ -0,0 +1,135 @@
+import hashlib
+import json
+import re
+import requests
+from typing import Callable, Dict, List, Optional
+
+# Per-message framing overhead (role, separators) in tokens
+MESSAGE_OVERHEAD = 4
+# Tokens reserved for the rolling summary when one is used
+SUMMARY_MAX_TOKENS = 256
+# Trimmed history is summarized in blocks of this many messages, so one summary serves several turns
+SUMMARY_BLOCK = 8
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for use as context in later turns. "
+    "Keep names, numbers, decisions, open questions and user preferences. "
+    "Reply with the summary only, at most 150 words."
+)
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate: punctuation counts as one token, words as one per 4 characters"""
+    return sum((len(piece) + 3) // 4 for piece in _WORD_RE.findall(text or ""))
+
+def message_tokens(message: Dict) -> int:
+    tokens = MESSAGE_OVERHEAD + estimate_tokens(message.get("content") or "")
+    if message.get("tool_calls"):
+        tokens += estimate_tokens(json.dumps(message["tool_calls"]))
+    return tokens
+
+def _group_starts(messages: List[Dict]) -> List[int]:
+    """Indices where a message group starts; tool results stay with the assistant turn that requested them"""
+    return [i for i, message in enumerate(messages) if i == 0 or message.get("role") != "tool"]
+
+def sliding_window(messages: List[Dict], max_tokens: int) -> int:
+    """Index of the oldest message that still fits, walking back from the newest.
+
+    The newest message group is always kept, even when it alone exceeds the budget.
+    """
+    starts = _group_starts(messages)
+    used = 0
+    cut = len(messages)
+    for start in reversed(starts):
+        group_tokens = sum(message_tokens(message) for message in messages[start:cut])
+        if used + group_tokens > max_tokens and cut < len(messages):
+            break
+        used += group_tokens
+        cut = start
+    return cut
+
+def _prefix_hashes(messages: List[Dict]) -> List[str]:
+    """Chained hashes so ``hashes[i]`` identifies ``messages[:i]``"""
+    hashes = [hashlib.sha256(b"").hexdigest()]
+    for message in messages:
+        encoded = json.dumps([message.get("role"), message.get("content")], ensure_ascii=False).encode()
+        hashes.append(hashlib.sha256(hashes[-1].encode() + encoded).hexdigest())
+    return hashes
+
+def fit_messages(
+    messages: List[Dict],
+    max_tokens: int,
+    summarize: Optional[Callable[[str, List[Dict]], str]] = None,
+    summary_cache: Optional[Dict[str, str]] = None,
+    block: int = SUMMARY_BLOCK
+) -> List[Dict]:
+    """Fit chat history into a token budget.
+
+    System messages are pinned; the rest is a sliding window of the newest
+    messages. With ``summarize``, what falls out of the window is replaced by
+    a rolling summary kept in ``summary_cache`` (e.g. in session state), so
+    each part of the conversation is summarized once and reused.
+    """
+    pinned = [message for message in messages if message.get("role") == "system"]
+    history = [message for message in messages if message.get("role") != "system"]
+    budget = max_tokens - sum(message_tokens(message) for message in pinned)
+    if sum(message_tokens(message) for message in history) <= budget:
+        return messages
+
+    if summarize is None:
+        return pinned + history[sliding_window(history, budget):]
+
+    cut = sliding_window(history, budget - SUMMARY_MAX_TOKENS)
+    if cut == 0:
+        return pinned + history
+    # Round the cut up to a block boundary so one summary serves every turn until the window
+    # passes the next block, but never give up more than half of the window for it
+    starts = _group_starts(history)
+    aligned = min(-(-cut // block) * block, cut + (len(history) - cut) // 2, starts[-1])
+    cut = next(start for start in starts if start >= aligned)
+
+    cache = summary_cache if summary_cache is not None else {}
+    hashes = _prefix_hashes(history[:cut])
+    summary = cache.get(hashes[cut])
+    if summary is None:
+        start, previous = 0, ""
+        for i in range(cut - 1, 0, -1):
+            if hashes[i] in cache:
+                start, previous = i, cache[hashes[i]]
+                break
+        try:
+            summary = summarize(previous, history[start:cut])
+        except Exception:
+            summary = None
+        if not summary:
+            return pinned + history[sliding_window(history, budget):]
+        cache[hashes[cut]] = summary
+
+    summary_message = {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+    return pinned + [summary_message] + history[cut:]
+
+def summarize_with_inception(api_key: str, previous_summary: str, messages: List[Dict], session: Optional[requests.Session] = None) -> str:
+    """Extend ``previous_summary`` with ``messages`` using a short non-streaming completion"""
+    lines = [f"{message['role']}: {message['content']}" for message in messages if message.get("content")]
+    transcript = "\n\n".join(lines)
+    if previous_summary:
+        transcript = f"Earlier summary:\n{previous_summary}\n\nConversation:\n{transcript}"
+    response = (session or requests).post(
+        'https://api.inceptionlabs.ai/v1/chat/completions',
+        headers={
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {api_key}'
+        },
+        json={
+            'model': 'mercury-coder',
+            'messages': [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript}
+            ],
+            'max_tokens': SUMMARY_MAX_TOKENS
+        },
+        timeout=20
+    )
+    response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"].strip()
@@ -0,0 +1,69 @@
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+class _CountingPool:
+    """Counts requests that had to open a socket; the rest reused a kept-alive connection"""
+    sockets_opened = 0
+
+    def _make_request(self, conn, *args, **kwargs):
+        if getattr(conn, "sock", None) is None:
+            self.sockets_opened += 1
+        return super()._make_request(conn, *args, **kwargs)
+
+class _CountingHTTPPool(_CountingPool, HTTPConnectionPool):
+    pass
+
+class _CountingHTTPSPool(_CountingPool, HTTPSConnectionPool):
+    pass
+
+class _PoolAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _CountingHTTPPool, "https": _CountingHTTPSPool}
+
+class PooledSession(requests.Session):
+    """A ``requests`` session with bounded keep-alive connection pools per upstream host.
+
+    urllib3 keeps one pool per host; each holds at most ``pool_size``
+    connections and a request waits for a free one rather than opening an
+    extra connection. Connections stay open between Streamlit reruns when the
+    session is held in ``st.cache_resource``. Streamed responses must be
+    closed (``with session.post(..., stream=True) as response``) to hand
+    their connection back.
+    """
+
+    def __init__(self, pool_size: int = 10, max_hosts: int = 8):
+        super().__init__()
+        self._adapter = _PoolAdapter(pool_connections=max_hosts, pool_maxsize=pool_size, pool_block=True)
+        self.mount("https://", self._adapter)
+        self.mount("http://", self._adapter)
+
+    def pool_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Requests sent and connections opened per host, with the share served by a reused connection"""
+        stats = {}
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            reused = max(pool.num_requests - pool.sockets_opened, 0)
+            stats[pool.host] = {
+                "requests": pool.num_requests,
+                "connections_opened": pool.sockets_opened,
+                "reused": reused,
+                "reuse_rate": reused / pool.num_requests if pool.num_requests else 0.0,
+            }
+        return stats
+
+    def reuse_rate(self) -> float:
+        """Share of requests, across all hosts, that went over an already-open connection"""
+        stats = self.pool_stats().values()
+        requests_sent = sum(host["requests"] for host in stats)
+        return sum(host["reused"] for host in stats) / requests_sent if requests_sent else 0.0
+
+def create_session() -> PooledSession:
+    """Build the shared session from HTTP_POOL_SIZE"""
+    return PooledSession(int(os.getenv("HTTP_POOL_SIZE", "10")))
@@ -0,0 +1,84 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+class KeyValidationCache:
+    """Thread-safe cache of API-key validation results keyed by an HMAC of the key.
+
+    Raw keys are never stored. Valid keys are kept for ``ttl`` seconds and
+    definitive rejections for ``failure_ttl``; transient failures are not
+    cached. Concurrent validations of the same key share one upstream call.
+    At most ``maxsize`` results are kept, evicting the least recently used.
+    """
+
+    def __init__(self, ttl: float = 600.0, failure_ttl: float = 30.0, secret: Optional[str] = None, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.failure_ttl = failure_ttl
+        self._secret = secret.encode() if secret else secrets.token_bytes(32)
+        self._data: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, threading.Event] = {}
+
+    def key(self, api_key: str) -> str:
+        return hmac.new(self._secret, api_key.encode(), hashlib.sha256).hexdigest()
+
+    def _get_locked(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._data.get(key)
+        if entry is not None:
+            if entry[1] > time.time():
+                self._data.move_to_end(key)
+                return entry[0]
+            del self._data[key]
+        return None
+
+    def peek(self, api_key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached result without validating"""
+        with self._lock:
+            return self._get_locked(self.key(api_key))
+
+    def get_or_validate(self, api_key: str, validate: Callable[[], Tuple[Dict[str, Any], bool]]) -> Dict[str, Any]:
+        """Return a cached result or run ``validate``, which returns ``(result, definitive)``"""
+        key = self.key(api_key)
+        while True:
+            with self._lock:
+                value = self._get_locked(key)
+                if value is not None:
+                    return value
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    break
+            event.wait()
+            with self._lock:
+                value = self._get_locked(key)
+                if value is not None:
+                    return value
+
+        try:
+            value, definitive = validate()
+            if value.get('valid') or definitive:
+                ttl = self.ttl if value.get('valid') else self.failure_ttl
+                with self._lock:
+                    self._data[key] = (value, time.time() + ttl)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+def create_key_cache() -> KeyValidationCache:
+    """Build the validation cache from API_KEY_CACHE_TTL / API_KEY_FAILURE_TTL / API_KEY_CACHE_SECRET"""
+    return KeyValidationCache(
+        float(os.getenv("API_KEY_CACHE_TTL", "600")),
+        float(os.getenv("API_KEY_FAILURE_TTL", "30")),
+        os.getenv("API_KEY_CACHE_SECRET")
+    )
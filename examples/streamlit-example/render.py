@@ -0,0 +1,75 @@
+import os
+import time
+from typing import Any, Callable
+from stable_prefix import STABLE_FRAMES, StablePrefix
+
+# Repaints per second while a response is streaming; the final frame is always drawn
+RENDER_MAX_FPS = float(os.getenv("RENDER_MAX_FPS", "15"))
+
+class RenderScheduler:
+    """Coalesce streamed chunks and repaint a placeholder at most ``max_fps`` times per second.
+
+    Every repaint sends a websocket delta and re-renders the markdown, so
+    drawing each token or denoising frame costs server CPU without being
+    visible. ``update`` keeps only the latest text and draws it once the
+    frame interval has elapsed since the last repaint; ``finish`` draws the
+    final text immediately. Text held back is drawn with the next chunk, so
+    status lines shown before a slow call should pass ``force=True``.
+    """
+
+    def __init__(self, placeholder: Any, max_fps: float = RENDER_MAX_FPS, clock: Callable[[], float] = time.monotonic):
+        self.placeholder = placeholder
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.clock = clock
+        self.updates = 0
+        self.renders = 0
+        self._last_render = None
+
+    def update(self, text: str, suffix: str = "", force: bool = False):
+        """Show ``text`` (plus an in-progress marker) if a frame is due or ``force`` is set, otherwise skip it"""
+        self.updates += 1
+        now = self.clock()
+        if force or self._last_render is None or now - self._last_render >= self.interval:
+            self._last_render = now
+            self._render(text + suffix)
+
+    def finish(self, text: str):
+        """Draw the final text right away"""
+        self._last_render = self.clock()
+        self._render(text)
+
+    def _render(self, text: str):
+        self.renders += 1
+        self.placeholder.markdown(text)
+
+class DiffusionRenderer:
+    """Draw diffusion frames with the settled leading blocks rendered only once.
+
+    Committed blocks (see ``StablePrefix``) are appended to a container as
+    their own markdown elements and never repainted; only the tail after
+    them goes through a ``RenderScheduler``. ``finish`` replaces it all with
+    the final text as one element.
+    """
+
+    def __init__(self, placeholder: Any, frames: int = STABLE_FRAMES, max_fps: float = RENDER_MAX_FPS):
+        self.placeholder = placeholder
+        self.prefix = StablePrefix(frames)
+        area = placeholder.container()
+        self._committed_slot = area.empty()
+        self._committed = self._committed_slot.container()
+        self.tail = RenderScheduler(area.empty(), max_fps)
+        self.commits = 0
+
+    def update(self, frame: str, suffix: str = "", force: bool = False):
+        commit, reset = self.prefix.update(frame)
+        if reset:
+            # Replaces the committed elements with an empty container
+            self._committed = self._committed_slot.container()
+        if commit:
+            self.commits += 1
+            self._committed.markdown(commit)
+        # A commit moves text out of the tail, so the tail must be redrawn with it
+        self.tail.update(frame[len(self.prefix.committed):], suffix, force or reset or bool(commit))
+
+    def finish(self, text: str):
+        self.placeholder.markdown(text)
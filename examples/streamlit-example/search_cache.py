@@ -0,0 +1,166 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+from semantic_index import MinHashIndex
+
+def normalize_query(query: str) -> str:
+    """Case-fold, trim and collapse whitespace/trailing punctuation so trivially different queries share a key"""
+    return re.sub(r"\s+", " ", query).strip().strip("?!.").strip().lower()
+
+class SearchCache:
+    """Thread-safe TTL + LRU cache for web search results with optional SQLite persistence.
+
+    Streamlit runs each session's script in its own thread, so concurrent
+    lookups of the same key wait for one in-flight upstream call instead of
+    all hitting Tavily. Error results are never cached. With a ``semantic``
+    index, a query that misses exactly is served from the closest cached
+    query with the same depth and result count when their similarity clears
+    the index threshold.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 300.0, path: Optional[str] = None, semantic: Optional[MinHashIndex] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.semantic = semantic
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self.hits = 0
+        self.disk_hits = 0
+        self.semantic_hits = 0
+        self.near_misses = 0
+        self.semantic_similarity = 0.0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(query: str, max_results: int, search_depth: str) -> str:
+        return f"{search_depth}:{max_results}:{normalize_query(query)}"
+
+    def _get_locked(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is not None:
+            if entry[1] > time.time():
+                self._data.move_to_end(key)
+                return entry[0]
+            del self._data[key]
+        return None
+
+    def _set_locked(self, key: str, value: Any, expires_at: float):
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            evicted, _ = self._data.popitem(last=False)
+            self.evictions += 1
+            if self.semantic is not None:
+                self.semantic.remove(evicted)
+        if self.semantic is not None:
+            depth, max_results, query = key.split(":", 2)
+            self.semantic.add(key, f"{depth}:{max_results}", query)
+
+    def _semantic_get_locked(self, key: str) -> Optional[Any]:
+        """Cached results of the most similar query, if it clears the threshold and is still cached"""
+        depth, max_results, query = key.split(":", 2)
+        match_key, score = self.semantic.best_match(f"{depth}:{max_results}", query)
+        if match_key is None:
+            return None
+        if score < self.semantic.threshold:
+            # Close calls show whether the threshold is leaving hits on the table
+            if score >= self.semantic.threshold - 0.1:
+                self.near_misses += 1
+            return None
+        value = self._get_locked(match_key)
+        if value is None:
+            self.semantic.remove(match_key)
+            return None
+        self.semantic_hits += 1
+        self.semantic_similarity += score
+        return value
+
+    def _load(self, key: str) -> Optional[tuple]:
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM search_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _store(self, key: str, value: Any, expires_at: float):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        while True:
+            with self._lock:
+                value = self._get_locked(key)
+                if value is not None:
+                    self.hits += 1
+                    return value
+                if self.semantic is not None:
+                    value = self._semantic_get_locked(key)
+                    if value is not None:
+                        return value
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    break
+                self.coalesced += 1
+            # Another thread is fetching this key; wait for it and re-check the cache
+            event.wait()
+            with self._lock:
+                value = self._get_locked(key)
+                if value is not None:
+                    return value
+
+        try:
+            entry = self._load(key)
+            if entry is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._set_locked(key, entry[0], entry[1])
+                return entry[0]
+
+            with self._lock:
+                self.misses += 1
+            value = fetch()
+            if 'error' not in value:
+                expires_at = time.time() + self.ttl
+                with self._lock:
+                    self._set_locked(key, value, expires_at)
+                self._store(key, value, expires_at)
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.semantic_hits + self.misses + self.coalesced
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "semantic_hits": self.semantic_hits,
+                "near_misses": self.near_misses,
+                "avg_semantic_similarity": round(self.semantic_similarity / self.semantic_hits, 4) if self.semantic_hits else 0.0,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+            }
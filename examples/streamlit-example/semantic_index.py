@@ -0,0 +1,167 @@
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+# Words that change the wording of a search query but not what it is looking for
+STOPWORDS = frozenset(
+    "a an and are about at be by can could do does for from how i in is it me of on or please search "
+    "show tell than that the this to was what when where which who why will with you your find look up "
+    "s t today now latest".split()
+)
+
+_WORD_RE = re.compile(r"\w+")
+# Share of the similarity score from whole terms; the rest comes from character trigrams, which absorb typos and word forms
+TERM_WEIGHT = 0.3
+_PRIME = (1 << 61) - 1
+
+def _stem(word: str) -> str:
+    """Very light suffix stripping so plural/verb forms share shingles"""
+    for suffix in ("ies", "ing", "es", "ed", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+def query_terms(query: str) -> List[str]:
+    """Normalized, stemmed content words of a query, in order"""
+    words = [_stem(word) for word in _WORD_RE.findall(query.lower())]
+    terms = [word for word in words if word not in STOPWORDS]
+    return terms or words
+
+class QueryFeatures(NamedTuple):
+    terms: FrozenSet[str]
+    trigrams: FrozenSet[str]
+    numbers: FrozenSet[str]
+
+    @property
+    def shingles(self) -> FrozenSet[str]:
+        return self.terms | self.trigrams
+
+def query_features(query: str) -> QueryFeatures:
+    """Word-order-independent features: content terms, character trigrams of each term, and numbers"""
+    terms = query_terms(query)
+    trigrams: Set[str] = set()
+    for term in terms:
+        padded = f"#{term}#"
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return QueryFeatures(frozenset(terms), frozenset(trigrams), frozenset(term for term in terms if term.isdigit()))
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def _one_edit(a: str, b: str) -> bool:
+    """Whether ``a`` and ``b`` differ by one inserted, deleted, substituted or transposed character"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    # Same length: one substitution, or two adjacent characters swapped
+    return a[i + 1:] == b[i + 1:] or (a[i + 2:] == b[i + 2:] and a[i:i + 2] == b[i:i + 2][::-1])
+
+def _has_term(term: str, terms: FrozenSet[str]) -> bool:
+    if term in terms:
+        return True
+    # Typos only in longer words, so "india" / "indiana" or "tesla" / "tesly" stay distinct entities
+    return len(term) >= 6 and any(len(other) >= 6 and _one_edit(term, other) for other in terms)
+
+def same_terms(a: QueryFeatures, b: QueryFeatures) -> bool:
+    """Every content term of each query appears in the other, up to a one-character typo in long words"""
+    return all(_has_term(term, b.terms) for term in a.terms) and all(_has_term(term, a.terms) for term in b.terms)
+
+def similarity(a: QueryFeatures, b: QueryFeatures) -> float:
+    """Blend of term and trigram Jaccard; 0 unless both queries have the same content terms and numbers.
+
+    Shingle overlap alone matches different entities ("covid cases in India"
+    / "... in Indiana", "tesla news" / "tesla recall news"), whose cached
+    results would be wrong, so word order and stopwords may differ but no
+    content word may be added, dropped or replaced.
+    """
+    if a.numbers != b.numbers or not same_terms(a, b):
+        return 0.0
+    return TERM_WEIGHT * jaccard(a.terms, b.terms) + (1 - TERM_WEIGHT) * jaccard(a.trigrams, b.trigrams)
+
+def _hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+
+class MinHashIndex:
+    """Near-duplicate lookup for short texts with MinHash + LSH banding.
+
+    Each entry's shingle set is summarised by ``bands * rows`` min-hashes;
+    entries sharing any band are candidates, and candidates are then scored
+    exactly with ``similarity``. Lookups cost a few hash computations
+    regardless of the number of entries. Entries are grouped by ``scope``
+    (e.g. search depth and result count) and never match across scopes. At
+    most ``maxsize`` entries are kept (LRU).
+    """
+
+    def __init__(self, threshold: float = 0.6, bands: int = 16, rows: int = 4, maxsize: int = 4096, seed: int = 1):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.maxsize = maxsize
+        n = bands * rows
+        self._coefficients = [((seed * 7919 + i * 104729) % _PRIME or 1, (seed * 15485863 + i * 32452843) % _PRIME) for i in range(n)]
+        self._entries: "OrderedDict[str, Tuple[str, QueryFeatures, Tuple[int, ...]]]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[str]] = {}
+
+    def signature(self, features: FrozenSet[str]) -> Tuple[int, ...]:
+        hashes = [_hash(feature) for feature in features] or [0]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self._coefficients)
+
+    def _bands(self, scope: str, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield scope, band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def add(self, key: str, scope: str, text: str):
+        self.remove(key)
+        features = query_features(text)
+        signature = self.signature(features.shingles)
+        self._entries[key] = (scope, features, signature)
+        for bucket in self._bands(scope, signature):
+            self._buckets.setdefault(bucket, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self.remove(next(iter(self._entries)))
+
+    def remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        scope, _, signature = entry
+        for bucket in self._bands(scope, signature):
+            keys = self._buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bucket]
+
+    def best_match(self, scope: str, text: str) -> Tuple[Optional[str], float]:
+        """The most similar entry in ``scope`` and its similarity, whether or not it clears the threshold"""
+        features = query_features(text)
+        candidates: Set[str] = set()
+        for bucket in self._bands(scope, self.signature(features.shingles)):
+            candidates |= self._buckets.get(bucket, set())
+        best_key, best_score = None, 0.0
+        for key in candidates:
+            score = similarity(features, self._entries[key][1])
+            if score > best_score:
+                best_key, best_score = key, score
+        if best_key is not None:
+            self._entries.move_to_end(best_key)
+        return best_key, best_score
+
+    def lookup(self, scope: str, text: str) -> Optional[Tuple[str, float]]:
+        """Key and similarity of the closest entry at or above the threshold"""
+        key, score = self.best_match(scope, text)
+        if key is None or score < self.threshold:
+            return None
+        return key, score
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Any, Dict, Iterator, List, Optional
+
+# Diffusing mode with tools (opt-in): start the diffused answer while the tool-decision call runs.
+# Every such turn then makes two upstream calls
+SPECULATIVE_TOOL_CHECK = os.getenv("SPECULATIVE_TOOL_CHECK", "false").lower() == "true"
+
+class SpeculationStats:
+    """Thread-safe counters of how often the speculative diffused answer was kept, and what that saved"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.kept = 0
+        self.cancelled = 0
+        self.latency_saved = 0.0
+
+    def record(self, kept: bool, latency_saved: float = 0.0):
+        with self._lock:
+            self.attempts += 1
+            if kept:
+                self.kept += 1
+                self.latency_saved += latency_saved
+            else:
+                self.cancelled += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "kept": self.kept,
+                "cancelled": self.cancelled,
+                "win_rate": self.kept / self.attempts if self.attempts else 0.0,
+                "latency_saved_seconds": round(self.latency_saved, 3),
+                "avg_latency_saved_seconds": round(self.latency_saved / self.kept, 3) if self.kept else 0.0,
+            }
+
+class SpeculativeGeneration:
+    """Relay diffused frames while the tool-decision call runs in another thread.
+
+    Frames are passed through as they arrive. If ``check`` resolves without
+    tool calls the generation continues and the time both calls overlapped
+    is counted as latency saved; if it asks for tools the generation is
+    closed (closing its upstream response) and ``stream`` ends with
+    ``tool_calls`` set. The check is looked at between frames, and once more
+    after the last one.
+    """
+
+    def __init__(self, generation: Iterator[str], check: "Future", stats: SpeculationStats):
+        self.generation = generation
+        self.check = check
+        self.stats = stats
+        self.assistant_response = ""
+        self.tool_calls: List[Dict] = []
+        self._decided = False
+        self._generation_done: Optional[float] = None
+
+    def stream(self) -> Iterator[str]:
+        started = time.monotonic()
+        try:
+            for frame in self.generation:
+                if not self._decided and self.check.done() and self._decide(started):
+                    return
+                yield frame
+            self._generation_done = time.monotonic()
+            if not self._decided:
+                wait([self.check])
+                self._decide(started)
+        finally:
+            self.generation.close()
+
+    def _decide(self, started: float) -> bool:
+        """Record the check's outcome; True when tools are needed and the generation must be dropped"""
+        self._decided = True
+        try:
+            self.assistant_response, self.tool_calls = self.check.result()
+        except Exception:
+            self.assistant_response, self.tool_calls = "", []
+        if self.tool_calls:
+            self.stats.record(False)
+            return True
+        overlap_end = min(time.monotonic(), self._generation_done or time.monotonic())
+        self.stats.record(True, overlap_end - started)
+        return False
@@ -1,8 +1,31 @@
 import streamlit as st
 import requests
 import json
-import time
-from typing import Generator, Dict, Any
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from typing import Generator, Dict, Any, Tuple
+from context import fit_messages, summarize_with_inception
+from http_session import PooledSession, create_session
+from key_cache import KeyValidationCache, create_key_cache
+from render import DiffusionRenderer, RenderScheduler
+from search_cache import SearchCache
+from semantic_index import MinHashIndex
+from speculation import SPECULATIVE_TOOL_CHECK, SpeculationStats, SpeculativeGeneration
+from sse_parser import iter_chunks, merge_tool_call_deltas
+
+# Deadline for a single tool call and for all tool calls of one model turn
+TOOL_CALL_TIMEOUT = 15
+TOOL_TURN_TIMEOUT = 30
+MAX_TOOL_WORKERS = 4
+
+# Web search result cache, shared by all sessions of this server
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH")
+# Serve near-duplicate queries from the cache (opt-in) when they have the same content words
+# and their similarity clears the threshold
+SEMANTIC_SEARCH_CACHE = os.getenv("SEMANTIC_SEARCH_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.6"))
 
 st.set_page_config(
     page_title="AI Chat with Tools",
@@ -22,16 +45,40 @@ if "api_key_valid" not in st.session_state:
     st.session_state.api_key_valid = None
 if "validating" not in st.session_state:
     st.session_state.validating = False
+if "context_tokens" not in st.session_state:
+    st.session_state.context_tokens = 6000
+if "summarize_history" not in st.session_state:
+    st.session_state.summarize_history = True
+if "summary_cache" not in st.session_state:
+    st.session_state.summary_cache = {}
 if "tools_enabled" not in st.session_state:
     st.session_state.tools_enabled = False
 
+@st.cache_resource
+def get_http_session() -> PooledSession:
+    """Process-wide keep-alive session so Inception and Tavily calls reuse open connections across reruns"""
+    return create_session()
+
+@st.cache_resource
+def get_speculation_stats() -> SpeculationStats:
+    """Process-wide counters for speculative diffusing with tools"""
+    return SpeculationStats()
+
+@st.cache_resource
+def get_key_cache() -> KeyValidationCache:
+    """Process-wide validation cache so reruns and repeated keys skip the paid upstream check"""
+    return create_key_cache()
+
 def validate_api_key(api_key: str) -> dict:
-    """Validate the API key by making an actual API request"""
+    """Validate the API key, reusing a recent result for the same key"""
     if not api_key or len(api_key.strip()) < 10:
         return {"valid": False, "error": "API key is too short"}
-    
+    return get_key_cache().get_or_validate(api_key, lambda: check_api_key(api_key))
+
+def check_api_key(api_key: str) -> Tuple[dict, bool]:
+    """Validate the API key by making an actual API request; the flag says whether a failure is definitive"""
     try:
-        response = requests.post(
+        response = get_http_session().post(
             'https://api.inceptionlabs.ai/v1/chat/completions',
             headers={
                 'Content-Type': 'application/json',
@@ -46,26 +93,41 @@ def validate_api_key(api_key: str) -> dict:
         )
         
         if response.status_code == 200:
-            return {"valid": True, "error": None}
+            return {"valid": True, "error": None}, True
         else:
             try:
                 error_data = response.json()
                 error_msg = error_data.get("error", f"API request failed with status {response.status_code}")
             except:
                 error_msg = f"API request failed with status {response.status_code}"
-            return {"valid": False, "error": error_msg}
+            # Rate limits and server errors say nothing about the key itself
+            definitive = 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+            return {"valid": False, "error": error_msg}, definitive
             
     except requests.exceptions.Timeout:
-        return {"valid": False, "error": "Request timed out"}
+        return {"valid": False, "error": "Request timed out"}, False
     except requests.exceptions.RequestException as e:
-        return {"valid": False, "error": f"Network error: {str(e)}"}
+        return {"valid": False, "error": f"Network error: {str(e)}"}, False
     except Exception as e:
-        return {"valid": False, "error": f"Unexpected error: {str(e)}"}
+        return {"valid": False, "error": f"Unexpected error: {str(e)}"}, False
 
-def search_web(query: str, api_key: str, max_results: int = 3) -> Dict[str, Any]:
+@st.cache_resource
+def get_search_cache() -> SearchCache:
+    """Process-wide search cache so repeated queries across reruns and sessions skip Tavily"""
+    semantic_index = MinHashIndex(SEMANTIC_CACHE_THRESHOLD, maxsize=SEARCH_CACHE_SIZE) if SEMANTIC_SEARCH_CACHE else None
+    return SearchCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_PATH, semantic_index)
+
+def search_web(query: str, api_key: str, max_results: int = 3, timeout: float = TOOL_CALL_TIMEOUT) -> Dict[str, Any]:
+    """Search the web using Tavily API, serving repeated queries from the cache"""
+    return get_search_cache().get_or_fetch(
+        SearchCache.key(query, max_results, 'basic'),
+        lambda: fetch_search_results(query, api_key, max_results, timeout)
+    )
+
+def fetch_search_results(query: str, api_key: str, max_results: int = 3, timeout: float = TOOL_CALL_TIMEOUT) -> Dict[str, Any]:
     """Search the web using Tavily API"""
     try:
-        response = requests.post(
+        response = get_http_session().post(
             'https://api.tavily.com/search',
             headers={'Content-Type': 'application/json'},
             json={
@@ -76,7 +138,7 @@ def search_web(query: str, api_key: str, max_results: int = 3) -> Dict[str, Any]
                 'max_results': max_results,
                 'include_raw_content': False
             },
-            timeout=15
+            timeout=timeout
         )
         
         if response.status_code == 200:
@@ -101,6 +163,39 @@ def search_web(query: str, api_key: str, max_results: int = 3) -> Dict[str, Any]
     except Exception as e:
         return {"error": f"Search error: {str(e)}"}
 
+def run_tool_call(tool_call: dict, tavily_api_key: str) -> Tuple[str, Dict[str, Any]]:
+    """Execute one tool call, returning (query, result)"""
+    function_name = tool_call["function"]["name"]
+    if function_name != "web_search":
+        return "", {"error": f"Unknown tool: {function_name}"}
+    try:
+        function_args = json.loads(tool_call["function"]["arguments"] or "{}")
+    except json.JSONDecodeError as e:
+        return "", {"error": f"Error parsing arguments: {e}"}
+    query = function_args.get('query', '')
+    return query, search_web(query, tavily_api_key, function_args.get('max_results', 3))
+
+def execute_tool_calls(tool_calls: list, tavily_api_key: str, turn_timeout: float = TOOL_TURN_TIMEOUT) -> Generator[Tuple[int, str, Dict[str, Any]], None, None]:
+    """Run all tool calls of one model turn in a bounded thread pool.
+
+    Yields (index, query, result) as each call completes; calls still
+    running when the turn deadline expires are reported as timed out.
+    """
+    executor = ThreadPoolExecutor(max_workers=min(MAX_TOOL_WORKERS, max(1, len(tool_calls))))
+    futures = {executor.submit(run_tool_call, tool_call, tavily_api_key): index for index, tool_call in enumerate(tool_calls)}
+    finished = set()
+    try:
+        for future in as_completed(futures, timeout=turn_timeout):
+            finished.add(futures[future])
+            query, result = future.result()
+            yield futures[future], query, result
+    except FuturesTimeoutError:
+        for index in range(len(tool_calls)):
+            if index not in finished:
+                yield index, "", {"error": f"Search timed out after {turn_timeout:g}s"}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
 def get_tools():
     """Get tools definition"""
     return [{
@@ -131,7 +226,7 @@ def get_tool_calls_without_diffusing(messages: list, api_key: str) -> tuple:
             "tools": get_tools()
         }
         
-        response = requests.post(
+        with get_http_session().post(
             'https://api.inceptionlabs.ai/v1/chat/completions',
             headers={
                 'Content-Type': 'application/json',
@@ -139,58 +234,27 @@ def get_tool_calls_without_diffusing(messages: list, api_key: str) -> tuple:
             },
             json=payload,
             stream=True
-        )
-        
-        if response.status_code != 200:
-            return f"Error: API request failed with status {response.status_code}", []
+        ) as response:
+            if response.status_code != 200:
+                return f"Error: API request failed with status {response.status_code}", []
         
-        full_response = ""
-        tool_calls = []
+            full_response = ""
+            tool_calls = []
         
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    data_str = line[6:]
-                    if data_str.strip() == '[DONE]':
-                        break
-                    if data_str.startswith('{'):
-                        try:
-                            data = json.loads(data_str)
-                            choice = data.get("choices", [{}])[0]
-                            delta = choice.get("delta", {})
-                            
-                            # Handle content
-                            if "content" in delta and delta["content"]:
-                                content = delta["content"]
-                                full_response += content
-                            
-                            # Handle tool calls
-                            if "tool_calls" in delta and delta["tool_calls"]:
-                                for tool_call in delta["tool_calls"]:
-                                    index = tool_call.get("index", 0)
-                                    
-                                    while len(tool_calls) <= index:
-                                        tool_calls.append({
-                                            "id": "",
-                                            "type": "function",
-                                            "function": {"name": "", "arguments": ""}
-                                        })
-                                    
-                                    if "id" in tool_call:
-                                        tool_calls[index]["id"] = tool_call["id"]
-                                    
-                                    if "function" in tool_call:
-                                        func = tool_call["function"]
-                                        if "name" in func:
-                                            tool_calls[index]["function"]["name"] = func["name"]
-                                        if "arguments" in func:
-                                            tool_calls[index]["function"]["arguments"] += func["arguments"]
-                                            
-                        except json.JSONDecodeError:
-                            continue
+            for chunk in iter_chunks(response.iter_content(chunk_size=None)):
+                if chunk.done:
+                    break
+            
+                # Handle content
+                content = chunk.delta.get("content")
+                if content:
+                    full_response += content
+            
+                # Handle tool calls
+                if chunk.delta.get("tool_calls"):
+                    merge_tool_call_deltas(tool_calls, chunk.delta["tool_calls"])
         
-        return full_response, tool_calls
+            return full_response, tool_calls
         
     except Exception as e:
         return f"Error: {str(e)}", []
@@ -207,7 +271,7 @@ def get_final_response_with_diffusing(messages: list, api_key: str) -> Generator
             # No tools - just final response
         }
         
-        response = requests.post(
+        with get_http_session().post(
             'https://api.inceptionlabs.ai/v1/chat/completions',
             headers={
                 'Content-Type': 'application/json',
@@ -215,37 +279,30 @@ def get_final_response_with_diffusing(messages: list, api_key: str) -> Generator
             },
             json=payload,
             stream=True
-        )
-        
-        if response.status_code != 200:
-            yield f"Error: API request failed with status {response.status_code}"
-            return
+        ) as response:
+            if response.status_code != 200:
+                yield f"Error: API request failed with status {response.status_code}"
+                return
         
-        current_content = ""
+            current_content = ""
         
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    data_str = line[6:]
-                    if data_str.strip() == '[DONE]':
-                        break
-                    if data_str.startswith('{'):
-                        try:
-                            data = json.loads(data_str)
-                            choice = data.get("choices", [{}])[0]
-                            delta = choice.get("delta", {})
-                            
-                            if "content" in delta and delta["content"] is not None:
-                                current_content = delta["content"]
-                                yield current_content
-                                
-                        except json.JSONDecodeError:
-                            continue
+            for chunk in iter_chunks(response.iter_content(chunk_size=None)):
+                if chunk.done:
+                    break
+            
+                # Unchanged denoising steps would only trigger a redundant re-render
+                content = chunk.delta.get("content")
+                if content is not None and content != current_content:
+                    current_content = content
+                    yield current_content
                             
     except Exception as e:
         yield f"Error: {str(e)}"
 
+def is_status_update(text: str) -> bool:
+    """Progress lines ("Searching...", "Step 2: ...") come right before slow tool calls, so they are drawn at once"""
+    return text.endswith("**\n\n")
+
 def stream_response_with_tools(messages: list, api_key: str, tools_enabled: bool) -> Generator[str, None, None]:
     """Stream response with optional tools"""
     try:
@@ -259,7 +316,7 @@ def stream_response_with_tools(messages: list, api_key: str, tools_enabled: bool
         if tools_enabled and st.session_state.tavily_api_key:
             request_data['tools'] = get_tools()
         
-        response = requests.post(
+        with get_http_session().post(
             'https://api.inceptionlabs.ai/v1/chat/completions',
             headers={
                 'Content-Type': 'application/json',
@@ -267,81 +324,56 @@ def stream_response_with_tools(messages: list, api_key: str, tools_enabled: bool
             },
             json=request_data,
             stream=True
-        )
-        
-        if response.status_code != 200:
-            yield f"Error: API request failed with status {response.status_code}"
-            return
+        ) as response:
+            if response.status_code != 200:
+                yield f"Error: API request failed with status {response.status_code}"
+                return
 
-        accumulated_content = ""
-        tool_calls_data = []
+            accumulated_content = ""
+            tool_calls_data = []
         
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    data_str = line[6:]  
-                    if data_str.strip() == '[DONE]':
-                        break
-                    if data_str.startswith('{'):
-                        try:
-                            data = json.loads(data_str)
-                            if 'choices' in data and len(data['choices']) > 0:
-                                choice = data['choices'][0]
-                                delta = choice.get('delta', {})
-                                
-                                # Handle regular content
-                                content = delta.get('content', '')
-                                if content:
-                                    accumulated_content += content
-                                    yield accumulated_content
-                                
-                                # Handle tool calls - Check if tool_calls is not None
-                                tool_calls = delta.get('tool_calls')
-                                if tool_calls is not None:
-                                    for tool_call in tool_calls:
-                                        idx = tool_call.get('index', 0)
-                                        
-                                        while len(tool_calls_data) <= idx:
-                                            tool_calls_data.append({'function': {'name': '', 'arguments': ''}})
-                                        
-                                        if 'function' in tool_call:
-                                            if 'name' in tool_call['function']:
-                                                tool_calls_data[idx]['function']['name'] = tool_call['function']['name']
-                                            if 'arguments' in tool_call['function']:
-                                                tool_calls_data[idx]['function']['arguments'] += tool_call['function']['arguments']
-                                
-                                finish_reason = choice.get('finish_reason')
-                                if finish_reason == 'tool_calls' and tool_calls_data:
-                                    for tool_call in tool_calls_data:
-                                        if tool_call['function']['name'] == 'web_search':
-                                            try:
-                                                args = json.loads(tool_call['function']['arguments'])
-                                                query = args.get('query', '')
-                                                if query and st.session_state.tavily_api_key:
-                                                    yield accumulated_content + "\n\n🔍 **Searching...**\n\n"
-                                                    search_result = search_web(query, st.session_state.tavily_api_key)
-                                                    
-                                                    if 'error' not in search_result:
-                                                        result_text = f"**Search Results for: {query}**\n\n"
-                                                        if search_result.get('answer'):
-                                                            result_text += f"**Quick Answer:** {search_result['answer']}\n\n"
-                                                        if search_result.get('results'):
-                                                            result_text += "**Sources:**\n"
-                                                            for i, item in enumerate(search_result['results'][:3], 1):
-                                                                title = item.get('title', 'No title')
-                                                                content = item.get('content', '')[:150] + "..." if len(item.get('content', '')) > 150 else item.get('content', '')
-                                                                url = item.get('url', '')
-                                                                result_text += f"{i}. **{title}**\n   {content}\n   🔗 {url}\n\n"
-                                                        yield accumulated_content + f"\n\n{result_text}"
-                                                    else:
-                                                        yield accumulated_content + f"\n\n❌ {search_result['error']}\n\n"
-                                            except:
-                                                yield accumulated_content + "\n\n❌ **Search failed**\n\n"
-                                    return
-                                        
-                        except json.JSONDecodeError:
-                            continue
+            for chunk in iter_chunks(response.iter_content(chunk_size=None)):
+                if chunk.done:
+                    break
+            
+                # Handle regular content
+                content = chunk.delta.get('content')
+                if content:
+                    accumulated_content += content
+                    yield accumulated_content
+            
+                # Handle tool calls
+                if chunk.delta.get('tool_calls'):
+                    merge_tool_call_deltas(tool_calls_data, chunk.delta['tool_calls'])
+            
+                if chunk.finish_reason == 'tool_calls' and tool_calls_data:
+                    if not st.session_state.tavily_api_key:
+                        return
+                    yield accumulated_content + "\n\n🔍 **Searching...**\n\n"
+                
+                    # All searches run concurrently; each result is shown as soon as it arrives
+                    sections = {}
+                    for index, query, search_result in execute_tool_calls(tool_calls_data, st.session_state.tavily_api_key):
+                        if 'error' not in search_result:
+                            result_text = f"**Search Results for: {query}**\n\n"
+                            if search_result.get('answer'):
+                                result_text += f"**Quick Answer:** {search_result['answer']}\n\n"
+                            if search_result.get('results'):
+                                result_text += "**Sources:**\n"
+                                for i, item in enumerate(search_result['results'][:3], 1):
+                                    title = item.get('title', 'No title')
+                                    content = item.get('content', '')[:150] + "..." if len(item.get('content', '')) > 150 else item.get('content', '')
+                                    url = item.get('url', '')
+                                    result_text += f"{i}. **{title}**\n   {content}\n   🔗 {url}\n\n"
+                            sections[index] = result_text
+                        else:
+                            sections[index] = f"❌ {search_result['error']}\n\n"
+                    
+                        response_text = accumulated_content + "\n\n" + "".join(sections[i] for i in sorted(sections))
+                        if len(sections) < len(tool_calls_data):
+                            response_text += "🔍 **Searching...**\n\n"
+                        yield response_text
+                    return
                             
     except Exception as e:
         yield f"Error: {str(e)}"
@@ -350,9 +382,23 @@ def diffuse_response_with_tools(messages: list, api_key: str, tools_enabled: boo
     """NEW: Two-step diffusing with tools using your approach"""
     try:
         if tools_enabled and st.session_state.tavily_api_key:
-            yield "🔧 **Step 1: Checking if tools are needed...**\n\n"
-            
-            assistant_response, tool_calls = get_tool_calls_without_diffusing(messages, api_key)
+            if SPECULATIVE_TOOL_CHECK:
+                # Start the diffused answer right away and decide on tools alongside it
+                executor = ThreadPoolExecutor(max_workers=1)
+                try:
+                    speculation = SpeculativeGeneration(
+                        get_final_response_with_diffusing(messages, api_key),
+                        executor.submit(get_tool_calls_without_diffusing, messages, api_key),
+                        get_speculation_stats()
+                    )
+                    yield from speculation.stream()
+                finally:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                assistant_response, tool_calls = speculation.assistant_response, speculation.tool_calls
+            else:
+                yield "🔧 **Step 1: Checking if tools are needed...**\n\n"
+                
+                assistant_response, tool_calls = get_tool_calls_without_diffusing(messages, api_key)
             
             if tool_calls:
                 yield f"🔍 **Found {len(tool_calls)} tool call(s). Executing...**\n\n"
@@ -365,55 +411,47 @@ def diffuse_response_with_tools(messages: list, api_key: str, tools_enabled: boo
                     "tool_calls": tool_calls
                 })
                 
+                queries = []
                 for tool_call in tool_calls:
-                    function_name = tool_call["function"]["name"]
-                    arguments = tool_call["function"]["arguments"]
-                    
-                    if function_name == "web_search":
-                        try:
-                            function_args = json.loads(arguments)
-                            query = function_args.get('query', '')
-                            max_results = function_args.get('max_results', 3)
-                            
-                            yield f"🔍 **Searching for: {query}**\n\n"
-                            
-                            search_result = search_web(query, st.session_state.tavily_api_key, max_results)
-                            
-                            final_messages.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call["id"],
-                                "name": function_name,
-                                "content": json.dumps(search_result)
-                            })
-                            
-                            if 'error' not in search_result:
-                                yield "✅ **Search completed! Getting final response with diffusing...**\n\n"
-                            else:
-                                yield f"❌ **Search failed: {search_result['error']}**\n\n"
-                                
-                        except json.JSONDecodeError as e:
-                            yield f"❌ **Error parsing arguments: {e}**\n\n"
-                            return
-                        except Exception as e:
-                            yield f"❌ **Error executing function: {e}**\n\n"
-                            return
+                    try:
+                        queries.append(json.loads(tool_call["function"]["arguments"]).get('query', ''))
+                    except json.JSONDecodeError:
+                        continue
+                yield f"🔍 **Searching for: {', '.join(queries)}**\n\n"
+                
+                # Run all searches concurrently, reporting each as it completes
+                tool_results = {}
+                for index, query, search_result in execute_tool_calls(tool_calls, st.session_state.tavily_api_key):
+                    tool_results[index] = search_result
+                    if 'error' not in search_result:
+                        yield f"✅ **Search completed for: {query}** ({len(tool_results)}/{len(tool_calls)})\n\n"
+                    else:
+                        yield f"❌ **Search failed: {search_result['error']}** ({len(tool_results)}/{len(tool_calls)})\n\n"
+                
+                for index, tool_call in enumerate(tool_calls):
+                    final_messages.append({
+                        "role": "tool",
+                        "tool_call_id": tool_call["id"],
+                        "name": tool_call["function"]["name"],
+                        "content": json.dumps(tool_results[index])
+                    })
+                
+                sources = [result for index in sorted(tool_results) if 'error' not in tool_results[index] for result in tool_results[index].get('results', [])[:3]]
+                search_summary = "🔍 **Search completed!**\n\n"
+                for i, result in enumerate(sources, 1):
+                    title = result.get('title', 'No title')
+                    content = result.get('content', '')[:150] + "..." if len(result.get('content', '')) > 150 else result.get('content', '')
+                    url = result.get('url', '')
+                    search_summary += f"{i}. **{title}**\n   {content}\n   🔗 {url}\n\n"
                 
                 yield "✨ **Step 2: Generating diffused response...**\n\n"
                 
                 final_content = ""
                 for chunk in get_final_response_with_diffusing(final_messages, api_key):
                     final_content = chunk
-                    complete_response = "🔍 **Search completed!**\n\n"
-                    for i, result in enumerate(search_result.get('results', [])[:3], 1):
-                        title = result.get('title', 'No title')
-                        content = result.get('content', '')[:150] + "..." if len(result.get('content', '')) > 150 else result.get('content', '')
-                        url = result.get('url', '')
-                        complete_response += f"{i}. **{title}**\n   {content}\n   🔗 {url}\n\n"
-                    
-                    complete_response += f"**AI Response:**\n\n{final_content}"
-                    yield complete_response
+                    yield search_summary + f"**AI Response:**\n\n{final_content}"
                 
-            else:
+            elif not SPECULATIVE_TOOL_CHECK:
                 yield "ℹ️ **No tools needed. Getting direct response with diffusing...**\n\n"
                 for chunk in get_final_response_with_diffusing(messages, api_key):
                     yield chunk
@@ -439,7 +477,9 @@ with st.sidebar:
     
     if api_key != st.session_state.api_key:
         st.session_state.api_key = api_key
-        st.session_state.api_key_valid = None
+        cached_result = get_key_cache().peek(api_key) if api_key else None
+        st.session_state.api_key_valid = cached_result["valid"] if cached_result else None
+        st.session_state.validation_error = cached_result["error"] if cached_result else None
     
     tavily_api_key = st.text_input(
         "Tavily API Key (for web search)",
@@ -493,8 +533,34 @@ with st.sidebar:
     else:
         st.warning("🔍 No Tavily key - web search disabled")
     
+    cache_stats = get_search_cache().stats()
+    if cache_stats["hits"] + cache_stats["disk_hits"] + cache_stats["semantic_hits"] + cache_stats["misses"] + cache_stats["coalesced"]:
+        st.caption(f"🗄️ Search cache: {cache_stats['size']} entries, {cache_stats['hit_rate']:.0%} hit rate ({cache_stats['semantic_hits']} near-duplicate)")
+    speculation_stats = get_speculation_stats().stats()
+    if speculation_stats["attempts"]:
+        st.caption(f"⚡ Speculative diffusing kept {speculation_stats['win_rate']:.0%} of the time, saving {speculation_stats['avg_latency_saved_seconds']:.1f}s on average")
+    pool_stats = get_http_session().pool_stats()
+    if pool_stats:
+        st.caption("🔌 Connection reuse: " + ", ".join(f"{host} {stats['reuse_rate']:.0%} of {stats['requests']}" for host, stats in pool_stats.items()))
+    
     st.divider()
     
+    st.subheader("🧠 Context")
+    context_tokens = st.slider(
+        "Context Budget (tokens)",
+        min_value=500,
+        max_value=32000,
+        value=st.session_state.context_tokens,
+        step=500,
+        help="Older messages are dropped (or summarized) to keep the prompt within this budget"
+    )
+    st.session_state.context_tokens = context_tokens
+    st.session_state.summarize_history = st.checkbox(
+        "Summarize older messages",
+        value=st.session_state.summarize_history,
+        help="Replace messages that no longer fit with a rolling summary instead of dropping them"
+    )
+    
     st.subheader("🔄 Chat Mode")
     mode = st.radio(
         "Select mode:",
@@ -510,6 +576,7 @@ with st.sidebar:
     
     if st.button("🗑️ Clear Chat", use_container_width=True):
         st.session_state.messages = []
+        st.session_state.summary_cache = {}
         st.rerun()
 
 tools_status = " + Web Search" if st.session_state.tools_enabled else ""
@@ -530,23 +597,31 @@ if prompt := st.chat_input("Type your message here...", disabled=not (st.session
     
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
-        api_messages = [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
+        summarize = (lambda previous, messages: summarize_with_inception(st.session_state.api_key, previous, messages, get_http_session())) if st.session_state.summarize_history else None
+        api_messages = fit_messages(
+            [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages],
+            st.session_state.context_tokens,
+            summarize,
+            st.session_state.summary_cache
+        )
         
         try:
             if st.session_state.chat_mode == "streaming":
                 full_response = ""
+                renderer = RenderScheduler(message_placeholder)
                 for chunk in stream_response_with_tools(api_messages, st.session_state.api_key, st.session_state.tools_enabled):
                     full_response = chunk
-                    message_placeholder.markdown(full_response + "▌")
-                message_placeholder.markdown(full_response)
+                    renderer.update(full_response, "▌", force=is_status_update(chunk))
+                renderer.finish(full_response)
             else:
                 with st.spinner("🔄 Diffusing response..."):
                     current_response = ""
+                    # Leading blocks that stop changing are drawn once; only the rest is repainted
+                    renderer = DiffusionRenderer(message_placeholder)
                     for chunk in diffuse_response_with_tools(api_messages, st.session_state.api_key, st.session_state.tools_enabled):
                         current_response = chunk
-                        message_placeholder.markdown(current_response + " ✨")
-                        time.sleep(0.02) 
-                    message_placeholder.markdown(current_response)
+                        renderer.update(current_response, " ✨", force=is_status_update(chunk))
+                    renderer.finish(current_response)
                     full_response = current_response
             
             st.session_state.messages.append({"role": "assistant", "content": full_response})